@@ -7,4 +7,8 @@ python manage.py collectstatic --no-input
 
 DJANGO_SUPERUSER_PASSWORD=$SUPER_USER_PASSWORD python manage.py createsuperuser --username $SUPER_USER_NAME --email $SUPER_USER_EMAIL --noinput
 
-gunicorn paymaster.wsgi:application --bind 0.0.0.0:8001
\ No newline at end of file
+if [ "$asyncRPC" = "True" ]; then
+  gunicorn paymaster.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8001
+else
+  gunicorn paymaster.wsgi:application --bind 0.0.0.0:8001
+fi
\ No newline at end of file
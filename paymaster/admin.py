@@ -1,46 +1,150 @@
-from .models import Operation
-from typing import Tuple
+from .models import Operation, SenderListEntry
+import re
+from typing import Optional, Tuple
 from django.contrib import admin
-from django.core.exceptions import ValidationError
-from django.db.models import QuerySet
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, QuerySet
 from django.http import HttpRequest
+from django.utils.functional import cached_property
+
+ADDRESS_RE = re.compile(r"^0x[0-9a-fA-F]{40}$")
+HASH_RE = re.compile(r"^0x[0-9a-fA-F]{64}$")
+NUMBER_RE = re.compile(r"^(?:[0-9]{1,78}|0x[0-9a-fA-F]{1,64})$")
+
+# Query string parameter holding the last primary key of the previous page
+CURSOR_VAR = "after"
 
 
 class BinarySearchAdmin(admin.ModelAdmin):
     """
-    Search inside binary fields, like EthereumAddressV2Field or Keccack256Field
+    Search inside binary fields, like EthereumAddressV2Field or Keccack256Field.
+    The shape of the search term selects a single exact lookup, so it can use the field index:
+    addresses go to `address_search_field`, 32 byte hashes to `hash_search_field` and numbers
+    (decimal or 0x prefixed) to `number_search_field`. Other terms use `search_fields`
     """
 
+    address_search_field: Optional[str] = None
+    hash_search_field: Optional[str] = None
+    number_search_field: Optional[str] = None
+
     def get_search_results(
         self, request: HttpRequest, queryset: QuerySet, search_term: str
     ) -> Tuple[QuerySet, bool]:
-        queryset, may_have_duplicates = super().get_search_results(
-            request, queryset, search_term
+        term = search_term.strip()
+        if self.address_search_field and ADDRESS_RE.match(term):
+            return queryset.filter(**{self.address_search_field: term}), False
+        elif self.hash_search_field and HASH_RE.match(term):
+            return queryset.filter(**{self.hash_search_field: term}), False
+        elif self.number_search_field and NUMBER_RE.match(term):
+            # `int(term, 0)` refuses decimals with leading zeros
+            number = int(term[2:], 16) if term.startswith("0x") else int(term, 10)
+            return queryset.filter(**{self.number_search_field: number}), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Avoids `COUNT(*)` over the whole table. Unfiltered querysets are counted with the planner
+    estimate on PostgreSQL and with the highest primary key elsewhere. Filtered querysets are
+    only indexed exact matches (see `BinarySearchAdmin`), so those are counted
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if queryset.query.where:
+            return queryset.count()
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+        return queryset.aggregate(last=Max("pk"))["last"] or 0
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages by primary key (`?after=<pk>`) instead of `OFFSET`, so deep pages cost the same as
+    the first one. Only used when the list is ordered by primary key, other orderings are
+    paginated by Django
+    """
+
+    keyset = False
+    first_page_url = None
+    next_page_url = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        key = self.lookup_opts.pk.attname
+        ordering = tuple(dict.fromkeys(self.queryset.query.order_by))
+        if ordering not in (("-" + key,), (key,)) or self.show_all:
+            return super().get_results(request)
+
+        self.keyset = True
+        queryset = self.queryset
+        cursor = request.GET.get(CURSOR_VAR)
+        if cursor:
+            try:
+                lookup = "pk__lt" if ordering[0].startswith("-") else "pk__gt"
+                queryset = queryset.filter(**{lookup: int(cursor)})
+            except ValueError:
+                raise IncorrectLookupParameters
+        result_list = list(queryset[: self.list_per_page + 1])
+        has_next = len(result_list) > self.list_per_page
+        result_list = result_list[: self.list_per_page]
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_next or bool(cursor)
+        self.paginator = paginator
+        self.first_page_url = (
+            self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR]) if cursor else None
+        )
+        self.next_page_url = (
+            self.get_query_string({CURSOR_VAR: result_list[-1].pk}, [PAGE_VAR])
+            if has_next
+            else None
         )
-        if search_term:
-            for search_field in self.get_search_fields(request):
-                try:
-                    if search_field.startswith("="):
-                        may_have_duplicates = True
-                        queryset |= self.model.objects.filter(
-                            **{search_field[1:]: search_term}
-                        )
-                    elif search_field.endswith("__icontains"):
-                        may_have_duplicates = True
-                        queryset |= self.model.objects.filter(
-                            **{
-                                search_field.replace("__icontains", "__contains"): [
-                                    search_term
-                                ]
-                            }
-                        )
-                except (ValidationError, ValueError):
-                    pass
-        return queryset, may_have_duplicates
 
 
 class OperationsAdmin(BinarySearchAdmin):
-    list_display = (['sender', 'nonce', 'status'])
+    list_display = (['sender', 'nonce', 'chainId', 'status'])
+    search_fields = ['=status']
+    address_search_field = 'sender'
+    hash_search_field = 'hash'
+    number_search_field = 'nonce'
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class SenderListEntryAdmin(BinarySearchAdmin):
+    list_display = ['address', 'list', 'chainId', 'enabled', 'note', 'updated']
+    list_filter = ['list', 'enabled', 'chainId']
+    search_fields = ['note']
+    address_search_field = 'address'
+    ordering = ['-id']
 
 
 admin.site.register(Operation, OperationsAdmin)
+admin.site.register(SenderListEntry, SenderListEntryAdmin)
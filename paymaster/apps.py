@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class PaymasterConfig(AppConfig):
+    name = "paymaster"
+
+    def ready(self):
+        # Connects the token registry, sender lists and sqlite connection signals
+        from . import db, sender_lists, token_registry  # noqa: F401
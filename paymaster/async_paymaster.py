@@ -0,0 +1,150 @@
+"""
+Asyncio version of the paymaster JSON-RPC endpoint, served by the ASGI application.
+
+Node and price source I/O is awaited with `AsyncWeb3` and `aiohttp`, and independent lookups
+run concurrently. Hashing and signing are shared with the sync endpoint and run in the
+default executor.
+"""
+import asyncio
+
+from .paymaster import (
+    VALID_FOR,
+    _budget_error,
+    _build_approved_tokens,
+    _cap_error,
+    _decode_operation,
+    _funds_error,
+    _gas_error,
+    _get_cached_approved_tokens,
+    _sign_operation,
+    operation_logger,
+)
+from .rates import rate_cache, RateUnavailable
+from .block_tracker import get_block_tracker
+from .batch import async_batch_resolve, batch_context, is_batch
+from .token_registry import token_registry
+from .audit import audit_writer
+from .signature_cache import signature_cache, signature_key
+from .funds import funds_checker
+from .gas import max_token_cost
+from .sender_lists import sender_lists
+from .budget import budget_ledger
+from .ratelimit import (
+    THROTTLED_CODE,
+    THROTTLED_MESSAGE,
+    client_ip,
+    ip_rate_limit,
+    sender_rate_limit,
+    throttled_response,
+)
+from .signer import get_signing_context
+from .chains import is_served_chain, resolve_chain_id
+from .metrics import Spans
+
+from jsonrpcserver import Result, Success, async_dispatch, Error
+from django.http import HttpResponse
+
+
+async def pm_sponsorUserOperation(chainId, request, token_address) -> Result:
+    if not is_served_chain(chainId):
+        return Error(4, "Unsupported chain", data="")
+    spans = Spans()
+    with spans.stage("token"):
+        await token_registry.async_refresh()
+        token = token_registry.get(chainId, token_address)
+    if token is None or not token["enabled"]:
+        return Error(2, "Unsupported token", data="")
+
+    with spans.stage("decode"):
+        op = _decode_operation(request)
+    if op is None:
+        return Error(400, "BAD REQUEST")
+    allowed = await spans.async_stage("senders", sender_lists.async_is_allowed(chainId, op.sender))
+    if not allowed:
+        return Error(9, "Sender not allowed", data="")
+    if not await sender_rate_limit.async_allow(op.sender):
+        return Error(THROTTLED_CODE, THROTTLED_MESSAGE, data="")
+
+    try:
+        exchange_rate, block_timestamp = await asyncio.gather(
+            spans.async_stage("rate", async_batch_resolve(("rate", chainId, token["address"]), lambda: rate_cache.async_get(chainId, token))),
+            spans.async_stage("block", async_batch_resolve(("block", chainId), get_block_tracker(chainId).async_latest_timestamp)),
+        )
+    except RateUnavailable:
+        return Error(3, "Exchange rate unavailable", data="")
+    with spans.stage("gas"):
+        error = _gas_error(chainId, token, op, exchange_rate)
+    if error is not None:
+        return error
+    cost = max_token_cost(op, exchange_rate)
+    error = _cap_error(token, op, cost)
+    if error is not None:
+        return error
+
+    if funds_checker.enabled:
+        spender = get_signing_context(chainId).paymaster_address
+        block_number = get_block_tracker(chainId).block_number
+        funds = await spans.async_stage("funds", async_batch_resolve(
+            ("funds", chainId, op.sender, token["address"], block_number),
+            lambda: funds_checker.async_get(chainId, op.sender, token["address"], spender, block_number),
+        ))
+        error = _funds_error(funds, op, token["address"], spender, cost)
+        if error is not None:
+            return error
+
+    # A cache hit saves the getHash call and signing, its cost was counted when it was signed
+    key = signature_key(chainId, token, op, exchange_rate)
+    cached = signature_cache.get(key)
+    error = _budget_error(chainId, token, op, cost if cached is None else 0)
+    if error is not None:
+        return error
+    if cached is not None:
+        operation_logger.info("Paymaster Operation sponsored again. sender=%s nonce=%d", op.sender, op.nonce)
+        return Success(cached[0])
+
+    paymasterAndData, hash = await asyncio.get_running_loop().run_in_executor(
+        None, _sign_operation, chainId, token, op, exchange_rate, block_timestamp, spans
+    )
+    budget_ledger.record(chainId, token, op.sender, cost)
+    signature_cache.put(key, VALID_FOR, paymasterAndData, hash)
+    audit_writer.record(chainId, op, paymasterAndData, hash)
+    operation_logger.info("Paymaster Operation sponsored. sender=%s nonce=%d %s", op.sender, op.nonce, spans)
+    return Success(paymasterAndData)
+
+
+async def pm_getApprovedTokens(chainId) -> Result:
+    if not is_served_chain(chainId):
+        return Error(4, "Unsupported chain", data="")
+    result = _get_cached_approved_tokens(chainId)
+    if result is None:
+        await token_registry.async_refresh()
+        tokens = token_registry.tokens(chainId)
+        quotes = await rate_cache.async_get_many(chainId, tokens)
+        result = _build_approved_tokens(chainId, tokens, quotes)
+        if result is None:
+            return Error(3, "Exchange rate unavailable", data="")
+    return Success(result)
+
+
+methods = {
+    "pm_sponsorUserOperation": pm_sponsorUserOperation,
+    "pm_getApprovedTokens": pm_getApprovedTokens,
+}
+
+
+async def jsonrpc(request, chain_id=None):
+    if not await ip_rate_limit.async_allow(client_ip(request)):
+        return throttled_response()
+    body = request.body.decode()
+    chainId = resolve_chain_id(chain_id, request)
+    if is_batch(body):
+        # Batch elements are dispatched concurrently by `async_dispatch`
+        with batch_context():
+            response = await async_dispatch(body, methods=methods, context=chainId)
+    else:
+        response = await async_dispatch(body, methods=methods, context=chainId)
+    return HttpResponse(response, content_type="application/json")
+
+
+# `csrf_exempt` wraps views in a sync function on Django 4.1, which would hide the coroutine
+jsonrpc.csrf_exempt = True
@@ -0,0 +1,144 @@
+"""
+Asynchronous persistence of sponsored operations.
+
+Requests only put the signed operation on a bounded in-process queue. A background thread
+stores them as `Operation` rows with `bulk_create`, once `auditBatchSize` operations are
+pending or every `auditFlushInterval` seconds. When the queue is full new operations are
+dropped (and counted) instead of slowing down the request. Pending operations are flushed when
+the process exits.
+"""
+import atexit
+import logging
+import queue
+import time
+from typing import List, Tuple
+
+import environ
+from django.db import DatabaseError, close_old_connections, connection
+
+from .background import BackgroundThread
+from .decoder import UserOperation
+from .models import Operation
+from .signer import get_signing_context
+
+env = environ.Env()
+logger = logging.getLogger(__name__)
+
+SPONSORED_STATUS = "sponsored"
+
+_STOP = object()
+
+
+class AuditWriter:
+    def __init__(self, enabled: bool, max_queue_size: int, batch_size: int, flush_interval: float):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._writer = BackgroundThread(self._run, "operation-audit-writer")
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, chain_id: str, op: UserOperation, paymaster_and_data: str, hash: bytes):
+        """
+        Queues a sponsored operation, never blocks
+        :param paymaster_and_data: signed paymaster data hex string (not 0x prefixed)
+        :param hash: paymaster hash signed in `paymaster_and_data`
+        """
+        if not self.enabled:
+            return
+        self._writer.ensure_started()
+        try:
+            self._queue.put_nowait((chain_id, op, paymaster_and_data, hash))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def close(self, timeout: float = 10):
+        """
+        Flushes the pending operations and stops the writer
+        """
+        if not self._writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+
+    def _run(self):
+        try:
+            stopped = False
+            while not stopped:
+                batch, stopped = self._collect_batch()
+                if batch:
+                    self._flush(batch)
+        finally:
+            connection.close()
+
+    def _collect_batch(self) -> Tuple[List, bool]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return self._drain(batch), True
+            batch.append(item)
+        return batch, False
+
+    def _drain(self, batch: List) -> List:
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if item is not _STOP:
+                batch.append(item)
+
+    def _flush(self, batch: List):
+        close_old_connections()
+        operations = [
+            Operation(
+                chainId=chain_id,
+                sender=op.sender,
+                nonce=op.nonce,
+                initCode=op.initCode,
+                callData=op.callData,
+                callGasLimit=op.callGasLimit,
+                verificationGasLimit=op.verificationGasLimit,
+                preVerificationGas=op.preVerificationGas,
+                maxFeePerGas=op.maxFeePerGas,
+                maxPriorityFeePerGas=op.maxPriorityFeePerGas,
+                paymasterAndData=get_signing_context(chain_id).paymaster_address
+                + paymaster_and_data,
+                signature=op.signature,
+                hash=hash,
+                status=SPONSORED_STATUS,
+            )
+            for chain_id, op, paymaster_and_data, hash in batch
+        ]
+        try:
+            Operation.objects.bulk_create(operations, batch_size=self.batch_size)
+            self.written += len(operations)
+        except DatabaseError as e:
+            self.failed += len(operations)
+            logger.error("Failed to store sponsored operations: %s", e)
+
+
+audit_writer = AuditWriter(
+    enabled=env.bool("auditOperations", default=True),
+    max_queue_size=env.int("auditQueueSize", default=10000),
+    batch_size=env.int("auditBatchSize", default=100),
+    flush_interval=env.float("auditFlushInterval", default=1),
+)
+
+atexit.register(audit_writer.close)
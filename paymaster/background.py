@@ -0,0 +1,57 @@
+"""
+Helpers for the in-process state kept fresh in the background: daemon threads started on
+first use, and reloads of stale state done by one caller at a time.
+"""
+import threading
+from typing import Callable, Optional
+
+
+class BackgroundThread:
+    """
+    Daemon thread running `target`, started by the first `ensure_started`. Threads do not
+    survive a fork, so a forked worker starts its own on its next call
+    """
+
+    def __init__(self, target: Callable[[], None], name: str):
+        self.target = target
+        self.name = name
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self.is_alive():
+            return
+        with self._lock:
+            if not self.is_alive():
+                self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+                self._thread.start()
+
+    def is_alive(self) -> bool:
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def reload_if_due(
+    lock: threading.Lock, loaded: bool, is_due: Callable[[], bool], reload: Callable[[], None]
+):
+    """
+    Calls `reload` if `is_due()`. Until the first load every caller waits for it, later reloads
+    are done by one caller while the others keep reading the current state
+    :param loaded: whether the first load is done
+    """
+    if not is_due():
+        return
+    if not loaded:
+        with lock:
+            if is_due():
+                reload()
+    elif lock.acquire(blocking=False):
+        try:
+            if is_due():
+                reload()
+        finally:
+            lock.release()
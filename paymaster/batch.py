@@ -0,0 +1,162 @@
+"""
+JSON-RPC batch handling.
+
+Elements of a batch are dispatched concurrently on a thread pool and their responses are
+returned in request order. While a batch is dispatched, lookups wrapped in `batch_resolve`
+(exchange rates, block timestamps) run once and are shared by every element.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import environ
+from django.db import close_old_connections
+from jsonrpcserver import dispatch, dispatch_to_serializable
+from jsonrpcserver.main import default_validator
+from jsonrpcserver.sentinels import NOCONTEXT
+
+env = environ.Env()
+
+
+class BatchContext:
+    def __init__(self):
+        self._results: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        if owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    async def async_resolve(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+        return await task
+
+
+_batch_context: contextvars.ContextVar[Optional[BatchContext]] = contextvars.ContextVar(
+    "batch_context", default=None
+)
+
+
+def batch_resolve(key: Hashable, fn: Callable[[], Any]) -> Any:
+    """
+    :return: `fn()`, computed once per batch when called while dispatching a batch
+    """
+    context = _batch_context.get()
+    if context is None:
+        return fn()
+    return context.resolve(key, fn)
+
+
+async def async_batch_resolve(key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+    """
+    Same as `batch_resolve` for coroutine functions
+    """
+    context = _batch_context.get()
+    if context is None:
+        return await fn()
+    return await context.async_resolve(key, fn)
+
+
+@contextmanager
+def batch_context():
+    """
+    Shares `batch_resolve` results between the elements of the batch dispatched inside it
+    """
+    token = _batch_context.set(BatchContext())
+    try:
+        yield
+    finally:
+        _batch_context.reset(token)
+
+
+def is_batch(body: str) -> bool:
+    return body.lstrip().startswith("[")
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=env.int("batchWorkers", default=8),
+                    thread_name_prefix="jsonrpc-batch",
+                )
+    return _executor
+
+
+def _clear_executor():
+    global _executor
+    _executor = None
+
+
+# Worker threads do not survive a fork
+os.register_at_fork(after_in_child=_clear_executor)
+
+
+def _validate_element(element):
+    # A batch element is a single request, a nested list would be dispatched as a batch
+    if not isinstance(element, dict):
+        raise ValueError("Batch element is not an object")
+    default_validator(element)
+
+
+def _dispatch_element(element, context: Any) -> Optional[Dict[str, Any]]:
+    # Worker threads are outside the request cycle that closes the stale connections
+    close_old_connections()
+    try:
+        return dispatch_to_serializable(
+            element,
+            context=context,
+            deserializer=lambda element: element,
+            validator=_validate_element,
+        )
+    finally:
+        close_old_connections()
+
+
+def dispatch_batch(body: str, context: Any = NOCONTEXT) -> str:
+    """
+    Same as `jsonrpcserver.dispatch`, with batch elements dispatched concurrently
+    :param context: passed as the first argument of the methods
+    """
+    try:
+        deserialized = json.loads(body)
+    except ValueError:
+        return dispatch(body, context=context)
+    if not isinstance(deserialized, list) or len(deserialized) < 2:
+        return dispatch(deserialized, context=context, deserializer=lambda request: request)
+
+    with batch_context():
+        variables = contextvars.copy_context()
+        executor = _get_executor()
+        futures = [
+            executor.submit(variables.copy().run, _dispatch_element, element, context)
+            for element in deserialized
+        ]
+        # Notifications have no response
+        responses = [
+            response for response in (future.result() for future in futures) if response
+        ]
+    return json.dumps(responses) if responses else ""
@@ -0,0 +1,112 @@
+"""
+Latest block timestamp kept in memory by a polling thread, one tracker per chain.
+
+The poller only asks the node for the block number every `blockInterval` seconds and fetches
+the block itself when the number changes. If the tracked value was not updated for
+`blockTimestampMaxDrift` seconds the latest block is fetched directly instead.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import environ
+from web3 import Web3
+
+from .background import BackgroundThread
+from .web3_pool import get_async_client, get_client
+
+env = environ.Env()
+logger = logging.getLogger(__name__)
+
+
+class BlockTracker:
+    def __init__(self, chain_id: str, w3: Web3, interval: float, max_drift: float):
+        self.chain_id = chain_id
+        self.w3 = w3
+        self.interval = interval
+        self.max_drift = max_drift
+        self.block_number: Optional[int] = None
+        self.timestamp: Optional[int] = None
+        self.updated_at = float("-inf")
+        self.fallback_fetches = 0
+        self._poller = BackgroundThread(self._run, "block-tracker")
+
+    def latest_timestamp(self) -> int:
+        """
+        :return: timestamp of the latest block, fetched from the node if the tracker is stale
+        """
+        self._poller.ensure_started()
+        if time.monotonic() - self.updated_at > self.max_drift:
+            self.fallback_fetches += 1
+            self._update(self.w3.eth.get_block("latest"))
+        return self.timestamp
+
+    async def async_latest_timestamp(self) -> int:
+        """
+        Same as `latest_timestamp`, the fallback fetch does not block the event loop
+        """
+        self._poller.ensure_started()
+        if time.monotonic() - self.updated_at > self.max_drift:
+            self.fallback_fetches += 1
+            w3 = get_async_client(self.chain_id).w3
+            self._update(await w3.eth.get_block("latest"))
+        return self.timestamp
+
+    def _update(self, block):
+        if self.block_number is None or block.number >= self.block_number:
+            self.block_number = block.number
+            self.timestamp = block.timestamp
+        self.updated_at = time.monotonic()
+
+    def _poll(self):
+        block_number = self.w3.eth.block_number
+        if block_number == self.block_number:
+            self.updated_at = time.monotonic()
+        else:
+            self._update(self.w3.eth.get_block(block_number))
+
+    def _run(self):
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                logger.warning("Block tracker poll failed: %s", e)
+            time.sleep(self.interval)
+
+
+_trackers: Dict[str, BlockTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_block_tracker(chain_id: str) -> BlockTracker:
+    tracker = _trackers.get(chain_id)
+    if tracker is None:
+        with _trackers_lock:
+            tracker = _trackers.get(chain_id)
+            if tracker is None:
+                tracker = BlockTracker(
+                    chain_id,
+                    get_client(chain_id).w3,
+                    interval=env.float("blockInterval", default=2),
+                    max_drift=env.float("blockTimestampMaxDrift", default=12),
+                )
+                _trackers[chain_id] = tracker
+    return tracker
+
+
+def get_block_tracker_stats() -> Dict[str, Dict[str, float]]:
+    now = time.monotonic()
+    return {
+        chain_id: {
+            "block_number": tracker.block_number or 0,
+            "age_seconds": now - tracker.updated_at if tracker.block_number else 0,
+            "fallback_fetches": tracker.fallback_fetches,
+        }
+        for chain_id, tracker in list(_trackers.items())
+    }
+
+
+# Trackers hold a `Web3Client` that is dropped after fork
+os.register_at_fork(after_in_child=_trackers.clear)
@@ -0,0 +1,220 @@
+"""
+Sponsorship budgets, as sliding-window sums of the maximum token cost of signed operations.
+
+Tokens set their limits in `ERC20ApprovedToken.chains`: `maxTokenSpend` for every sender
+together and `maxSenderSpend` for each sender, both over the last `budgetWindow` seconds
+(default one hour). Tokens without limits are not tracked.
+
+Spending is counted in memory, in buckets of `budgetBucketSeconds`, and sharded by key so
+concurrent requests rarely share a lock. A background thread checkpoints the new spending to
+`BudgetCheckpoint` every `budgetCheckpointInterval` seconds, then reloads the totals of every
+process from the database. Each process therefore sees the spending of the others with at
+most one interval of delay, and a budget can be overshot by what is signed in that time.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+import environ
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import Sum
+
+from .background import BackgroundThread
+from .gas import _limit
+from .models import BudgetCheckpoint
+
+env = environ.Env()
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 3600
+
+# (chainId, lowercase token address, sender or `None` for the token total)
+Key = Tuple[str, str, Optional[str]]
+
+
+class BudgetLedger:
+    def __init__(self, bucket_seconds: float, retention: float, interval: float, shards: int):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention
+        self.interval = interval
+        # key -> {bucket: amount}, totals of every process plus the local pending spending
+        self._counters: Dict[Key, Dict[int, int]] = {}
+        # (chainId, token, sender, bucket) -> amount not checkpointed yet
+        self._pending: Dict[Tuple[str, str, str, int], int] = defaultdict(int)
+        self._shard_locks = [threading.Lock() for _ in range(shards)]
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = BackgroundThread(self._run, "budget-checkpoint")
+        self.rejected = 0
+        self.checkpoints = 0
+        self.failed = 0
+
+    def exceeded(self, chain_id: str, token, sender: str, cost: int) -> Optional[str]:
+        """
+        :param cost: maximum token cost of the operation
+        :return: `"token"` or `"sender"` if signing would go over that budget of `token`
+        """
+        max_token_spend = _limit(token.get("maxTokenSpend"))
+        max_sender_spend = _limit(token.get("maxSenderSpend"))
+        if max_token_spend is None and max_sender_spend is None:
+            return None
+        self._writer.ensure_started()
+        address = token["address"].lower()
+        sender = sender.lower()
+        oldest = self._bucket(time.time() - token.get("budgetWindow", DEFAULT_WINDOW))
+        if (
+            max_token_spend is not None
+            and self._spent((chain_id, address, None), oldest) + cost > max_token_spend
+        ):
+            self.rejected += 1
+            return "token"
+        if (
+            max_sender_spend is not None
+            and self._spent((chain_id, address, sender), oldest) + cost > max_sender_spend
+        ):
+            self.rejected += 1
+            return "sender"
+        return None
+
+    def record(self, chain_id: str, token, sender: str, cost: int):
+        """
+        Counts the maximum token cost of a signed operation
+        """
+        if token.get("maxTokenSpend") is None and token.get("maxSenderSpend") is None:
+            return
+        address = token["address"].lower()
+        sender = sender.lower()
+        bucket = self._bucket(time.time())
+        # Counted along with the pending spending, so that `load` sees both or neither
+        with self._pending_lock:
+            self._add((chain_id, address, None), bucket, cost)
+            self._add((chain_id, address, sender), bucket, cost)
+            self._pending[(chain_id, address, sender, bucket)] += cost
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "counters": len(self._counters),
+            "pending": len(self._pending),
+            "rejected": self.rejected,
+            "checkpoints": self.checkpoints,
+            "failed": self.failed,
+        }
+
+    def checkpoint(self):
+        """
+        Stores the pending spending, then reloads the totals of every process
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        close_old_connections()
+        try:
+            BudgetCheckpoint.objects.bulk_create(
+                [
+                    BudgetCheckpoint(
+                        chainId=chain_id, token=token, sender=sender, bucket=bucket, amount=amount
+                    )
+                    for (chain_id, token, sender, bucket), amount in pending.items()
+                ]
+            )
+        except DatabaseError as e:
+            self.failed += 1
+            logger.error("Failed to checkpoint sponsorship budgets: %s", e)
+            with self._pending_lock:
+                for key, amount in pending.items():
+                    self._pending[key] += amount
+            return
+        self.checkpoints += 1
+        # The spending is stored, a failed reload keeps the current counters (which include it)
+        # until the next checkpoint
+        try:
+            self.load()
+        except DatabaseError as e:
+            self.failed += 1
+            logger.error("Failed to reload sponsorship budgets: %s", e)
+
+    def load(self):
+        """
+        Rebuilds the counters from the checkpoints of the retention period and the pending
+        spending of this process
+        """
+        oldest = self._bucket(time.time() - self.retention)
+        BudgetCheckpoint.objects.filter(bucket__lt=oldest).delete()
+        rows = list(
+            BudgetCheckpoint.objects.filter(bucket__gte=oldest)
+            .values_list("chainId", "token", "sender", "bucket")
+            .annotate(total=Sum("amount"))
+        )
+        # Spending recorded from here on is in the pending amounts read below
+        with self._pending_lock:
+            spent = [(row[:4], int(row[4])) for row in rows] + list(self._pending.items())
+            counters: Dict[Key, Dict[int, int]] = {}
+            for (chain_id, token, sender, bucket), amount in spent:
+                token, sender = token.lower(), sender.lower()
+                for key in ((chain_id, token, None), (chain_id, token, sender)):
+                    buckets = counters.setdefault(key, {})
+                    buckets[bucket] = buckets.get(bucket, 0) + amount
+            self._counters = counters
+
+    def close(self, timeout: float = 10):
+        """
+        Checkpoints the pending spending and stops the writer
+        """
+        if not self._writer.is_alive():
+            return
+        self._stop.set()
+        self._writer.join(timeout)
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds)
+
+    def _shard_lock(self, key: Key) -> threading.Lock:
+        return self._shard_locks[hash(key) % len(self._shard_locks)]
+
+    def _spent(self, key: Key, oldest: int) -> int:
+        buckets = self._counters.get(key)
+        if not buckets:
+            return 0
+        with self._shard_lock(key):
+            return sum(amount for bucket, amount in buckets.items() if bucket >= oldest)
+
+    def _add(self, key: Key, bucket: int, amount: int):
+        with self._shard_lock(key):
+            buckets = self._counters.get(key)
+            if buckets is None:
+                buckets = self._counters[key] = {}
+            buckets[bucket] = buckets.get(bucket, 0) + amount
+
+    def _run(self):
+        try:
+            close_old_connections()
+            try:
+                self.load()
+            except DatabaseError as e:
+                logger.error("Failed to load sponsorship budgets: %s", e)
+            while not self._stop.wait(self.interval):
+                self.checkpoint()
+            self.checkpoint()
+        finally:
+            connection.close()
+
+    def _after_fork(self):
+        # The parent checkpoints its own pending spending
+        self._pending = defaultdict(int)
+        self._pending_lock = threading.Lock()
+        self._shard_locks = [threading.Lock() for _ in self._shard_locks]
+        self._stop = threading.Event()
+
+
+budget_ledger = BudgetLedger(
+    bucket_seconds=env.float("budgetBucketSeconds", default=60),
+    retention=env.float("budgetRetention", default=86400),
+    interval=env.float("budgetCheckpointInterval", default=10),
+    shards=env.int("budgetShards", default=16),
+)
+
+atexit.register(budget_ledger.close)
+os.register_at_fork(after_in_child=budget_ledger._after_fork)
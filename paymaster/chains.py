@@ -0,0 +1,42 @@
+"""
+Settings of the chains served by one deployment.
+
+`chainId` is the default chain, served on `/paymaster` with the global settings. Other chains
+are served on `/paymaster/<chainId>` (or `/paymaster?chainId=<chainId>`) once
+`HTTPProvider_<chainId>` is set. Any setting read through `chain_env` can be overridden per
+chain the same way, e.g. `paymaster_add_420`, and otherwise falls back to the global one.
+Clients, signers and block trackers of a chain are only created by its first request.
+"""
+from typing import Optional
+
+import environ
+
+env = environ.Env()
+
+
+def default_chain_id() -> str:
+    return str(env("chainId"))
+
+
+def chain_env(name: str, chain_id: str, default=environ.Env.NOTSET):
+    """
+    :return: `<name>_<chain_id>` when set, `<name>` otherwise
+    """
+    key = "%s_%s" % (name, chain_id)
+    if key in env.ENVIRON:
+        return env(key)
+    return env(name, default=default)
+
+
+def is_served_chain(chain_id: Optional[str]) -> bool:
+    if not chain_id or not chain_id.isdigit():
+        return False
+    return chain_id == default_chain_id() or "HTTPProvider_%s" % chain_id in env.ENVIRON
+
+
+def resolve_chain_id(chain_id: Optional[str], request) -> str:
+    """
+    :param chain_id: chain of the request path, if any
+    :return: chain selected by the path, then the `chainId` query parameter, then the default
+    """
+    return str(chain_id or request.GET.get("chainId") or default_chain_id())
@@ -0,0 +1,18 @@
+"""
+SQLite tuning for several workers sharing one database file.
+
+WAL lets readers run while the audit writer holds the write lock, and `synchronous=NORMAL` is
+durable in WAL mode apart from the last transactions on power loss. `busy_timeout` is set
+from the `timeout` option in settings.
+"""
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
@@ -0,0 +1,170 @@
+"""
+Fast path decoder for the `UserOperation` sent to `pm_sponsorUserOperation`.
+
+Applies the same validation rules and error messages as `OperationSerialzer` in a single pass
+over the JSON dict and returns ints and bytes directly. `OperationSerialzer` is still used for
+persistence and the admin.
+"""
+import binascii
+from typing import Any, Dict, List, Optional
+
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail, ValidationError
+
+from .serializers import HexadecimalField
+from .utils import fast_is_checksum_address
+
+REQUIRED_ERROR = serializers.Field.default_error_messages["required"]
+NULL_ERROR = serializers.Field.default_error_messages["null"]
+NOT_A_DICT_ERROR = serializers.Serializer.default_error_messages["invalid"]
+NO_DATA_ERROR = "No data provided"
+HEX_ERRORS = HexadecimalField.default_error_messages
+
+
+class UserOperation:
+    __slots__ = (
+        "sender",
+        "nonce",
+        "initCode",
+        "callData",
+        "callGasLimit",
+        "verificationGasLimit",
+        "preVerificationGas",
+        "maxFeePerGas",
+        "maxPriorityFeePerGas",
+        "paymasterAndData",
+        "signature",
+    )
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs[field])
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        :return: the operation as the `UserOperation` struct expected by web3 contract calls
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class _FieldError(Exception):
+    def __init__(self, message: str, code: str = "invalid"):
+        self.detail = ErrorDetail(message, code=code)
+
+
+def _decode_address(data) -> str:
+    try:
+        if not fast_is_checksum_address(data):
+            raise ValueError
+        elif int(data, 16) == 0:
+            raise _FieldError("0x0 address is not allowed")
+        elif int(data, 16) == 1:
+            raise _FieldError("0x1 address is not allowed")
+    except ValueError:
+        raise _FieldError("Address %s is not checksumed" % data)
+    return data
+
+
+def _decode_hex(
+    data,
+    allow_blank: bool = False,
+    min_length: Optional[int] = None,
+    max_length: Optional[int] = None,
+) -> bytes:
+    if isinstance(data, (bytes, memoryview)):
+        data = data.hex()
+    elif isinstance(data, str):
+        data = data.strip()
+        if data.startswith("0x"):
+            data = data[2:]
+    else:
+        raise _FieldError(HEX_ERRORS["invalid"].format(value=data))
+
+    if not data:
+        if allow_blank:
+            return b""
+        raise _FieldError(HEX_ERRORS["blank"], code="blank")
+
+    # `HexBytes` strips another `0x` or `0X` prefix after the one removed by the serializer
+    digits = data[2:] if data.startswith(("0x", "0X")) else data
+    try:
+        value = binascii.unhexlify(digits if len(digits) % 2 == 0 else "0" + digits)
+    except ValueError:
+        raise _FieldError(HEX_ERRORS["invalid"].format(value=data))
+    if min_length and len(value) < min_length:
+        raise _FieldError(
+            HEX_ERRORS["min_length"].format(min_length=len(value)), code="min_length"
+        )
+    elif max_length and len(value) > max_length:
+        raise _FieldError(
+            HEX_ERRORS["max_length"].format(max_length=len(value)), code="max_length"
+        )
+    return value
+
+
+def _decode_uint(data) -> int:
+    return int.from_bytes(_decode_hex(data), "big")
+
+
+def _decode_bytes(data) -> bytes:
+    return _decode_hex(data, allow_blank=True)
+
+
+def _decode_signature(data) -> bytes:
+    return _decode_hex(data, allow_blank=True, min_length=65, max_length=65)
+
+
+FIELD_DECODERS = (
+    ("sender", _decode_address),
+    ("nonce", _decode_uint),
+    ("initCode", _decode_bytes),
+    ("callData", _decode_bytes),
+    ("callGasLimit", _decode_uint),
+    ("verificationGasLimit", _decode_uint),
+    ("preVerificationGas", _decode_uint),
+    ("maxFeePerGas", _decode_uint),
+    ("maxPriorityFeePerGas", _decode_uint),
+    ("paymasterAndData", _decode_bytes),
+    ("signature", _decode_signature),
+)
+
+
+def decode_user_operation(data) -> UserOperation:
+    """
+    :param data: `UserOperation` as received in the JSON-RPC params
+    :return: decoded `UserOperation`
+    :raises ValidationError: with the same detail as `OperationSerialzer.errors`
+    """
+    if data is None:
+        # `Serializer.errors` replaces the null error of a missing body
+        raise ValidationError({"non_field_errors": [ErrorDetail(NO_DATA_ERROR, code="null")]})
+    if not isinstance(data, dict):
+        raise ValidationError(
+            {
+                "non_field_errors": [
+                    ErrorDetail(
+                        NOT_A_DICT_ERROR.format(datatype=type(data).__name__),
+                        code="invalid",
+                    )
+                ]
+            }
+        )
+
+    values = {}
+    errors: Dict[str, List[ErrorDetail]] = {}
+    for field, decode in FIELD_DECODERS:
+        if field not in data:
+            errors[field] = [ErrorDetail(REQUIRED_ERROR, code="required")]
+            continue
+        value = data[field]
+        if value is None:
+            errors[field] = [ErrorDetail(NULL_ERROR, code="null")]
+            continue
+        try:
+            values[field] = decode(value)
+        except _FieldError as e:
+            errors[field] = [e.detail]
+
+    if errors:
+        raise ValidationError(errors)
+    return UserOperation(**values)
@@ -0,0 +1,247 @@
+"""
+Pre-check of the sender's token balance and allowance before signing.
+
+`balanceOf(sender)` and `allowance(sender, paymaster)` are read with a single Multicall3
+`aggregate3` call at the latest tracked block, and cached per (chainId, sender, token, block).
+Operations whose maximum token cost is above the balance, or above the allowance, are refused.
+An `approve(paymaster, amount)` of the token made by the operation, as a call of an account
+`execute` or `executeBatch` (for example a batched approve + call), counts as allowance.
+
+If the node cannot answer, the check is skipped: the paymaster still validates on-chain. A chain
+without a contract at `multicall3Address` is not asked again for `multicall3RetryInterval`
+seconds.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import environ
+import requests
+from eth_abi import decode, encode
+from eth_abi.exceptions import DecodingError
+from web3.exceptions import Web3Exception
+
+from .decoder import UserOperation
+from .web3_pool import get_async_client, get_client
+
+env = environ.Env()
+logger = logging.getLogger(__name__)
+
+MULTICALL3_ADDRESS = env("multicall3Address", default="0xcA11bde05977b3631167028862bE2a173976CA11")
+
+# aggregate3((address,bool,bytes)[])
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")
+ALLOWANCE_SELECTOR = bytes.fromhex("dd62ed3e")
+APPROVE_SELECTOR = bytes.fromhex("095ea7b3")
+# execute(address,uint256,bytes) and executeBatch(address[],bytes[]) of the account
+EXECUTE_SELECTOR = bytes.fromhex("b61d27f6")
+EXECUTE_BATCH_SELECTOR = bytes.fromhex("18dfb3c7")
+
+# Errors raised by a failing node or an unexpected Multicall3 answer (`0x` when it is not
+# deployed, a null result from some node proxies)
+CALL_ERRORS = (
+    requests.RequestException,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    Web3Exception,
+    DecodingError,
+    TypeError,
+    ValueError,
+)
+
+
+class Multicall3Unavailable(ValueError):
+    """
+    The node answered `0x`, there is no Multicall3 contract on the chain
+    """
+
+
+def account_calls(call_data: bytes) -> List[Tuple[str, bytes]]:
+    """
+    :return: target and data of the calls made by an account `execute` or `executeBatch`,
+        empty for any other callData
+    """
+    selector, arguments = call_data[:4], call_data[4:]
+    try:
+        if selector == EXECUTE_SELECTOR:
+            target, _, data = decode(["address", "uint256", "bytes"], arguments)
+            return [(target, data)]
+        if selector == EXECUTE_BATCH_SELECTOR:
+            targets, data = decode(["address[]", "bytes[]"], arguments)
+            return list(zip(targets, data))
+    except DecodingError:
+        pass
+    return []
+
+
+def approved_amount(call_data: bytes, token: str, spender: str) -> Optional[int]:
+    """
+    :return: amount of the last `approve(spender, amount)` call to `token` made by `call_data`
+    """
+    token, spender = token.lower(), spender.lower()
+    amount = None
+    for target, data in account_calls(call_data):
+        if target.lower() != token or data[:4] != APPROVE_SELECTOR:
+            continue
+        try:
+            approved, value = decode(["address", "uint256"], data[4:])
+        except DecodingError:
+            continue
+        if approved.lower() == spender:
+            amount = value
+    return amount
+
+
+def encode_funds_call(sender: str, token: str, spender: str) -> bytes:
+    """
+    :return: calldata of `aggregate3` reading `balanceOf(sender)` and
+        `allowance(sender, spender)` of `token`
+    """
+    calls = [
+        (token, True, BALANCE_OF_SELECTOR + encode(["address"], [sender])),
+        (token, True, ALLOWANCE_SELECTOR + encode(["address", "address"], [sender, spender])),
+    ]
+    return AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+
+
+def decode_funds_result(data: bytes) -> Tuple[int, int]:
+    """
+    :return: balance and allowance
+    :raises ValueError: if one of the calls failed
+    """
+    if not data:
+        raise Multicall3Unavailable("No Multicall3 contract at %s" % MULTICALL3_ADDRESS)
+    (results,) = decode(["(bool,bytes)[]"], data)
+    if len(results) != 2 or not all(success and len(value) >= 32 for success, value in results):
+        raise ValueError("balanceOf or allowance call failed")
+    return tuple(int.from_bytes(value[:32], "big") for _, value in results)
+
+
+class FundsChecker:
+    def __init__(self, enabled: bool, max_size: int, retry_interval: float):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.retry_interval = retry_interval
+        # (chainId, sender, token, block) -> (balance, allowance)
+        self._entries: "OrderedDict[Tuple[str, str, str, int], Tuple[int, int]]" = OrderedDict()
+        # chainId -> monotonic time Multicall3 is asked again
+        self._unavailable: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def get(
+        self, chain_id: str, sender: str, token: str, spender: str, block_number: int
+    ) -> Optional[Tuple[int, int]]:
+        """
+        :return: balance and allowance of `sender` at `block_number`, `None` if the node
+            could not tell
+        """
+        key = (chain_id, sender, token, block_number)
+        funds = self._lookup(key)
+        if funds is None and self._available(chain_id):
+            data = encode_funds_call(sender, token, spender)
+            try:
+                result = get_client(chain_id).w3.eth.call(
+                    {"to": MULTICALL3_ADDRESS, "data": data}, block_number
+                )
+                funds = self._store(key, decode_funds_result(result))
+            except CALL_ERRORS as e:
+                self._failed(chain_id, e)
+        return funds
+
+    async def async_get(
+        self, chain_id: str, sender: str, token: str, spender: str, block_number: int
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Same as `get` using the `AsyncWeb3` client
+        """
+        key = (chain_id, sender, token, block_number)
+        funds = self._lookup(key)
+        if funds is None and self._available(chain_id):
+            data = encode_funds_call(sender, token, spender)
+            try:
+                result = await get_async_client(chain_id).w3.eth.call(
+                    {"to": MULTICALL3_ADDRESS, "data": data}, block_number
+                )
+                funds = self._store(key, decode_funds_result(result))
+            except CALL_ERRORS as e:
+                self._failed(chain_id, e)
+        return funds
+
+    def shortfall(
+        self, funds: Tuple[int, int], op: UserOperation, token: str, spender: str, cost: int
+    ) -> Optional[str]:
+        """
+        :param cost: `gas.max_token_cost` of `op`
+        :return: `"balance"` or `"allowance"` if it does not cover `cost`
+        """
+        balance, allowance = funds
+        if balance < cost:
+            reason = "balance"
+        elif allowance < cost and (approved_amount(op.callData, token, spender) or 0) < cost:
+            reason = "allowance"
+        else:
+            return None
+        self.rejected += 1
+        return reason
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "entries": len(self._entries),
+        }
+
+    def _available(self, chain_id: str) -> bool:
+        retry_at = self._unavailable.get(chain_id)
+        if retry_at is None or retry_at <= time.monotonic():
+            return True
+        self.skipped += 1
+        return False
+
+    def _lookup(self, key) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            funds = self._entries.get(key)
+            if funds is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return funds
+
+    def _store(self, key, funds: Tuple[int, int]) -> Tuple[int, int]:
+        with self._lock:
+            self._entries[key] = funds
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return funds
+
+    def _failed(self, chain_id: str, e: Exception):
+        self.errors += 1
+        if isinstance(e, Multicall3Unavailable):
+            self._unavailable[chain_id] = time.monotonic() + self.retry_interval
+            logger.warning(
+                "Sender funds check disabled for %ds on chain %s: %s",
+                self.retry_interval, chain_id, e,
+            )
+        else:
+            logger.warning("Sender funds check skipped: %s", e)
+
+
+funds_checker = FundsChecker(
+    enabled=env.bool("checkSenderFunds", default=True),
+    max_size=env.int("senderFundsCacheSize", default=10000),
+    retry_interval=env.float("multicall3RetryInterval", default=3600),
+)
@@ -0,0 +1,120 @@
+"""
+In-process verification of the gas fields of a sponsored operation.
+
+`preVerificationGas` must cover the calldata cost of the packed operation plus the bundle
+overhead, computed like the bundler's `calcPreVerificationGas`. The `paymasterAndData` counted
+is the one that will be signed, with its known fields (paymaster, token, mode, fee and exchange
+rate) set. Only the low bytes of validUntil and the paymaster signature are not known yet, they
+count as non-zero bytes, like a missing part of the operation signature.
+
+The maximum token cost is what the EntryPoint can charge the paymaster, converted with the
+exchange rate. Tokens can cap it in `ERC20ApprovedToken.chains` with `maxTokenCost` (token
+amount in token decimals) and `maxGas` (total gas of the operation).
+"""
+from math import floor
+from typing import Optional, Union
+
+import environ
+from hexbytes import HexBytes
+
+from .decoder import UserOperation
+from .op_hash import WORD, _encode_bytes, pack_user_operation
+from .signer import SIGNATURE_SIZE, build_paymaster_and_data
+
+env = environ.Env()
+
+FIXED_GAS = 21000
+PER_USER_OP_GAS = 18300
+PER_USER_OP_WORD_GAS = 4
+ZERO_BYTE_GAS = 4
+NON_ZERO_BYTE_GAS = 16
+BUNDLE_SIZE = env.int("preVerificationGasBundleSize", default=1)
+
+# SponsoringMode (GAS ONLY) of the signed paymaster data
+SPONSORING_MODE = 1
+# validUntil is a 6 bytes timestamp, its first 2 bytes are zero until 2106
+VALID_UNTIL_PLACEHOLDER = 2**32 - 1
+SIGNATURE_PLACEHOLDER = b"\xff" * SIGNATURE_SIZE
+
+# EntryPoint prefund: verificationGasLimit counts 3 times when there is a paymaster (postOp)
+VERIFICATION_GAS_MULTIPLIER = 3
+
+
+def signed_paymaster_and_data(paymaster: str, token: str, exchange_rate: int) -> bytes:
+    """
+    :return: `paymasterAndData` with the fields of the one signed for `token`, validUntil and
+        the signature being non-zero placeholders
+    """
+    return bytes(HexBytes(paymaster)) + build_paymaster_and_data(
+        token, SPONSORING_MODE, VALID_UNTIL_PLACEHOLDER, 0, exchange_rate, SIGNATURE_PLACEHOLDER
+    )
+
+
+def pre_verification_gas(op: UserOperation, paymaster_and_data: bytes) -> int:
+    """
+    :param paymaster_and_data: `signed_paymaster_and_data` of the sponsoring token
+    :return: minimum `preVerificationGas` of `op` once sponsored
+    """
+    signature = op.signature.ljust(SIGNATURE_SIZE, b"\xff")
+    signed = UserOperation(
+        **dict(op.as_dict(), paymasterAndData=paymaster_and_data, signature=signature)
+    )
+    # The bundler packs the operation without its last word, as if the signature was empty
+    packed = b"".join(
+        (
+            pack_user_operation(signed),
+            _encode_bytes(paymaster_and_data),
+            _encode_bytes(signature),
+        )
+    )[:-WORD]
+    zero_bytes = packed.count(0)
+    call_data_gas = zero_bytes * ZERO_BYTE_GAS + (len(packed) - zero_bytes) * NON_ZERO_BYTE_GAS
+    # Fractional words and bundle share, rounded half up like `Math.round`
+    gas = (
+        call_data_gas
+        + FIXED_GAS / BUNDLE_SIZE
+        + PER_USER_OP_GAS
+        + PER_USER_OP_WORD_GAS * (len(packed) + 31) / 32
+    )
+    return floor(gas + 0.5)
+
+
+def total_gas(op: UserOperation) -> int:
+    """
+    :return: gas the EntryPoint requires the paymaster to prefund
+    """
+    return (
+        op.callGasLimit
+        + op.verificationGasLimit * VERIFICATION_GAS_MULTIPLIER
+        + op.preVerificationGas
+    )
+
+
+def max_token_cost(op: UserOperation, exchange_rate: int) -> int:
+    """
+    :param exchange_rate: token amount (in token decimals) worth 1 ether
+    :return: token amount charged if the operation uses all its gas at `maxFeePerGas`
+    """
+    return -(-total_gas(op) * op.maxFeePerGas * exchange_rate // 10**18)
+
+
+def _limit(value: Union[int, str, None]) -> Optional[int]:
+    # Large amounts may be written as decimal or 0x prefixed strings in the chains JSON
+    if value is None or isinstance(value, int):
+        return value
+    return int(value, 0)
+
+
+def exceeded_cap(token, op: UserOperation, cost: int) -> Optional[str]:
+    """
+    :param token: token config from `ERC20ApprovedToken.chains`
+    :param cost: `max_token_cost` of `op`
+    :return: name of the cap of `token` that `op` goes over
+    """
+    max_gas = _limit(token.get("maxGas"))
+    if max_gas is not None and total_gas(op) > max_gas:
+        return "maxGas"
+    max_cost = _limit(token.get("maxTokenCost"))
+    if max_cost is not None and cost > max_cost:
+        return "maxTokenCost"
+    return None
@@ -0,0 +1,60 @@
+"""
+Logging helpers referenced from `LOGGING` in settings.
+"""
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler
+
+from .background import BackgroundThread
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps a random `rate` fraction of the records, warnings and errors are always kept
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class NonBlockingStreamHandler(QueueHandler):
+    """
+    Formats records on the calling thread and writes them to stdout from a background thread.
+    When `max_queue_size` records are pending new ones are dropped instead of blocking
+    """
+
+    def __init__(self, max_queue_size: int = 10000):
+        super().__init__(queue.Queue(maxsize=max_queue_size))
+        self.target = logging.StreamHandler(sys.stdout)
+        self.dropped = 0
+        self._writer = BackgroundThread(self._run, "log-writer")
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record: logging.LogRecord):
+        self._writer.ensure_started()
+        super().emit(record)
+
+    def close(self):
+        # Writes what is still pending when logging shuts down
+        while True:
+            try:
+                self.target.handle(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.target.flush()
+        super().close()
+
+    def _run(self):
+        while True:
+            self.target.handle(self.queue.get())
@@ -0,0 +1,145 @@
+"""
+Local stand-ins for the Ethereum node and the exchange rate source used by `manage.py bench`.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_abi import decode, encode
+
+from paymaster.decoder import UserOperation
+from paymaster.op_hash import get_paymaster_hash
+
+# getHash((address,uint256,bytes,bytes,uint256,uint256,uint256,uint256,uint256,bytes,bytes),(address,uint8,uint48,uint256,uint256,bytes))
+GET_HASH_SELECTOR = "0xb5766ebc"
+GET_HASH_TYPES = [
+    "(address,uint256,bytes,bytes,uint256,uint256,uint256,uint256,uint256,bytes,bytes)",
+    "(address,uint8,uint48,uint256,uint256,bytes)",
+]
+
+# aggregate3((address,bool,bytes)[]) of balanceOf(address) and allowance(address,address)
+AGGREGATE3_SELECTOR = "0x82ad56cb"
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")
+ALLOWANCE_SELECTOR = bytes.fromhex("dd62ed3e")
+TOKEN_BALANCE = 10**30
+
+BLOCK_NUMBER = 0x10
+BLOCK_TIMESTAMP = 0x64000000
+EMPTY_HASH = "0x" + "00" * 32
+
+# Price of 1 token in ether, as answered by the coingecko `simple/token_price` API
+TOKEN_PRICE = b'{"0x0000000000000000000000000000000000000000":{"eth":0.00061234}}'
+
+
+class StubNodeHandler(BaseHTTPRequestHandler):
+    """
+    Answers the JSON-RPC calls made by the paymaster: `eth_chainId`, `eth_blockNumber`,
+    `eth_getBlockByNumber`, `eth_call` of `getHash` (computed locally) and of Multicall3
+    `aggregate3` (balances are `server.token_balance` and allowances `server.token_allowance`,
+    `TOKEN_BALANCE` by default). GET requests are answered with `TOKEN_PRICE`, so the server is
+    also the exchange rate source
+    """
+
+    protocol_version = "HTTP/1.1"
+    chain_id = 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(request, list):
+            response = [self._call(element) for element in request]
+        else:
+            response = self._call(request)
+        self._send(json.dumps(response).encode())
+
+    def do_GET(self):
+        self._send(TOKEN_PRICE)
+
+    def _call(self, request):
+        method = request["method"]
+        if method == "eth_chainId":
+            result = hex(self.chain_id)
+        elif method == "eth_blockNumber":
+            result = hex(BLOCK_NUMBER)
+        elif method == "eth_getBlockByNumber":
+            result = self._block()
+        elif method == "eth_call" and request["params"][0]["data"].startswith(AGGREGATE3_SELECTOR):
+            result = self._aggregate3(request["params"][0]["data"])
+        elif method == "eth_call":
+            result = self._get_hash(request["params"][0]["data"])
+        else:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32601, "message": "Method not found"},
+            }
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def _get_hash(self, data: str) -> str:
+        if not data.startswith(GET_HASH_SELECTOR):
+            return "0x"
+        user_op, paymaster_data = decode(GET_HASH_TYPES, bytes.fromhex(data[10:]))
+        op = UserOperation(**dict(zip(UserOperation.__slots__, user_op)))
+        # No deployed contract, the paymaster address is the one the signer uses
+        paymaster_address = self.server.paymaster_address
+        return "0x" + get_paymaster_hash(op, paymaster_data, self.chain_id, paymaster_address).hex()
+
+    def _aggregate3(self, data: str) -> str:
+        (calls,) = decode(["(address,bool,bytes)[]"], bytes.fromhex(data[10:]))
+        answers = {
+            BALANCE_OF_SELECTOR: self.server.token_balance,
+            ALLOWANCE_SELECTOR: self.server.token_allowance,
+        }
+        results = [
+            (call_data[:4] in answers, answers.get(call_data[:4], 0).to_bytes(32, "big"))
+            for _, _, call_data in calls
+        ]
+        return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+
+    def _block(self):
+        return {
+            "number": hex(BLOCK_NUMBER),
+            "timestamp": hex(BLOCK_TIMESTAMP),
+            "hash": "0x" + "11" * 32,
+            "parentHash": EMPTY_HASH,
+            "nonce": "0x0000000000000000",
+            "sha3Uncles": EMPTY_HASH,
+            "logsBloom": "0x" + "00" * 256,
+            "transactionsRoot": EMPTY_HASH,
+            "stateRoot": EMPTY_HASH,
+            "receiptsRoot": EMPTY_HASH,
+            "miner": "0x" + "00" * 20,
+            "difficulty": "0x0",
+            "totalDifficulty": "0x0",
+            "extraData": "0x",
+            "size": "0x1",
+            "gasLimit": "0x1c9c380",
+            "gasUsed": "0x0",
+            "transactions": [],
+            "uncles": [],
+            "mixHash": EMPTY_HASH,
+            "baseFeePerGas": "0x1",
+        }
+
+    def _send(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_node(chain_id: int, paymaster_address: str) -> ThreadingHTTPServer:
+    """
+    Serves `StubNodeHandler` on a free local port, in a daemon thread
+    :return: the server, `server.server_address` gives the port
+    """
+    handler = type("ChainStubNodeHandler", (StubNodeHandler,), {"chain_id": chain_id})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.paymaster_address = paymaster_address
+    server.token_balance = server.token_allowance = TOKEN_BALANCE
+    threading.Thread(target=server.serve_forever, name="stub-node", daemon=True).start()
+    return server
@@ -0,0 +1,566 @@
+"""
+End to end benchmark of the JSON-RPC endpoint against a local stub node and price source.
+
+    python manage.py bench --concurrency 1 4 16 --requests 500 --output bench.json
+
+Requests go through the Django test client (middleware, URL routing and the configured
+`jsonrpc` view) into a throwaway test database. `--servers gunicorn uvicorn` also load real
+server processes over HTTP, started as `init.sh` does: gunicorn sync workers on
+`paymaster.wsgi` and uvicorn workers with `asyncRPC` on `paymaster.asgi`. Results are written as JSON, so two runs can
+be compared with any JSON diff tool. The database micro benchmarks run after `--seed-operations`
+operations are stored.
+"""
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+from itertools import count, cycle
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import quote
+
+import django
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from ._stubs import start_stub_node
+
+BENCH_TOKEN = "0x7F5c764cBc14f9669B88837ca1490cCa17c31607"
+BENCH_SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+
+# Well known development key, only used when `paymaster_pk` is not set
+DEV_PAYMASTER = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+DEV_PAYMASTER_PK = "0x59c6995e998f97a5a0044966f0945389dc9e86dae88c7a8412f4603b6b78690d"
+
+METHODS = ("pm_sponsorUserOperation", "pm_getApprovedTokens")
+
+# gunicorn arguments of each server, as started by init.sh
+SERVERS = {
+    "gunicorn": ["paymaster.wsgi:application"],
+    "uvicorn": ["paymaster.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+SERVER_START_TIMEOUT = 60
+
+
+def user_operation(nonce: int) -> dict:
+    return {
+        "sender": BENCH_SENDER,
+        "nonce": hex(nonce),
+        "initCode": "0x",
+        "callData": "0xb61d27f6" + "ab" * 196,
+        "callGasLimit": "0x5208",
+        "verificationGasLimit": "0x186a0",
+        "preVerificationGas": "0xc350",
+        "maxFeePerGas": "0x3b9aca00",
+        "maxPriorityFeePerGas": "0x3b9aca00",
+        "paymasterAndData": "0x",
+        "signature": "0x" + "11" * 65,
+    }
+
+
+def large_user_operation(nonce: int, size: int) -> dict:
+    """
+    :return: operation deploying its account, with `size` bytes of `callData` and of `initCode`
+    """
+    return dict(
+        user_operation(nonce),
+        initCode=BENCH_TOKEN + "cd" * (size - 20),
+        callData="0xb61d27f6" + "ab" * (size - 4),
+    )
+
+
+class ServerClient:
+    """
+    `Client.post` over HTTP to a server process, on a kept alive connection
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+
+    def post(self, path: str, data: str, content_type: str) -> requests.Response:
+        return self.session.post(
+            self.url + path, data=data, headers={"Content-Type": content_type}, timeout=30
+        )
+
+
+def percentile(latencies: List[float], q: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[q - 1]
+
+
+class Command(BaseCommand):
+    help = "Benchmarks pm_sponsorUserOperation and pm_getApprovedTokens end to end"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--requests", type=int, default=500, help="per method and level")
+        parser.add_argument("--warmup", type=int, default=20)
+        parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+        parser.add_argument(
+            "--allocation-requests", type=int, default=50,
+            help="requests traced with tracemalloc (0 to skip)",
+        )
+        parser.add_argument(
+            "--micro-iterations", type=int, default=2000,
+            help="iterations of each micro benchmark (0 to skip)",
+        )
+        parser.add_argument(
+            "--seed-operations", type=int, default=200000,
+            help="operations stored before the database micro benchmarks",
+        )
+        parser.add_argument("--get-hash-mode", choices=["local", "remote", "verify"])
+        parser.add_argument(
+            "--rate-limits", action="store_true", help="keep the IP and sender rate limits"
+        )
+        parser.add_argument(
+            "--servers", nargs="*", choices=list(SERVERS), default=[],
+            help="also load these server processes over HTTP",
+        )
+        parser.add_argument("--server-workers", type=int, default=1)
+        parser.add_argument("--output", help="JSON results file, stdout when omitted")
+
+    def handle(self, *args, **options):
+        chain_id = str(os.environ.get("chainId", "10"))
+        self._configure_environment(chain_id, options)
+        node = start_stub_node(int(chain_id), os.environ["paymaster_add"])
+        node_url = "http://127.0.0.1:%d" % node.server_address[1]
+        os.environ["HTTPProvider"] = node_url
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._create_token(chain_id, node_url)
+            results = {
+                "meta": self._meta(chain_id, options),
+                "endpoint": [],
+                "servers": [],
+                "allocations": [],
+                "micro": {},
+            }
+            self._nonces = count()
+            for method in options["methods"]:
+                self._run(method, options["warmup"], 1)
+                for concurrency in options["concurrency"]:
+                    results["endpoint"].append(
+                        self._measure(method, options["requests"], concurrency)
+                    )
+                if options["allocation_requests"]:
+                    results["allocations"].append(
+                        self._trace_allocations(method, options["allocation_requests"])
+                    )
+            for server in options["servers"]:
+                results["servers"] += self._measure_server(server, options)
+            if options["micro_iterations"]:
+                seed_operations(options["seed_operations"])
+                results["micro"] = run_micro_benchmarks(options["micro_iterations"])
+        finally:
+            from paymaster.audit import audit_writer
+
+            audit_writer.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            node.shutdown()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stdout.write(self._summary(results))
+        else:
+            self.stdout.write(output)
+
+    def _configure_environment(self, chain_id: str, options):
+        os.environ["chainId"] = chain_id
+        if "paymaster_pk" not in os.environ:
+            os.environ["paymaster_pk"] = DEV_PAYMASTER_PK
+            os.environ["paymaster_add"] = DEV_PAYMASTER
+        if options["get_hash_mode"]:
+            from paymaster import paymaster
+
+            paymaster.GET_HASH_MODE = options["get_hash_mode"]
+        if not options["rate_limits"]:
+            from paymaster.ratelimit import ip_rate_limit, sender_rate_limit
+
+            # Every request comes from the same client and sender
+            ip_rate_limit.rate = sender_rate_limit.rate = 0
+
+    def _create_token(self, chain_id: str, node_url: str):
+        from paymaster.models import ERC20ApprovedToken
+        from paymaster.token_registry import token_registry
+
+        ERC20ApprovedToken.objects.create(
+            name="BENCH",
+            chains={
+                chain_id: {
+                    "address": BENCH_TOKEN,
+                    "decimals": 6,
+                    "exchangeRateSource": node_url + "/price",
+                    "enabled": True,
+                }
+            },
+        )
+        token_registry.invalidate()
+
+    def _meta(self, chain_id: str, options) -> Dict:
+        from paymaster import paymaster
+
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "async_rpc": settings.ASYNC_RPC,
+            "get_hash_mode": paymaster.GET_HASH_MODE,
+            "chain_id": chain_id,
+            "warmup": options["warmup"],
+            "seed_operations": options["seed_operations"],
+        }
+
+    def _body(self, method: str) -> str:
+        if method == "pm_sponsorUserOperation":
+            params = [user_operation(next(self._nonces)), BENCH_TOKEN]
+        else:
+            params = []
+        return json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+
+    def _request(self, client: Client, method: str) -> Tuple[float, bool]:
+        body = self._body(method)
+        start = time.perf_counter()
+        response = client.post("/paymaster", body, content_type="application/json")
+        elapsed = time.perf_counter() - start
+        ok = response.status_code == 200 and "result" in json.loads(response.content)
+        return elapsed, ok
+
+    def _run(
+        self, method: str, requests: int, concurrency: int, url: str = None
+    ) -> Tuple[List[float], int]:
+        per_worker = [requests // concurrency] * concurrency
+        for i in range(requests % concurrency):
+            per_worker[i] += 1
+
+        def worker(n: int) -> List[Tuple[float, bool]]:
+            client = ServerClient(url) if url else Client(HTTP_HOST="localhost")
+            try:
+                return [self._request(client, method) for _ in range(n)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = [s for result in executor.map(worker, per_worker) for s in result]
+        latencies = [elapsed for elapsed, _ in samples]
+        errors = sum(1 for _, ok in samples if not ok)
+        return latencies, errors
+
+    def _measure(self, method: str, requests: int, concurrency: int, url: str = None) -> Dict:
+        start = time.perf_counter()
+        latencies, errors = self._run(method, requests, concurrency, url)
+        elapsed = time.perf_counter() - start
+        return {
+            "method": method,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": errors,
+            "seconds": elapsed,
+            "throughput_rps": len(latencies) / elapsed,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+
+    def _measure_server(self, server: str, options) -> List[Dict]:
+        """
+        Starts `server` on the benchmark database and node, then loads it like the in process
+        endpoint benchmark
+        """
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        url = "http://127.0.0.1:%d" % port
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url(),
+            asyncRPC=str(server == "uvicorn"),
+            getHashMode=options["get_hash_mode"] or os.environ.get("getHashMode", "local"),
+            logLevel="WARNING",
+        )
+        if not options["rate_limits"]:
+            env.update(ipRateLimit="0", senderRateLimit="0")
+        # gunicorn 20 cannot run with `python -m`, use the script installed next to Python
+        gunicorn = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+        command = [gunicorn] + SERVERS[server] + [
+            "--bind", "127.0.0.1:%d" % port, "--workers", str(options["server_workers"]),
+        ]
+        with tempfile.TemporaryFile() as log:
+            process = subprocess.Popen(
+                command, env=env, stdout=subprocess.DEVNULL, stderr=log, cwd=settings.BASE_DIR
+            )
+            try:
+                self._wait_for_server(process, url, log)
+                rows = []
+                for method in options["methods"]:
+                    self._run(method, options["warmup"], 1, url)
+                    for concurrency in options["concurrency"]:
+                        row = self._measure(method, options["requests"], concurrency, url)
+                        rows.append(dict(row, server=server, workers=options["server_workers"]))
+                return rows
+            finally:
+                process.terminate()
+                process.wait(10)
+
+    def _wait_for_server(self, process: subprocess.Popen, url: str, log):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        client = ServerClient(url)
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                client.post("/paymaster", self._body("pm_getApprovedTokens"), "application/json")
+                return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        log.seek(0)
+        raise CommandError("%s did not start:\n%s" % (url, log.read().decode(errors="replace")))
+
+    def _trace_allocations(self, method: str, requests: int) -> Dict:
+        client = Client(HTTP_HOST="localhost")
+        self._request(client, method)
+        peaks = []
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            for _ in range(requests):
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                self._request(client, method)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            retained = tracemalloc.get_traced_memory()[0] - baseline
+        finally:
+            tracemalloc.stop()
+        return {
+            "method": method,
+            "requests": requests,
+            "peak_bytes_per_request": statistics.fmean(peaks),
+            "retained_bytes_per_request": retained / requests,
+        }
+
+    def _summary(self, results: Dict) -> str:
+        lines = []
+        for row in results["endpoint"]:
+            lines.append(
+                "%-24s c=%-3d %8.1f req/s  p50 %7.2fms  p99 %7.2fms  errors %d"
+                % (
+                    row["method"], row["concurrency"], row["throughput_rps"],
+                    row["p50_ms"], row["p99_ms"], row["errors"],
+                )
+            )
+        for row in results["servers"]:
+            lines.append(
+                "%-8s %-24s c=%-3d %8.1f req/s  p50 %7.2fms  p99 %7.2fms  errors %d"
+                % (
+                    row["server"], row["method"], row["concurrency"], row["throughput_rps"],
+                    row["p50_ms"], row["p99_ms"], row["errors"],
+                )
+            )
+        for row in results["allocations"]:
+            lines.append(
+                "%-24s peak %9.0f B/req  retained %7.0f B/req"
+                % (row["method"], row["peak_bytes_per_request"], row["retained_bytes_per_request"])
+            )
+        for name, ns in results["micro"].items():
+            lines.append("%-40s %10.0f ns/op" % (name, ns))
+        return "\n".join(lines)
+
+
+def database_url() -> str:
+    """
+    :return: `DATABASE_URL` of the benchmark database, for the server processes
+    """
+    database = connection.settings_dict
+    if connection.vendor == "sqlite":
+        return "sqlite:///" + str(database["NAME"])
+    return "postgres://%s:%s@%s:%s/%s" % (
+        quote(database["USER"] or "", safe=""),
+        quote(database["PASSWORD"] or "", safe=""),
+        database["HOST"],
+        database["PORT"],
+        database["NAME"],
+    )
+
+
+def _price_payloads() -> List[Tuple[str, dict, bytes]]:
+    """
+    Large generated `exchangeRateSource` responses, the priced token being the last entry
+    :return: `(adapter, token, body)`
+    """
+    contracts = ["0x%040x" % i for i in range(1, 5001)] + [BENCH_TOKEN.lower()]
+    coingecko = {contract: {"eth": 0.00061234, "usd": 1.0001} for contract in contracts}
+    symbols = ["T%d" % i for i in range(5000)] + ["BENCH"]
+    token_prices = {"prices": {symbol: {"eth": "0.00061234"} for symbol in symbols}}
+    ether_prices = {"data": {"currency": "ETH", "rates": {symbol: "1633.0795" for symbol in symbols}}}
+    token = {
+        "address": BENCH_TOKEN,
+        "decimals": 6,
+        "exchangeRateSource": "http://localhost/?contract_addresses=%s" % BENCH_TOKEN.lower(),
+    }
+    return [
+        ("coingecko", token, json.dumps(coingecko).encode()),
+        (
+            "tokenPrice",
+            dict(token, exchangeRateAdapter="tokenPrice", exchangeRatePath="prices.BENCH.eth"),
+            json.dumps(token_prices).encode(),
+        ),
+        (
+            "etherPrice",
+            dict(token, exchangeRateAdapter="etherPrice", exchangeRatePath="data.rates.BENCH"),
+            json.dumps(ether_prices).encode(),
+        ),
+    ]
+
+
+def seed_operations(rows: int, senders: int = 1000, batch_size: int = 5000):
+    """
+    Stores `rows` operations spread over `senders` senders (`BENCH_SENDER` among them), so the
+    database micro benchmarks run against tables and indexes of a production size
+    """
+    from paymaster.models import Operation
+
+    addresses = [BENCH_SENDER] + ["0x%040x" % (i + 2) for i in range(senders - 1)]
+    for start in range(0, rows, batch_size):
+        Operation.objects.bulk_create(
+            [
+                Operation(
+                    chainId="10",
+                    sender=addresses[i % senders],
+                    nonce=i // senders,
+                    callData=b"\xb6\x1d\x27\xf6" + b"\xab" * 196,
+                    hash=i.to_bytes(32, "big"),
+                    status="sponsored",
+                )
+                for i in range(start, min(start + batch_size, rows))
+            ]
+        )
+
+
+def _micro_benchmarks() -> List[Tuple[str, Callable[[], Callable[[], object]], float]]:
+    """
+    :return: `(name, setup, scale)`, `setup()` returns the function to time and `scale` is the
+        fraction of `--micro-iterations` it runs (for the slow database ones)
+    """
+    from paymaster.decoder import decode_user_operation
+    from paymaster.gas import pre_verification_gas, signed_paymaster_and_data
+    from paymaster.models import Operation
+    from paymaster.op_hash import get_paymaster_hash
+    from paymaster.price_sources import CHUNK_SIZE, _select, read_prices, token_path, token_rate
+    from paymaster.serializers import OperationSerialzer
+    from paymaster.signer import build_paymaster_and_data, get_signing_context
+    from paymaster.utils import fast_to_checksum_address
+
+    chain_id = os.environ["chainId"]
+    op_data = user_operation(1)
+    op = decode_user_operation(op_data)
+    paymaster_data = [BENCH_TOKEN, 1, 1700000000, 0, 1633079662, b""]
+    signer = get_signing_context(chain_id)
+    hash = get_paymaster_hash(op, paymaster_data, signer.chain_id, signer.paymaster_address)
+    paymaster_and_data = signed_paymaster_and_data(signer.paymaster_address, BENCH_TOKEN, 1633079662)
+    addresses = cycle(["0x%040x" % i for i in range(1, 1001)])
+
+    def checksum_uncached():
+        return lambda: fast_to_checksum_address.__wrapped__(next(addresses))
+
+    def bulk_insert():
+        def insert():
+            Operation.objects.bulk_create(
+                [
+                    Operation(sender=op.sender, nonce=i, callData=op.callData, hash=hash)
+                    for i in range(100)
+                ]
+            )
+
+        return insert
+
+    def admin_sender_search():
+        from django.contrib import admin
+
+        model_admin = admin.site._registry[Operation]
+        queryset = Operation.objects.order_by("-id")
+        return lambda: list(model_admin.get_search_results(None, queryset, op.sender)[0][:100])
+
+    def read_price(token, body: bytes):
+        chunks = [body[i : i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+        path = token_path(token)
+        return lambda: token_rate(token, read_prices(chunks, [path], max_size=len(body)))
+
+    def load_price(token, body: bytes):
+        path = token_path(token)
+        return lambda: token_rate(token, _select(json.loads(body, parse_float=Decimal), [path]))
+
+    def decode(data: dict):
+        return lambda: decode_user_operation(data)
+
+    def serialize(data: dict):
+        return lambda: OperationSerialzer(data=data).is_valid(raise_exception=True)
+
+    # Up to the 48kb initCode limit of EIP-3860
+    operation_benchmarks = []
+    for size in (1024, 16 * 1024, 48 * 1024):
+        data = large_user_operation(1, size)
+        operation_benchmarks += [
+            ("decode_user_operation_%dkb" % (size // 1024), partial(decode, data), 0.1),
+            ("operation_serializer_%dkb" % (size // 1024), partial(serialize, data), 0.1),
+        ]
+
+    price_benchmarks = []
+    for adapter, token, body in _price_payloads():
+        size = "%dkb" % (len(body) // 1024)
+        price_benchmarks += [
+            ("price_%s_stream_%s" % (adapter, size), partial(read_price, token, body), 0.01),
+            ("price_%s_json_loads_%s" % (adapter, size), partial(load_price, token, body), 0.01),
+        ]
+
+    return [
+        ("decode_user_operation", lambda: lambda: decode_user_operation(op_data), 1),
+        ("pre_verification_gas", lambda: lambda: pre_verification_gas(op, paymaster_and_data), 1),
+        (
+            "get_paymaster_hash",
+            lambda: lambda: get_paymaster_hash(
+                op, paymaster_data, signer.chain_id, signer.paymaster_address
+            ),
+            1,
+        ),
+        ("sign", lambda: lambda: signer.sign(hash), 1),
+        ("build_paymaster_and_data", lambda: lambda: build_paymaster_and_data(*paymaster_data), 1),
+        ("checksum_address_cached", lambda: lambda: fast_to_checksum_address(BENCH_SENDER), 1),
+        ("checksum_address_uncached", checksum_uncached, 1),
+        ("operation_bulk_create_100", bulk_insert, 0.01),
+        ("admin_sender_search", admin_sender_search, 0.1),
+    ] + operation_benchmarks + price_benchmarks
+
+
+def run_micro_benchmarks(iterations: int) -> Dict[str, float]:
+    """
+    :return: nanoseconds per call of each micro benchmark
+    """
+    results = {}
+    for name, setup, scale in _micro_benchmarks():
+        function = setup()
+        number = max(1, int(iterations * scale))
+        seconds = timeit.Timer(function).timeit(number=number)
+        results[name] = seconds / number * 1e9
+    return results
@@ -0,0 +1,157 @@
+"""
+Stage latency histograms and service counters, served in the Prometheus text format on `/metrics`.
+
+Values are kept per process, so with several gunicorn workers each scrape reports the worker
+that answered it (add a `worker` label in the scrape config or run one worker per target).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from django.http import HttpResponse
+
+from .audit import audit_writer
+from .block_tracker import get_block_tracker_stats
+from .budget import budget_ledger
+from .funds import funds_checker
+from .ratelimit import get_rate_limit_stats
+from .rates import rate_cache
+from .sender_lists import sender_lists
+from .signature_cache import signature_cache
+from .utils import checksum_cache_info
+from .web3_pool import get_pool_stats
+
+# Seconds, from a local keccak (~10us) to a slow node round trip
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1, 2.5, 5,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [count per bucket (last one is +Inf), sum]
+        self._series: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> Iterable[str]:
+        yield "# HELP %s %s" % (self.name, self.documentation)
+        yield "# TYPE %s histogram" % self.name
+        with self._lock:
+            series = {label_value: list(values) for label_value, values in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            labels = '%s="%s"' % (self.label, label_value)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                yield '%s_bucket{%s,le="%s"} %d' % (self.name, labels, bound, cumulative)
+            yield "%s_sum{%s} %r" % (self.name, labels, values[-1])
+            yield "%s_count{%s} %d" % (self.name, labels, cumulative)
+
+
+STAGE_SECONDS = Histogram(
+    "paymaster_stage_duration_seconds",
+    "Time spent in each stage of pm_sponsorUserOperation",
+    "stage",
+)
+
+
+class Spans:
+    """
+    Stage durations of one request. Every stage is also observed in `STAGE_SECONDS`
+    """
+
+    __slots__ = ("durations",)
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    async def async_stage(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.durations[name] = seconds
+        STAGE_SECONDS.observe(name, seconds)
+
+    def __str__(self):
+        return " ".join(
+            "%s=%.2fms" % (name, seconds * 1000) for name, seconds in self.durations.items()
+        )
+
+
+def _gauges(name: str, documentation: str, values: Mapping[str, float]) -> Iterable[str]:
+    for key, value in values.items():
+        yield "# HELP %s_%s %s" % (name, key, documentation)
+        yield "# TYPE %s_%s gauge" % (name, key)
+        yield "%s_%s %r" % (name, key, value)
+
+
+def _chain_gauges(
+    name: str, documentation: str, chains: Mapping[str, Mapping[str, float]]
+) -> Iterable[str]:
+    samples: Dict[str, List[Tuple[str, float]]] = {}
+    for chain_id, values in chains.items():
+        for key, value in values.items():
+            samples.setdefault(key, []).append((chain_id, value))
+    for key, values in samples.items():
+        yield "# HELP %s_%s %s" % (name, key, documentation)
+        yield "# TYPE %s_%s gauge" % (name, key)
+        for chain_id, value in values:
+            yield '%s_%s{chain="%s"} %r' % (name, key, chain_id, value)
+
+
+def collect() -> Iterable[str]:
+    yield from STAGE_SECONDS.collect()
+    yield from _gauges(
+        "paymaster_exchange_rate_cache", "Exchange rate cache", rate_cache.stats()
+    )
+    yield from _gauges(
+        "paymaster_signature_cache", "Signed paymasterAndData cache", signature_cache.stats()
+    )
+    yield from _gauges(
+        "paymaster_sender_funds", "Sender balance and allowance checks", funds_checker.stats()
+    )
+    yield from _gauges(
+        "paymaster_sender_lists", "Sender allow and deny lists", sender_lists.stats()
+    )
+    yield from _gauges("paymaster_budget", "Sponsorship budgets", budget_ledger.stats())
+    yield from _gauges("paymaster_rate_limit", "Request throttling", get_rate_limit_stats())
+    yield from _gauges("paymaster_audit", "Sponsored operations audit writer", audit_writer.stats())
+    yield from _gauges(
+        "paymaster_checksum_cache", "EIP-55 checksum address cache", checksum_cache_info()
+    )
+    yield from _chain_gauges("paymaster_node_http", "Node HTTP connection pool", get_pool_stats())
+    yield from _chain_gauges("paymaster_block", "Latest block tracker", get_block_tracker_stats())
+
+
+def metrics(request):
+    return HttpResponse("\n".join(collect()) + "\n", content_type=CONTENT_TYPE)
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:03
+
+import django.core.validators
+from django.db import migrations, models
+import paymaster.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ERC20ApprovedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='ERC20', max_length=200, unique=True)),
+                ('chains', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Operation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender', paymaster.models.EthereumAddressField(default='0x0000000000000000000000000000000000000000')),
+                ('nonce', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('initCode', paymaster.models.HexField(blank=True, max_length=200000, null=True)),
+                ('callData', paymaster.models.HexField(max_length=200000)),
+                ('callGasLimit', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('verificationGasLimit', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('preVerificationGas', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('maxFeePerGas', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('maxPriorityFeePerGas', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('paymasterAndData', paymaster.models.HexField(blank=True, max_length=200000, null=True)),
+                ('signature', paymaster.models.HexField(blank=True, max_length=65, null=True)),
+                ('status', models.CharField(blank=True, max_length=200, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:04
+
+from django.db import migrations, models
+import paymaster.models
+
+BINARY_FIELDS = ["sender", "initCode", "callData", "paymasterAndData", "signature"]
+BATCH_SIZE = 2000
+
+
+def _copy_fields(apps, source_suffix, target_suffix):
+    Operation = apps.get_model("paymaster", "Operation")
+    fields = [field + target_suffix for field in BINARY_FIELDS]
+    batch = []
+    for operation in Operation.objects.order_by("pk").iterator(chunk_size=BATCH_SIZE):
+        for field in BINARY_FIELDS:
+            setattr(operation, field + target_suffix, getattr(operation, field + source_suffix))
+        batch.append(operation)
+        if len(batch) == BATCH_SIZE:
+            Operation.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Operation.objects.bulk_update(batch, fields)
+
+
+def hex_to_binary(apps, schema_editor):
+    _copy_fields(apps, "", "_binary")
+
+
+def binary_to_hex(apps, schema_editor):
+    _copy_fields(apps, "_binary", "")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='sender_binary',
+            field=paymaster.models.EthereumAddressV2Field(null=True),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='initCode_binary',
+            field=paymaster.models.HexV2Field(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='callData_binary',
+            field=paymaster.models.HexV2Field(null=True),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='paymasterAndData_binary',
+            field=paymaster.models.HexV2Field(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='signature_binary',
+            field=paymaster.models.HexV2Field(blank=True, max_length=65, null=True),
+        ),
+        # Lets the reverse migration add the hex column back before copying into it
+        migrations.AlterField(
+            model_name='operation',
+            name='callData',
+            field=paymaster.models.HexField(max_length=200000, null=True),
+        ),
+        migrations.RunPython(hex_to_binary, binary_to_hex),
+        migrations.RemoveField(
+            model_name='operation',
+            name='sender',
+        ),
+        migrations.RemoveField(
+            model_name='operation',
+            name='initCode',
+        ),
+        migrations.RemoveField(
+            model_name='operation',
+            name='callData',
+        ),
+        migrations.RemoveField(
+            model_name='operation',
+            name='paymasterAndData',
+        ),
+        migrations.RemoveField(
+            model_name='operation',
+            name='signature',
+        ),
+        migrations.RenameField(
+            model_name='operation',
+            old_name='sender_binary',
+            new_name='sender',
+        ),
+        migrations.RenameField(
+            model_name='operation',
+            old_name='initCode_binary',
+            new_name='initCode',
+        ),
+        migrations.RenameField(
+            model_name='operation',
+            old_name='callData_binary',
+            new_name='callData',
+        ),
+        migrations.RenameField(
+            model_name='operation',
+            old_name='paymasterAndData_binary',
+            new_name='paymasterAndData',
+        ),
+        migrations.RenameField(
+            model_name='operation',
+            old_name='signature_binary',
+            new_name='signature',
+        ),
+        migrations.AlterField(
+            model_name='operation',
+            name='sender',
+            field=paymaster.models.EthereumAddressV2Field(default='0x0000000000000000000000000000000000000000'),
+        ),
+        migrations.AlterField(
+            model_name='operation',
+            name='callData',
+            field=paymaster.models.HexV2Field(),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['sender', 'nonce'], name='paymaster_o_sender_e90b50_idx'),
+        ),
+    ]
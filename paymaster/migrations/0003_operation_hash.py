@@ -0,0 +1,19 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:07
+
+from django.db import migrations
+import paymaster.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0002_operation_binary_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='hash',
+            field=paymaster.models.HexV2Field(blank=True, db_index=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0003_operation_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='chainId',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+    ]
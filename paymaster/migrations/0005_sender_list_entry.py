@@ -0,0 +1,33 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:28
+
+from django.db import migrations, models
+import paymaster.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0004_operation_chain_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SenderListEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', paymaster.models.EthereumAddressV2Field()),
+                ('list', models.CharField(choices=[('allow', 'Allow'), ('deny', 'Deny')], default='deny', max_length=5)),
+                ('chainId', models.CharField(blank=True, max_length=20, null=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('note', models.CharField(blank=True, default='', max_length=200)),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'sender list entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='senderlistentry',
+            index=models.Index(fields=['address', 'list'], name='paymaster_s_address_da789b_idx'),
+        ),
+    ]
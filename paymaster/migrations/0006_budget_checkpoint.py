@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:32
+
+import django.core.validators
+from django.db import migrations, models
+import paymaster.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0005_sender_list_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chainId', models.CharField(max_length=20)),
+                ('token', paymaster.models.EthereumAddressV2Field()),
+                ('sender', paymaster.models.EthereumAddressV2Field()),
+                ('bucket', models.BigIntegerField(db_index=True)),
+                ('amount', paymaster.models.Uint256Field(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+    ]
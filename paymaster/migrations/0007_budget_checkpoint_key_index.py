@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymaster', '0006_budget_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='budgetcheckpoint',
+            index=models.Index(fields=['chainId', 'token', 'sender', 'bucket'], name='paymaster_b_chainId_4e0037_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django import forms
 from django.db import models
 from django.core.validators import MinValueValidator, int_list_validator
 from django.core import exceptions
@@ -123,21 +124,130 @@ class EthereumAddressField(models.CharField):
         return self.to_python(value)
 
 
+class EthereumAddressV2Field(models.Field):
+    """
+    Ethereum address (EIP55) stored as 20 bytes. Returns the checksummed address.
+    """
+
+    description = "Ethereum address (EIP55)"
+    default_validators = [validate_checksumed_address]
+    default_error_messages = {
+        "invalid": _('"%(value)s" value must be an EIP55 checksummed address.'),
+    }
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def from_db_value(self, value, expression, connection):
+        if value:
+            return fast_to_checksum_address(bytes(value))
+        return value
+
+    def get_prep_value(self, value):
+        if value:
+            return bytes(HexBytes(self.to_python(value)))
+        return value
+
+    def to_python(self, value):
+        if value is not None:
+            try:
+                return fast_to_checksum_address(value)
+            except (TypeError, ValueError):
+                raise exceptions.ValidationError(
+                    self.error_messages["invalid"],
+                    code="invalid",
+                    params={"value": value},
+                )
+        return value
+
+    def formfield(self, **kwargs):
+        defaults = {"form_class": forms.CharField, "max_length": 2 + 40}
+        defaults.update(kwargs)
+        return super().formfield(**defaults)
+
+
+class HexV2Field(models.BinaryField):
+    """
+    Stores hex values as bytes, half the size of a `HexField`. Accepts `bytes` or hex `str`.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        # Some backends return `memoryview`
+        return value if value is None else bytes(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            value = HexBytes(value)
+        return super().get_prep_value(value)
+
+
 class Operation(models.Model):
-    sender = EthereumAddressField(default=NULL_ADDRESS)
+    chainId = models.CharField(max_length=20, null=True, blank=True)
+    sender = EthereumAddressV2Field(default=NULL_ADDRESS)
     nonce = Uint256Field(default=0, validators=[MinValueValidator(0)])
-    initCode = HexField(max_length=200000, null=True, blank=True)
-    callData = HexField(max_length=200000)
+    initCode = HexV2Field(null=True, blank=True)
+    callData = HexV2Field()
     callGasLimit = Uint256Field(default=0, validators=[MinValueValidator(0)])
     verificationGasLimit = Uint256Field(default=0, validators=[MinValueValidator(0)])
     preVerificationGas = Uint256Field(default=0, validators=[MinValueValidator(0)])
     maxFeePerGas = Uint256Field(default=0, validators=[MinValueValidator(0)])
     maxPriorityFeePerGas = Uint256Field(default=0, validators=[MinValueValidator(0)])
-    paymasterAndData = HexField(max_length=200000, null=True, blank=True)
-    signature = HexField(max_length=65, null=True, blank=True)
+    paymasterAndData = HexV2Field(null=True, blank=True)
+    signature = HexV2Field(max_length=65, null=True, blank=True)
+    # Paymaster hash (`getHash`) signed for the operation
+    hash = HexV2Field(max_length=32, null=True, blank=True, db_index=True)
     status = models.CharField(max_length=200, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["sender", "nonce"]),
+        ]
+
 
 class ERC20ApprovedToken(models.Model):
     name = models.CharField(max_length=200, default="ERC20", unique=True)
-    chains = models.JSONField()
\ No newline at end of file
+    chains = models.JSONField()
+
+class SenderListEntry(models.Model):
+    """
+    Sender allowed or denied sponsoring. When a chain has allowed senders only those are
+    sponsored. Entries without chainId apply to every chain
+    """
+
+    ALLOW = "allow"
+    DENY = "deny"
+    LIST_CHOICES = [(ALLOW, "Allow"), (DENY, "Deny")]
+
+    address = EthereumAddressV2Field()
+    list = models.CharField(max_length=5, choices=LIST_CHOICES, default=DENY)
+    chainId = models.CharField(max_length=20, null=True, blank=True)
+    enabled = models.BooleanField(default=True)
+    note = models.CharField(max_length=200, blank=True, default="")
+    # Lets every process pick up changed entries without reloading the lists
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = "sender list entries"
+        indexes = [
+            models.Index(fields=["address", "list"]),
+        ]
+
+
+class BudgetCheckpoint(models.Model):
+    """
+    Token amount sponsored for a sender during one budget bucket (`budgetBucketSeconds`), as
+    flushed by one process. Rows of the same bucket from several checkpoints add up
+    """
+
+    chainId = models.CharField(max_length=20)
+    token = EthereumAddressV2Field()
+    sender = EthereumAddressV2Field()
+    # Unix time divided by the bucket length
+    bucket = models.BigIntegerField(db_index=True)
+    amount = Uint256Field(default=0, validators=[MinValueValidator(0)])
+
+    class Meta:
+        indexes = [
+            # Totals are summed by key and bucket
+            models.Index(fields=["chainId", "token", "sender", "bucket"]),
+        ]
@@ -0,0 +1,103 @@
+from typing import Any, Sequence, Union
+
+from hexbytes import HexBytes
+
+from .decoder import UserOperation
+from .utils import fast_keccak
+
+WORD = 32
+
+# Head of the `UserOperation` tuple: 11 static words (dynamic fields are offsets)
+USER_OP_HEAD_SIZE = 11 * WORD
+
+# Head of `abi.encode(pack(userOp), chainid, paymaster, token, mode, validUntil, fee, exchangeRate)`
+PAYMASTER_HASH_HEAD_SIZE = 8 * WORD
+
+
+def _word(value: int) -> bytes:
+    return value.to_bytes(WORD, "big")
+
+
+def _address_word(address: Union[str, bytes]) -> bytes:
+    return bytes(HexBytes(address)).rjust(WORD, b"\0")
+
+
+def _padded_size(length: int) -> int:
+    return (length + WORD - 1) // WORD * WORD
+
+
+def _encode_bytes(value: bytes) -> bytes:
+    """
+    ABI encoding of a dynamic `bytes` value: length word followed by the right padded data
+    """
+    return _word(len(value)) + value.ljust(_padded_size(len(value)), b"\0")
+
+
+def pack_user_operation(op: UserOperation) -> bytes:
+    """
+    Same result as `CandidePaymaster.pack`: the calldata of the `UserOperation` tuple copied up to
+    (but not including) the `paymasterAndData` length word
+    :param op:
+    :return: packed `UserOperation`
+    """
+    init_code = op.initCode
+    call_data = op.callData
+    paymaster_and_data = op.paymasterAndData
+
+    init_code_offset = USER_OP_HEAD_SIZE
+    call_data_offset = init_code_offset + WORD + _padded_size(len(init_code))
+    paymaster_and_data_offset = call_data_offset + WORD + _padded_size(len(call_data))
+    signature_offset = (
+        paymaster_and_data_offset + WORD + _padded_size(len(paymaster_and_data))
+    )
+
+    return b"".join(
+        (
+            _address_word(op.sender),
+            _word(op.nonce),
+            _word(init_code_offset),
+            _word(call_data_offset),
+            _word(op.callGasLimit),
+            _word(op.verificationGasLimit),
+            _word(op.preVerificationGas),
+            _word(op.maxFeePerGas),
+            _word(op.maxPriorityFeePerGas),
+            _word(paymaster_and_data_offset),
+            _word(signature_offset),
+            _encode_bytes(init_code),
+            _encode_bytes(call_data),
+        )
+    )
+
+
+def get_paymaster_hash(
+    op: UserOperation,
+    paymaster_data: Sequence[Any],
+    chain_id: int,
+    paymaster_address: str,
+) -> bytes:
+    """
+    Calculates `CandidePaymaster.getHash(userOp, paymasterData)` without calling the node
+    :param op:
+    :param paymaster_data: `[token, mode, validUntil, fee, exchangeRate, signature]`, signature is ignored
+    :param chain_id: `block.chainid` of the chain the paymaster is deployed on
+    :param paymaster_address: `address(this)` of the paymaster contract
+    :return: Keccak256 of the abi encoded paymaster data as `bytes`
+    """
+    token, mode, valid_until, fee, exchange_rate = paymaster_data[:5]
+    packed = pack_user_operation(op)
+    return fast_keccak(
+        b"".join(
+            (
+                _word(PAYMASTER_HASH_HEAD_SIZE),
+                _word(int(chain_id)),
+                _address_word(paymaster_address),
+                _address_word(token),
+                _word(mode),
+                _word(valid_until),
+                _word(fee),
+                _word(exchange_rate),
+                _encode_bytes(packed),
+            )
+        )
+    )
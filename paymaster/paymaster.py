@@ -1,108 +1,279 @@
-import math
+from .decoder import decode_user_operation
+from .op_hash import get_paymaster_hash
+from .web3_pool import get_client
+from .rates import rate_cache, RateUnavailable
+from .block_tracker import get_block_tracker
+from .batch import batch_resolve, dispatch_batch
+from .token_registry import token_registry
+from .signer import build_paymaster_and_data, get_signing_context
+from .audit import audit_writer
+from .signature_cache import signature_cache, signature_key
+from .funds import funds_checker
+from .sender_lists import sender_lists
+from .budget import budget_ledger
+from .ratelimit import (
+    THROTTLED_CODE,
+    THROTTLED_MESSAGE,
+    client_ip,
+    ip_rate_limit,
+    sender_rate_limit,
+    throttled_response,
+)
+from .gas import exceeded_cap, max_token_cost, pre_verification_gas, signed_paymaster_and_data
+from .chains import is_served_chain, resolve_chain_id
+from .metrics import Spans
 
-from .models import ERC20ApprovedToken
-from .serializers import OperationSerialzer
-
-from jsonrpcserver import method, Result, Success, dispatch, Error
+from jsonrpcserver import method, Result, Success, Error
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
 
 import environ
-import requests
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-from hexbytes import HexBytes
-import re
-from eth_account.messages import defunct_hash_message
+import logging
+import time
 
 env = environ.Env()
+logger = logging.getLogger(__name__)
+# Sampled with `logSampleRate`, see settings
+operation_logger = logging.getLogger("paymaster.operations")
+
+# `pm_getApprovedTokens` result by chainId, as (expires at, result)
+_approved_tokens = {}
+
+# Seconds the signed paymaster data stays valid after the latest block
+VALID_FOR = 180
+
+# Seconds a `pm_getApprovedTokens` result is reused
+APPROVED_TOKENS_TTL = env.float('approvedTokensTTL', default=5)
+VERIFY_GAS_LIMITS = env.bool('verifyGasLimits', default=True)
+# `local`, `remote` or `verify`, see `_get_paymaster_hash`
+GET_HASH_MODE = env('getHashMode', default='local')
 
 
-# Todo: check wallet balance if it has the required tokens to pay for the paymaster fees
-# Todo: accept the full bundle as an input and check the approve operation
 @method
-def pm_sponsorUserOperation(request, token_address) -> Result:
-    w3 = Web3(Web3.HTTPProvider(env('HTTPProvider')))
-    chainId = str(env('chainId'))
-    if chainId == "10":
-        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-    print('\033[96m' + "Paymaster Operation received." + '\033[39m')
-    token_object = ERC20ApprovedToken.objects.filter(chains__has_key=chainId).filter(chains__icontains=token_address)
-    if len(token_object) < 1:
+def pm_sponsorUserOperation(chainId, request, token_address) -> Result:
+    if not is_served_chain(chainId):
+        return Error(4, "Unsupported chain", data="")
+    spans = Spans()
+    with spans.stage("token"):
+        token = token_registry.get(chainId, token_address)
+    if token is None or not token["enabled"]:
         return Error(2, "Unsupported token", data="")
 
-    token = token_object.first().chains[chainId]
-    if not token["enabled"]:
-        return Error(2, "Unsupported token", data="")
+    with spans.stage("decode"):
+        op = _decode_operation(request)
+    if op is None:
+        return Error(400, "BAD REQUEST")
+    with spans.stage("senders"):
+        allowed = sender_lists.is_allowed(chainId, op.sender)
+    if not allowed:
+        return Error(9, "Sender not allowed", data="")
+    if not sender_rate_limit.allow(op.sender):
+        return Error(THROTTLED_CODE, THROTTLED_MESSAGE, data="")
 
-    serialzer = OperationSerialzer(data=request)
+    try:
+        with spans.stage("rate"):
+            exchange_rate = batch_resolve(("rate", chainId, token["address"]), lambda: rate_cache.get(chainId, token))
+    except RateUnavailable:
+        return Error(3, "Exchange rate unavailable", data="")
+    with spans.stage("gas"):
+        error = _gas_error(chainId, token, op, exchange_rate)
+    if error is not None:
+        return error
+    cost = max_token_cost(op, exchange_rate)
+    error = _cap_error(token, op, cost)
+    if error is not None:
+        return error
 
-    if not serialzer.is_valid():
-        return Error(400, "BAD REQUEST")
+    with spans.stage("block"):
+        block_timestamp = batch_resolve(("block", chainId), get_block_tracker(chainId).latest_timestamp)
+    if funds_checker.enabled:
+        spender = get_signing_context(chainId).paymaster_address
+        block_number = get_block_tracker(chainId).block_number
+        with spans.stage("funds"):
+            funds = batch_resolve(
+                ("funds", chainId, op.sender, token["address"], block_number),
+                lambda: funds_checker.get(chainId, op.sender, token["address"], spender, block_number),
+            )
+        error = _funds_error(funds, op, token["address"], spender, cost)
+        if error is not None:
+            return error
+
+    key = signature_key(chainId, token, op, exchange_rate)
+    cached = signature_cache.get(key)
+    # The cost of a cached operation was counted when it was signed
+    error = _budget_error(chainId, token, op, cost if cached is None else 0)
+    if error is not None:
+        return error
+    if cached is not None:
+        operation_logger.info("Paymaster Operation sponsored again. sender=%s nonce=%d", op.sender, op.nonce)
+        return Success(cached[0])
+
+    paymasterAndData, hash = _sign_operation(chainId, token, op, exchange_rate, block_timestamp, spans)
+    budget_ledger.record(chainId, token, op.sender, cost)
+    signature_cache.put(key, VALID_FOR, paymasterAndData, hash)
+    audit_writer.record(chainId, op, paymasterAndData, hash)
+    operation_logger.info("Paymaster Operation sponsored. sender=%s nonce=%d %s", op.sender, op.nonce, spans)
+    return Success(paymasterAndData)
+
+@method
+def pm_getApprovedTokens(chainId) -> Result:
+    if not is_served_chain(chainId):
+        return Error(4, "Unsupported chain", data="")
+    result = _get_cached_approved_tokens(chainId)
+    if result is None:
+        tokens = token_registry.tokens(chainId)
+        result = _build_approved_tokens(chainId, tokens, rate_cache.get_many(chainId, tokens))
+        if result is None:
+            return Error(3, "Exchange rate unavailable", data="")
+    return Success(result)
+
+
+def _get_cached_approved_tokens(chainId):
+    cached = _approved_tokens.get(chainId)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def _build_approved_tokens(chainId, tokens, quotes):
+    """
+    Lists the tokens with a rate, flagging the ones older than `exchangeRateTTL`, and caches
+    the list for `approvedTokensTTL` seconds
+    :param quotes: `(rate, stale)` by lowercase token address
+    :return: `None` if no token has a rate
+    """
+    paymaster_address = get_signing_context(chainId).paymaster_address
+    result = []
+    for token in tokens:
+        quote = quotes.get(token["address"].lower())
+        if quote is None:
+            continue
+        result.append({
+            "address": token["address"],
+            "paymaster": paymaster_address,
+            "exchangeRate": quote[0],
+            "stale": quote[1],
+        })
+    if tokens and not result:
+        return None
+    _approved_tokens[chainId] = (time.monotonic() + APPROVED_TOKENS_TTL, result)
+    return result
+
+
+def _decode_operation(request):
+    try:
+        return decode_user_operation(request)
+    except ValidationError:
+        return None
+
+
+def _gas_error(chainId, token, op, exchange_rate):
+    """
+    :return: JSON-RPC error if `preVerificationGas` does not cover the packed operation
+    """
+    if not VERIFY_GAS_LIMITS:
+        return None
+    paymaster = get_signing_context(chainId).paymaster_address
+    required = pre_verification_gas(
+        op, signed_paymaster_and_data(paymaster, token["address"], exchange_rate)
+    )
+    if op.preVerificationGas < required:
+        return Error(7, "preVerificationGas too low", data=hex(required))
+    return None
+
+
+def _cap_error(token, op, cost):
+    """
+    :param cost: maximum token cost of `op`
+    :return: JSON-RPC error if `op` goes over a cap of `token`
+    """
+    cap = exceeded_cap(token, op, cost)
+    if cap is not None:
+        return Error(8, "Operation exceeds the token %s" % cap, data="")
+    return None
+
+
+def _funds_error(funds, op, token_address, spender, cost):
+    """
+    :param funds: balance and allowance of the sender, `None` when unknown
+    :return: JSON-RPC error if they do not cover the maximum token cost of `op`
+    """
+    if funds is None:
+        return None
+    shortfall = funds_checker.shortfall(funds, op, token_address, spender, cost)
+    if shortfall == "balance":
+        return Error(5, "Insufficient token balance", data="")
+    if shortfall == "allowance":
+        return Error(6, "Insufficient token allowance", data="")
+    return None
 
-    op = dict(serialzer.data)
-    op["maxFeePerGas"] = int(op["maxFeePerGas"], 16)
-    op["maxPriorityFeePerGas"] = int(op["maxPriorityFeePerGas"], 16)
-    op["callGasLimit"] = int(op["callGasLimit"], 16)
-    op["verificationGasLimit"] = int(op["verificationGasLimit"], 16)
-    op["preVerificationGas"] = int(op["preVerificationGas"], 16)
-    op["nonce"] = int(op["nonce"], 16)
 
-    abi = [{"inputs":[{"components":[{"internalType":"address","name":"sender","type":"address"},{"internalType":"uint256","name":"nonce","type":"uint256"},{"internalType":"bytes","name":"initCode","type":"bytes"},{"internalType":"bytes","name":"callData","type":"bytes"},{"internalType":"uint256","name":"callGasLimit","type":"uint256"},{"internalType":"uint256","name":"verificationGasLimit","type":"uint256"},{"internalType":"uint256","name":"preVerificationGas","type":"uint256"},{"internalType":"uint256","name":"maxFeePerGas","type":"uint256"},{"internalType":"uint256","name":"maxPriorityFeePerGas","type":"uint256"},{"internalType":"bytes","name":"paymasterAndData","type":"bytes"},{"internalType":"bytes","name":"signature","type":"bytes"}],"internalType":"struct UserOperation","name":"userOp","type":"tuple"},{"components":[{"internalType":"contract IERC20Metadata","name":"token","type":"address"},{"internalType":"enum CandidePaymaster.SponsoringMode","name":"mode","type":"uint8"},{"internalType":"uint48","name":"validUntil","type":"uint48"},{"internalType":"uint256","name":"fee","type":"uint256"},{"internalType":"uint256","name":"exchangeRate","type":"uint256"},{"internalType":"bytes","name":"signature","type":"bytes"}],"internalType":"struct CandidePaymaster.PaymasterData","name":"paymasterData","type":"tuple"}],"name":"getHash","outputs":[{"internalType":"bytes32","name":"","type":"bytes32"}],"stateMutability":"view","type":"function"}]
-    paymaster = w3.eth.contract(address=env('paymaster_add'), abi=abi)
+def _budget_error(chainId, token, op, cost):
+    """
+    :param cost: maximum token cost of `op`
+    :return: JSON-RPC error if sponsoring `op` goes over a budget of `token`
+    """
+    budget = budget_ledger.exceeded(chainId, token, op.sender, cost)
+    if budget is not None:
+        return Error(10, "Sponsorship budget exceeded", data=budget)
+    return None
 
-    exchange_rate = _get_token_rate(token)
+
+def _sign_operation(chainId, token, op, exchange_rate, block_timestamp, spans):
+    """
+    Hashes and signs the paymaster data of `op`. Does no I/O unless `getHashMode` asks the node
+    :param spans: `Spans` of the request, receives the getHash, sign and encode stages
+    :return: `paymasterAndData` hex string (not 0x prefixed) and the signed hash
+    """
+    signer = get_signing_context(chainId)
 
     paymasterData = [
         token["address"],
         1,  # SponsoringMode (GAS ONLY)
-        w3.eth.get_block("latest").timestamp + 180,  # validUntil 3 minutes in the future
+        block_timestamp + VALID_FOR,  # validUntil 3 minutes in the future
         0,  # Fee (in case mode == 0)
         exchange_rate,  # Exchange Rate
         b'',
     ]
 
-    hash = paymaster.functions.getHash(op, paymasterData).call()
-    hash = defunct_hash_message(hash)
-    paymasterSigner = w3.eth.account.from_key(env('paymaster_pk'))
-    sig = paymasterSigner.signHash(hash)
-    paymasterData[-1] = HexBytes(sig.signature.hex())
-
-    paymasterAndData = (
-          str(paymasterData[0][2:])
-        + str("{0:0{1}x}".format(paymasterData[1], 2))
-        + str("{0:0{1}x}".format(paymasterData[2], 12))
-        + str("{0:0{1}x}".format(paymasterData[3], 64))
-        + str("{0:0{1}x}".format(paymasterData[4], 64))
-        + sig.signature.hex()[2:]
-    )
+    with spans.stage("getHash"):
+        hash = _get_paymaster_hash(signer, op, paymasterData)
+    with spans.stage("sign"):
+        paymasterData[-1] = signer.sign(hash)
+    with spans.stage("encode"):
+        paymasterAndData = build_paymaster_and_data(*paymasterData).hex()
+    return paymasterAndData, hash
 
-    return Success(paymasterAndData)
 
-@method
-def pm_getApprovedTokens() -> Result:
-    result = []
-    approved_tokens = ERC20ApprovedToken.objects.filter(chains__has_key=env('chainId'))
-    for approvedToken in approved_tokens:
-        token = approvedToken.chains[env('chainId')]
-        exchange_rate = _get_token_rate(token)
-        result.append({
-            "address": token["address"],
-            "paymaster": env('paymaster_add'),
-            "exchangeRate": exchange_rate
-        })
-    return Success(result)
+def _get_paymaster_hash(signer, op, paymasterData):
+    """
+    `getHashMode` selects how the hash to sign is obtained:
+    `local` computes it in-process, `remote` calls `getHash` on the node and
+    `verify` does both and prefers the node's result when they differ
+    """
+    if GET_HASH_MODE == 'remote':
+        return _get_remote_paymaster_hash(signer, op, paymasterData)
+
+    hash = get_paymaster_hash(op, paymasterData, signer.chain_id, signer.paymaster_address)
+    if GET_HASH_MODE == 'verify':
+        remote_hash = _get_remote_paymaster_hash(signer, op, paymasterData)
+        if remote_hash != hash:
+            logger.warning("Local getHash mismatch: %s != %s", hash.hex(), remote_hash.hex())
+            return remote_hash
+    return hash
 
 
-def _get_token_rate(token):
-    rate_request = requests.get(token["exchangeRateSource"])
-    rate_float = 1 / float(re.search(r'"eth":(\d+\.\d+)', rate_request.content.decode()).group(1))
-    rate = math.ceil(rate_float * (10 ** token["decimals"]))
-    return rate
+def _get_remote_paymaster_hash(signer, op, paymasterData):
+    paymaster = get_client(str(signer.chain_id)).paymaster
+    return paymaster.functions.getHash(op.as_dict(), paymasterData).call()
 
 
 @csrf_exempt
-def jsonrpc(request):
+def jsonrpc(request, chain_id=None):
+    if not ip_rate_limit.allow(client_ip(request)):
+        return throttled_response()
     return HttpResponse(
-        dispatch(request.body.decode()), content_type="application/json"
+        dispatch_batch(request.body.decode(), context=resolve_chain_id(chain_id, request)),
+        content_type="application/json",
     )
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+Adapters reading token prices from the JSON returned by `exchangeRateSource`.
+
+A token selects its adapter with `exchangeRateAdapter` in `ERC20ApprovedToken.chains`:
+
+- `coingecko` (default): price of 1 token in ether, at `<contract>.eth` of the coingecko
+  `simple/token_price` response, `contract` being the token address or the single
+  `contract_addresses` of the source
+- `tokenPrice`: price of 1 token in ether, at `exchangeRatePath`
+- `etherPrice`: price of 1 ether in tokens, at `exchangeRatePath`
+
+`exchangeRatePath` uses the ijson prefix syntax: keys separated by dots, `item` for the
+elements of an array and `*` for any key. Responses are streamed and read only until every
+requested path is found, with `ijson` when installed. Bodies over
+`exchangeRateMaxResponseSize` bytes are refused. Prices are kept as `Decimal` and converted
+with exact integer arithmetic.
+"""
+import json
+import math
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+import environ
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+env = environ.Env()
+
+Path = Tuple[str, ...]
+Number = Union[int, Decimal]
+
+MAX_RESPONSE_SIZE = env.int("exchangeRateMaxResponseSize", default=1024 * 1024)
+CHUNK_SIZE = 16 * 1024
+# Largest power of ten of a price
+MAX_EXPONENT = 100
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+def parse_path(path: str) -> Path:
+    return tuple(path.split(".")) if path else ()
+
+
+class PriceAdapter:
+    default_path: Optional[str] = None
+
+    def path(self, token) -> Path:
+        path = token.get("exchangeRatePath", self.default_path)
+        if path is None:
+            raise ValueError("exchangeRatePath is required by %s" % type(self).__name__)
+        return parse_path(path)
+
+    def to_rate(self, token, price: Number) -> int:
+        """
+        :param price: value read at `path(token)`
+        :return: token amount (in token decimals) worth 1 ether, rounded up
+        """
+        raise NotImplementedError
+
+
+class TokenPriceAdapter(PriceAdapter):
+    def to_rate(self, token, price: Number) -> int:
+        price = Fraction(price)
+        if price <= 0:
+            raise ValueError("Invalid token price %s" % price)
+        return math.ceil(10 ** token["decimals"] / price)
+
+
+class CoingeckoAdapter(TokenPriceAdapter):
+    def path(self, token) -> Path:
+        if "exchangeRatePath" in token:
+            return super().path(token)
+        # The source may quote the same token on another chain, like WETH on mainnet
+        query = parse_qs(urlparse(token["exchangeRateSource"]).query)
+        contracts = [
+            contract.lower()
+            for value in query.get("contract_addresses", [])
+            for contract in value.split(",")
+        ]
+        address = token["address"].lower()
+        if address not in contracts:
+            address = contracts[0] if len(contracts) == 1 else "*"
+        return address, "eth"
+
+
+class EtherPriceAdapter(PriceAdapter):
+    def to_rate(self, token, price: Number) -> int:
+        price = Fraction(price)
+        if price <= 0:
+            raise ValueError("Invalid ether price %s" % price)
+        return math.ceil(price * 10 ** token["decimals"])
+
+
+ADAPTERS: Dict[str, PriceAdapter] = {
+    "coingecko": CoingeckoAdapter(),
+    "tokenPrice": TokenPriceAdapter(),
+    "etherPrice": EtherPriceAdapter(),
+}
+
+
+def get_adapter(token) -> PriceAdapter:
+    name = token.get("exchangeRateAdapter", "coingecko")
+    try:
+        return ADAPTERS[name]
+    except KeyError:
+        raise ValueError("Unknown exchangeRateAdapter %s" % name)
+
+
+def token_path(token) -> Path:
+    """
+    :param token: token config from `ERC20ApprovedToken.chains`
+    :return: path of the price of `token` in its `exchangeRateSource` response
+    """
+    return get_adapter(token).path(token)
+
+
+def token_rate(token, prices: Dict[Path, Number]) -> int:
+    """
+    :param prices: numbers read from the `exchangeRateSource` of `token`
+    :return: token amount (in token decimals) worth 1 ether
+    """
+    adapter = get_adapter(token)
+    path = adapter.path(token)
+    if path not in prices:
+        raise ValueError("No price at %s" % ".".join(path))
+    return adapter.to_rate(token, prices[path])
+
+
+def _matches(prefix: Path, path: Path) -> bool:
+    return len(prefix) == len(path) and all(
+        part == "*" or part == key for part, key in zip(path, prefix)
+    )
+
+
+def _number(value) -> Optional[Number]:
+    if isinstance(value, float):
+        value = Decimal(repr(value))
+    elif isinstance(value, str):
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            return None
+    if isinstance(value, Decimal):
+        # NaN, infinities and huge exponents cannot be converted to an exact rate
+        if not value.is_finite() or abs(value.adjusted()) > MAX_EXPONENT:
+            return None
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class _PathMatcher:
+    """
+    Keeps the first number seen at each requested path of a stream of ijson events
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        self.prices: Dict[Path, Number] = {}
+        # Most paths have no wildcard and are matched on the prefix string
+        self.exact: Dict[str, Path] = {}
+        self.wildcards: Set[Path] = set()
+        for path in paths:
+            if "*" in path:
+                self.wildcards.add(path)
+            else:
+                self.exact[".".join(path)] = path
+
+    def feed(self, prefix: str, event: str, value) -> bool:
+        """
+        :return: `True` once every path is found
+        """
+        if event != "number" and event != "string":
+            return False
+        path = self.exact.get(prefix)
+        if path is not None:
+            self._found(path, value)
+            if path in self.prices:
+                del self.exact[prefix]
+        if self.wildcards:
+            prefix_path = parse_path(prefix)
+            for path in [path for path in self.wildcards if _matches(prefix_path, path)]:
+                self._found(path, value)
+                if path in self.prices:
+                    self.wildcards.discard(path)
+        return not self.exact and not self.wildcards
+
+    def _found(self, path: Path, value):
+        number = _number(value)
+        if number is not None:
+            self.prices[path] = number
+
+
+def _walk(document, path: Path) -> Iterator:
+    if not path:
+        yield document
+        return
+    part, rest = path[0], path[1:]
+    if isinstance(document, dict):
+        values = document.values() if part == "*" else [document[part]] if part in document else []
+    elif isinstance(document, list) and part in ("item", "*"):
+        values = document
+    else:
+        values = []
+    for value in values:
+        yield from _walk(value, rest)
+
+
+def _select(document, paths: Iterable[Path]) -> Dict[Path, Number]:
+    prices: Dict[Path, Number] = {}
+    for path in paths:
+        for value in _walk(document, path):
+            number = _number(value)
+            if number is not None:
+                prices[path] = number
+                break
+    return prices
+
+
+def _single_exact(paths: Set[Path]) -> bool:
+    return len(paths) == 1 and "*" not in next(iter(paths))
+
+
+class _CappedReader:
+    """
+    File-like view of response chunks for `ijson`, refusing more than `max_size` bytes
+    """
+
+    def __init__(self, chunks: Iterable[bytes], max_size: int):
+        self._chunks = iter(chunks)
+        self._max_size = max_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # `ijson` probes the type of the stream with `read(0)`
+        if size == 0:
+            return b""
+        chunk = next(self._chunks, b"")
+        self.size += len(chunk)
+        if self.size > self._max_size:
+            raise ResponseTooLarge("Response is larger than %d bytes" % self._max_size)
+        return chunk
+
+
+class _AsyncCappedReader:
+    def __init__(self, chunks: AsyncIterator[bytes], max_size: int):
+        self._chunks = chunks
+        self._max_size = max_size
+        self.size = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b""
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        self.size += len(chunk)
+        if self.size > self._max_size:
+            raise ResponseTooLarge("Response is larger than %d bytes" % self._max_size)
+        return chunk
+
+
+def read_prices(
+    chunks: Iterable[bytes], paths: Iterable[Path], max_size: int = MAX_RESPONSE_SIZE
+) -> Dict[Path, Number]:
+    """
+    :param chunks: response body
+    :param paths: paths to read
+    :return: number found at each path, paths without a number are left out
+    :raises ValueError: if the body is not JSON or larger than `max_size`
+    """
+    reader = _CappedReader(chunks, max_size)
+    if ijson is None:
+        body = b"".join(iter(reader.read, b""))
+        return _select(json.loads(body, parse_float=Decimal), paths)
+    paths = set(paths)
+    try:
+        if _single_exact(paths):
+            # Filtered by the ijson backend, much cheaper than matching every event
+            (path,) = paths
+            for value in ijson.items(reader, ".".join(path), use_float=False):
+                number = _number(value)
+                if number is not None:
+                    return {path: number}
+            return {}
+        matcher = _PathMatcher(paths)
+        for prefix, event, value in ijson.parse(reader, use_float=False):
+            if matcher.feed(prefix, event, value):
+                break
+        return matcher.prices
+    except ijson.JSONError as e:
+        raise ValueError(str(e)) from e
+
+
+async def async_read_prices(
+    chunks: AsyncIterator[bytes], paths: Iterable[Path], max_size: int = MAX_RESPONSE_SIZE
+) -> Dict[Path, Number]:
+    """
+    Same as `read_prices` for an async stream of chunks
+    """
+    reader = _AsyncCappedReader(chunks, max_size)
+    if ijson is None:
+        body = bytearray()
+        chunk = await reader.read()
+        while chunk:
+            body += chunk
+            chunk = await reader.read()
+        return _select(json.loads(bytes(body), parse_float=Decimal), paths)
+    paths = set(paths)
+    try:
+        if _single_exact(paths):
+            (path,) = paths
+            async for value in ijson.items_async(reader, ".".join(path), use_float=False):
+                number = _number(value)
+                if number is not None:
+                    return {path: number}
+            return {}
+        matcher = _PathMatcher(paths)
+        async for prefix, event, value in ijson.parse_async(reader, use_float=False):
+            if matcher.feed(prefix, event, value):
+                break
+        return matcher.prices
+    except ijson.JSONError as e:
+        raise ValueError(str(e)) from e
@@ -0,0 +1,242 @@
+"""
+Request throttling by client IP and by operation sender, with GCRA (a token bucket that only
+stores one timestamp per key).
+
+Each key may send `burst` requests at once, then one every `1 / rate` seconds. The state of a
+key is its theoretical arrival time (TAT), it expires once the TAT is in the past, so the
+stores only hold recently active callers.
+
+The IP limit is off unless `ipRateLimit` is set. Behind a proxy or load balancer every request
+comes from the proxy address, so `clientIpHeader` must name the header holding the client
+address (e.g. `X-Forwarded-For`) before enabling it, or every client shares one limit.
+
+`rateLimitBackend` selects where the TATs are kept:
+
+- `memory` (default): per process, bounded to `rateLimitMaxKeys` keys (least recently used
+  keys are dropped first). Each gunicorn worker throttles on its own
+- `sqlite`: a SQLite file at `rateLimitPath`, shared by every worker of the host
+- a dotted path to a class with the same interface as `RateLimitBackend`
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import environ
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+
+env = environ.Env()
+
+THROTTLED_CODE = -32005
+THROTTLED_MESSAGE = "Too many requests"
+
+# Request header holding the client address set by a trusted proxy, e.g. `X-Forwarded-For`
+CLIENT_IP_HEADER = env("clientIpHeader", default=None)
+
+
+class RateLimitBackend:
+    # Whether `update` may block, the async endpoint then calls it from a thread
+    blocking = False
+
+    def update(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        """
+        Atomically checks and advances the TAT of `key`
+        :param interval: seconds between requests at the sustained rate
+        :param tolerance: seconds the TAT may be ahead of `now`, `interval * (burst - 1)`
+        :return: `True` if the request is allowed
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            if tat - now > tolerance:
+                return False
+            self._tats[key] = tat + interval
+            self._tats.move_to_end(key)
+            # Drops the least recently used keys over the bound, and expired ones on the way
+            while self._tats and (
+                len(self._tats) > self.max_keys or next(iter(self._tats.values())) < now
+            ):
+                self._tats.popitem(last=False)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+class SQLiteBackend(RateLimitBackend):
+    blocking = True
+
+    # Expired keys are deleted every `PURGE_EVERY` updates
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._updates = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL)"
+        )
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _reset(self):
+        # SQLite connections must not be used across a fork
+        self._local = threading.local()
+
+    def update(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tat FROM rate_limit WHERE key = ?", (key,)).fetchone()
+            tat = max(row[0] if row else now, now)
+            allowed = tat - now <= tolerance
+            if allowed:
+                connection.execute(
+                    "INSERT OR REPLACE INTO rate_limit (key, tat) VALUES (?, ?)",
+                    (key, tat + interval),
+                )
+            self._updates += 1
+            if self._updates % self.PURGE_EVERY == 0:
+                connection.execute("DELETE FROM rate_limit WHERE tat < ?", (now,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+class RateLimit:
+    def __init__(self, name: str, rate: float, burst: int):
+        """
+        :param rate: sustained requests per second, `0` disables the limit
+        :param burst: requests allowed at once
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.allowed = 0
+        self.throttled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def allow(self, value: str) -> bool:
+        """
+        :return: `False` if `value` went over the limit
+        """
+        if not self.enabled:
+            return True
+        interval = 1 / self.rate
+        allowed = get_backend().update(
+            "%s:%s" % (self.name, value), time.time(), interval, interval * (self.burst - 1)
+        )
+        return self._count(allowed)
+
+    async def async_allow(self, value: str) -> bool:
+        """
+        Same as `allow`, blocking backends are called from a thread
+        """
+        if get_backend().blocking and self.enabled:
+            return await sync_to_async(self.allow, thread_sensitive=False)(value)
+        return self.allow(value)
+
+    def _count(self, allowed: bool) -> bool:
+        if allowed:
+            self.allowed += 1
+        else:
+            self.throttled += 1
+        return allowed
+
+
+def throttled_response() -> JsonResponse:
+    """
+    :return: JSON-RPC error answering a whole request (single or batch) from a throttled client
+    """
+    return JsonResponse(
+        {
+            "jsonrpc": "2.0",
+            "error": {"code": THROTTLED_CODE, "message": THROTTLED_MESSAGE},
+            "id": None,
+        },
+        status=429,
+    )
+
+
+def client_ip(request) -> str:
+    """
+    :return: address of the client, read from the `clientIpHeader` request header (the first
+        address of a `X-Forwarded-For` list) when the server is behind a proxy
+    """
+    if CLIENT_IP_HEADER:
+        forwarded = request.headers.get(CLIENT_IP_HEADER)
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+_backend: Optional[RateLimitBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> RateLimitBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(env("rateLimitBackend", default="memory"))
+    return _backend
+
+
+def _create_backend(name: str) -> RateLimitBackend:
+    if name == "memory":
+        return MemoryBackend(env.int("rateLimitMaxKeys", default=100000))
+    if name == "sqlite":
+        return SQLiteBackend(
+            env(
+                "rateLimitPath",
+                default=os.path.join(tempfile.gettempdir(), "paymaster-ratelimit.sqlite3"),
+            ),
+            env.float("sqliteBusyTimeout", default=5),
+        )
+    return import_string(name)()
+
+
+ip_rate_limit = RateLimit(
+    "ip", env.float("ipRateLimit", default=0), env.int("ipRateLimitBurst", default=50)
+)
+sender_rate_limit = RateLimit(
+    "sender", env.float("senderRateLimit", default=2), env.int("senderRateLimitBurst", default=10)
+)
+
+
+def get_rate_limit_stats():
+    return {
+        "ip_allowed": ip_rate_limit.allowed,
+        "ip_throttled": ip_rate_limit.throttled,
+        "sender_allowed": sender_rate_limit.allowed,
+        "sender_throttled": sender_rate_limit.throttled,
+    }
@@ -0,0 +1,372 @@
+"""
+Exchange rate cache refreshed by a background thread.
+
+Rates are kept per (chainId, token address). A rate older than `exchangeRateTTL` is still
+served while the refresher fetches a new one, but once it is older than
+`exchangeRateMaxStaleness` it is refused and `RateUnavailable` is raised. Tokens sharing an
+`exchangeRateSource` are fetched with a single request, and each token reads its price from
+the response with the adapter selected in its config (see `price_sources`).
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import environ
+import requests
+
+from .background import BackgroundThread
+from .price_sources import (
+    CHUNK_SIZE,
+    Number,
+    Path,
+    async_read_prices,
+    read_prices,
+    token_path,
+    token_rate,
+)
+
+env = environ.Env()
+
+
+class RateUnavailable(Exception):
+    pass
+
+
+# Errors raised by a failing or malformed `exchangeRateSource`
+FETCH_ERRORS = (
+    requests.RequestException,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    KeyError,
+    ValueError,
+)
+
+
+def fetch_prices(url: str, paths: Iterable[Path], timeout: float) -> Dict[Path, Number]:
+    """
+    :param url: `exchangeRateSource` of one or more tokens
+    :param paths: price paths of those tokens, see `price_sources.token_path`
+    :param timeout: seconds to wait for the source
+    :return: number found at each path
+    """
+    with requests.get(url, timeout=timeout, stream=True) as response:
+        return read_prices(response.iter_content(CHUNK_SIZE), paths)
+
+
+async def async_fetch_prices(
+    session: aiohttp.ClientSession, url: str, paths: Iterable[Path]
+) -> Dict[Path, Number]:
+    """
+    Same as `fetch_prices` using an `aiohttp` session
+    """
+    async with session.get(url) as response:
+        return await async_read_prices(response.content.iter_chunked(CHUNK_SIZE), paths)
+
+
+def fetch_token_rate(token, timeout: float) -> int:
+    """
+    :param token: token config from `ERC20ApprovedToken.chains`
+    :param timeout: seconds to wait for `exchangeRateSource`
+    :return: token amount (in token decimals) worth 1 ether
+    """
+    prices = fetch_prices(token["exchangeRateSource"], [token_path(token)], timeout)
+    return token_rate(token, prices)
+
+
+async def async_fetch_token_rate(session: aiohttp.ClientSession, token) -> int:
+    """
+    Same as `fetch_token_rate` using an `aiohttp` session
+    """
+    prices = await async_fetch_prices(
+        session, token["exchangeRateSource"], [token_path(token)]
+    )
+    return token_rate(token, prices)
+
+
+class RateEntry:
+    __slots__ = ("token", "rate", "fetched_at", "attempted_at")
+
+    def __init__(self, token, rate: int, fetched_at: float):
+        self.token = token
+        self.rate = rate
+        self.fetched_at = fetched_at
+        self.attempted_at = float("-inf")
+
+
+class ExchangeRateCache:
+    def __init__(self, ttl: float, max_staleness: float, timeout: float):
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.timeout = timeout
+        self._entries: Dict[Tuple[str, str], RateEntry] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._refresher = BackgroundThread(self._run, "exchange-rate-refresher")
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refused = 0
+        self.refresh_errors = 0
+
+    def get(self, chain_id: str, token) -> int:
+        """
+        :return: cached rate of `token`, fetched synchronously on a cold miss
+        :raises RateUnavailable: if the rate cannot be fetched or is older than the max staleness
+        """
+        key = (chain_id, token["address"].lower())
+        rate = self._lookup(key, token)
+        if rate is None:
+            self.misses += 1
+            return self._refresh(key, token).rate
+        return rate
+
+    async def async_get(self, chain_id: str, token) -> int:
+        """
+        Same as `get`, a cold miss is fetched without blocking the event loop
+        """
+        key = (chain_id, token["address"].lower())
+        rate = self._lookup(key, token)
+        if rate is None:
+            self.misses += 1
+            try:
+                rate = await async_fetch_token_rate(await self._get_session(), token)
+            except FETCH_ERRORS as e:
+                self.refresh_errors += 1
+                raise RateUnavailable(str(e)) from e
+            self._entries[key] = RateEntry(token, rate, time.monotonic())
+        return rate
+
+    def get_many(self, chain_id: str, tokens: List[dict]) -> Dict[str, Tuple[int, bool]]:
+        """
+        Rates of several tokens. Cold misses are fetched concurrently, once per
+        `exchangeRateSource`, and sources that do not answer within the timeout are left out
+        :return: `(rate, stale)` by lowercase token address, for the tokens with a rate
+        """
+        quotes, missing = self._lookup_many(chain_id, tokens)
+        if missing:
+            sources = _group_by_source(chain_id, missing)
+            executor = self._get_executor()
+            futures = [
+                executor.submit(self._refresh_source, url, keyed_tokens)
+                for url, keyed_tokens in sources.items()
+            ]
+            wait(futures, timeout=self.timeout)
+            quotes.update(self._lookup_many(chain_id, missing)[0])
+        return quotes
+
+    async def async_get_many(
+        self, chain_id: str, tokens: List[dict]
+    ) -> Dict[str, Tuple[int, bool]]:
+        """
+        Same as `get_many`, cold misses are fetched without blocking the event loop
+        """
+        quotes, missing = self._lookup_many(chain_id, tokens)
+        if missing:
+            sources = _group_by_source(chain_id, missing)
+            await asyncio.gather(
+                *(
+                    self._async_refresh_source(url, keyed_tokens)
+                    for url, keyed_tokens in sources.items()
+                )
+            )
+            quotes.update(self._lookup_many(chain_id, missing)[0])
+        return quotes
+
+    def _lookup_many(
+        self, chain_id: str, tokens: List[dict]
+    ) -> Tuple[Dict[str, Tuple[int, bool]], List[dict]]:
+        quotes = {}
+        missing = []
+        for token in tokens:
+            address = token["address"].lower()
+            try:
+                entry = self._lookup_entry((chain_id, address), token)
+            except RateUnavailable:
+                entry = None
+            if entry is None:
+                missing.append(token)
+            else:
+                quotes[address] = (entry.rate, time.monotonic() - entry.fetched_at > self.ttl)
+        return quotes, missing
+
+    def _lookup(self, key: Tuple[str, str], token) -> Optional[int]:
+        entry = self._lookup_entry(key, token)
+        return None if entry is None else entry.rate
+
+    def _lookup_entry(self, key: Tuple[str, str], token) -> Optional[RateEntry]:
+        self._refresher.ensure_started()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        entry.token = token
+        age = time.monotonic() - entry.fetched_at
+        if age <= self.ttl:
+            self.hits += 1
+        elif age <= self.max_staleness:
+            self.stale_hits += 1
+            self._wakeup.set()
+        else:
+            self.refused += 1
+            self._wakeup.set()
+            raise RateUnavailable("Exchange rate is %d seconds old" % age)
+        return entry
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        ages = [now - entry.fetched_at for entry in list(self._entries.values())]
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refused": self.refused,
+            "refresh_errors": self.refresh_errors,
+            "entries": len(ages),
+            "max_age_seconds": max(ages, default=0),
+        }
+
+    def _refresh(self, key: Tuple[str, str], token) -> RateEntry:
+        try:
+            rate = fetch_token_rate(token, self.timeout)
+        except FETCH_ERRORS as e:
+            self.refresh_errors += 1
+            raise RateUnavailable(str(e)) from e
+        entry = RateEntry(token, rate, time.monotonic())
+        self._entries[key] = entry
+        return entry
+
+    def _refresh_source(self, url: str, keyed_tokens: List[Tuple[Tuple[str, str], dict]]):
+        """
+        Fetches `url` once and updates the rate of every token using it as source
+        """
+        try:
+            prices = fetch_prices(url, _price_paths(keyed_tokens), self.timeout)
+        except FETCH_ERRORS:
+            self.refresh_errors += len(keyed_tokens)
+            return
+        self._store_rates(prices, keyed_tokens)
+
+    async def _async_refresh_source(
+        self, url: str, keyed_tokens: List[Tuple[Tuple[str, str], dict]]
+    ):
+        try:
+            prices = await async_fetch_prices(
+                await self._get_session(), url, _price_paths(keyed_tokens)
+            )
+        except FETCH_ERRORS:
+            self.refresh_errors += len(keyed_tokens)
+            return
+        self._store_rates(prices, keyed_tokens)
+
+    def _store_rates(
+        self, prices: Dict[Path, Number], keyed_tokens: List[Tuple[Tuple[str, str], dict]]
+    ):
+        fetched_at = time.monotonic()
+        for key, token in keyed_tokens:
+            try:
+                self._entries[key] = RateEntry(token, token_rate(token, prices), fetched_at)
+            except FETCH_ERRORS:
+                self.refresh_errors += 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=env.int("exchangeRateFetchWorkers", default=8),
+                        thread_name_prefix="exchange-rate-fetch",
+                    )
+        return self._executor
+
+    def _clear_executor(self):
+        self._executor = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # An `aiohttp` session can only be used from the event loop it was created in, so there
+        # is one per loop. The sessions of loops closed since are closed with the new one
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+            with self._lock:
+                closed_loops = [old for old in self._sessions if old.is_closed()]
+                stale = [self._sessions.pop(old) for old in closed_loops]
+                self._sessions[loop] = session
+            for old_session in stale:
+                # Its connections went with the loop
+                await old_session.close()
+        return session
+
+    def close(self, timeout: float = 10):
+        """
+        Closes the `aiohttp` sessions
+        """
+        with self._lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+        for loop, session in sessions:
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout)
+            elif loop.is_closed():
+                asyncio.run(session.close())
+            else:
+                loop.run_until_complete(session.close())
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.ttl / 2)
+            self._wakeup.clear()
+            now = time.monotonic()
+            sources: Dict[str, List[Tuple[Tuple[str, str], dict]]] = {}
+            for key, entry in list(self._entries.items()):
+                # A failing source is retried at most once per timeout period
+                if (
+                    now - entry.fetched_at > self.ttl / 2
+                    and now - entry.attempted_at >= self.timeout
+                ):
+                    entry.attempted_at = now
+                    sources.setdefault(entry.token["exchangeRateSource"], []).append(
+                        (key, entry.token)
+                    )
+            for url, keyed_tokens in sources.items():
+                self._refresh_source(url, keyed_tokens)
+
+
+def _group_by_source(
+    chain_id: str, tokens: List[dict]
+) -> Dict[str, List[Tuple[Tuple[str, str], dict]]]:
+    sources: Dict[str, List[Tuple[Tuple[str, str], dict]]] = {}
+    for token in tokens:
+        sources.setdefault(token["exchangeRateSource"], []).append(
+            ((chain_id, token["address"].lower()), token)
+        )
+    return sources
+
+
+def _price_paths(keyed_tokens: List[Tuple[Tuple[str, str], dict]]) -> List[Path]:
+    paths = []
+    for _, token in keyed_tokens:
+        try:
+            paths.append(token_path(token))
+        except (KeyError, ValueError):
+            # Reported by `token_rate` for this token only
+            pass
+    return paths
+
+
+rate_cache = ExchangeRateCache(
+    ttl=env.float("exchangeRateTTL", default=60),
+    max_staleness=env.float("exchangeRateMaxStaleness", default=600),
+    timeout=env.float("exchangeRateTimeout", default=5),
+)
+
+atexit.register(rate_cache.close)
+# Fetch threads do not survive a fork
+os.register_at_fork(after_in_child=rate_cache._clear_executor)
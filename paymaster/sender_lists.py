@@ -0,0 +1,250 @@
+"""
+In-memory index of `SenderListEntry`, checked before any network I/O of a sponsored operation.
+
+Senders are kept as 20 byte keys, in one set per list and chainId (`None` for every chain),
+along with the membership of each entry so that an entry moved to another list, chain or
+address leaves its old set. Saved and deleted entries are applied to the index of the process
+that changed them right away. Other processes pick up changed rows every `senderListTTL`
+seconds, querying only the rows updated since their last check. Deleted rows are only seen there on the full reload
+every `senderListReloadInterval` seconds (disable the entry instead for an immediate effect).
+
+With `senderListBloomFilter`, denied senders are kept in a Bloom filter instead of a set, for
+very large denylists. Senders that hit the filter are then looked up in the database.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import environ
+from asgiref.sync import sync_to_async
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from hexbytes import HexBytes
+
+from .background import reload_if_due
+from .models import SenderListEntry
+
+env = environ.Env()
+
+Key = bytes
+# (list, chainId, sender) of an entry
+Membership = Tuple[str, Optional[str], Key]
+
+
+def sender_key(address: str) -> Key:
+    return bytes(HexBytes(address))
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        # Keyed, so senders cannot be picked to collide with a denied one
+        self._salt = os.urandom(16)
+
+    def _positions(self, key: Key) -> Iterable[int]:
+        digest = hashlib.blake2b(key, digest_size=4 * self.hashes, key=self._salt).digest()
+        for i in range(0, len(digest), 4):
+            yield int.from_bytes(digest[i : i + 4], "little") % self.size
+
+    def add(self, key: Key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: Key) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key)
+        )
+
+
+class SenderLists:
+    def __init__(
+        self, ttl: float, reload_interval: float, bloom_filter: bool, bloom_error_rate: float
+    ):
+        self.ttl = ttl
+        self.reload_interval = reload_interval
+        self.bloom_filter = bloom_filter
+        self.bloom_error_rate = bloom_error_rate
+        # chainId -> senders, `None` for the entries of every chain
+        self._allowed: Dict[Optional[str], Set[Key]] = {}
+        self._denied: Dict[Optional[str], Set[Key]] = {}
+        self._denied_filter: Optional[BloomFilter] = None
+        # entry pk -> its membership, and the number of entries of each membership. Denied
+        # senders of the Bloom filter are not tracked
+        self._memberships: Dict[int, Membership] = {}
+        self._counts: Dict[Membership, int] = {}
+        self._updated_since = None
+        self._checked_at = float("-inf")
+        self._loaded_at = float("-inf")
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.filter_hits = 0
+
+    def is_allowed(self, chain_id: str, address: str) -> bool:
+        """
+        :return: `False` if `address` is denied on `chain_id`, or if the chain has allowed
+            senders and `address` is not one of them
+        """
+        self._ensure_loaded()
+        key = sender_key(address)
+        allowed = self._allowed
+        if (allowed.get(None) or allowed.get(chain_id)) and not _contains(allowed, chain_id, key):
+            self.rejected += 1
+            return False
+        if self._is_denied(chain_id, address, key):
+            self.rejected += 1
+            return False
+        return True
+
+    async def async_is_allowed(self, chain_id: str, address: str) -> bool:
+        """
+        Same as `is_allowed`, reloading and confirming Bloom filter hits off the event loop
+        """
+        if self._is_due():
+            await sync_to_async(self._ensure_loaded)()
+        if self._denied_filter is not None and sender_key(address) in self._denied_filter:
+            return await sync_to_async(self.is_allowed)(chain_id, address)
+        return self.is_allowed(chain_id, address)
+
+    def load(self):
+        allowed: Dict[Optional[str], Set[Key]] = {}
+        denied: Dict[Optional[str], Set[Key]] = {}
+        memberships: Dict[int, Membership] = {}
+        counts: Dict[Membership, int] = {}
+        entries = SenderListEntry.objects.filter(enabled=True).values_list(
+            "pk", "address", "list", "chainId"
+        )
+        updated_since = SenderListEntry.objects.aggregate(last=Max("updated"))["last"]
+        for pk, address, list_name, chain_id in entries.iterator(chunk_size=10000):
+            membership = (list_name, chain_id or None, sender_key(address))
+            lists = allowed if list_name == SenderListEntry.ALLOW else denied
+            lists.setdefault(membership[1], set()).add(membership[2])
+            if list_name == SenderListEntry.ALLOW or not self.bloom_filter:
+                memberships[pk] = membership
+                counts[membership] = counts.get(membership, 0) + 1
+        denied_filter = None
+        if self.bloom_filter:
+            denied_filter = BloomFilter(sum(map(len, denied.values())), self.bloom_error_rate)
+            for keys in denied.values():
+                for key in keys:
+                    denied_filter.add(key)
+            denied = {}
+        self._allowed, self._denied, self._denied_filter = allowed, denied, denied_filter
+        self._memberships, self._counts = memberships, counts
+        self._updated_since = updated_since
+        self._loaded_at = self._checked_at = time.monotonic()
+        self._loaded = True
+
+    def load_changes(self):
+        """
+        Applies the entries updated since the last load or check. Entries updated in the same
+        instant as the last one seen are applied again, in case they were committed after it
+        """
+        entries = SenderListEntry.objects.order_by("updated")
+        if self._updated_since is not None:
+            entries = entries.filter(updated__gte=self._updated_since)
+        for entry in entries:
+            self.apply(entry)
+            self._updated_since = entry.updated
+        self._checked_at = time.monotonic()
+
+    def apply(self, entry: SenderListEntry, deleted: bool = False):
+        """
+        Adds, moves or removes a single entry, without reloading the lists. A sender stays in
+        a set as long as another entry puts it there
+        """
+        if not self._loaded:
+            return
+        previous = self._memberships.pop(entry.pk, None)
+        if previous is not None:
+            self._remove(previous)
+        if not entry.enabled or deleted:
+            return
+        key = sender_key(entry.address)
+        if entry.list == SenderListEntry.DENY and self._denied_filter is not None:
+            # Bloom filters cannot remove keys, removed entries fail the database lookup
+            self._denied_filter.add(key)
+            return
+        membership = (entry.list, entry.chainId or None, key)
+        self._memberships[entry.pk] = membership
+        self._counts[membership] = self._counts.get(membership, 0) + 1
+        self._lists(entry.list).setdefault(membership[1], set()).add(key)
+
+    def invalidate(self):
+        self._loaded_at = self._checked_at = float("-inf")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "allowed": sum(map(len, list(self._allowed.values()))),
+            "denied": sum(map(len, list(self._denied.values()))),
+            "rejected": self.rejected,
+            "filter_hits": self.filter_hits,
+        }
+
+    def _lists(self, list_name: str) -> Dict[Optional[str], Set[Key]]:
+        return self._allowed if list_name == SenderListEntry.ALLOW else self._denied
+
+    def _remove(self, membership: Membership):
+        count = self._counts.pop(membership) - 1
+        if count:
+            self._counts[membership] = count
+            return
+        list_name, chain_id, key = membership
+        self._lists(list_name).get(chain_id, set()).discard(key)
+
+    def _is_denied(self, chain_id: str, address: str, key: Key) -> bool:
+        if self._denied_filter is None:
+            return _contains(self._denied, chain_id, key)
+        if key not in self._denied_filter:
+            return False
+        self.filter_hits += 1
+        return SenderListEntry.objects.filter(
+            Q(chainId__isnull=True) | Q(chainId="") | Q(chainId=chain_id),
+            address=address,
+            list=SenderListEntry.DENY,
+            enabled=True,
+        ).exists()
+
+    def _is_due(self) -> bool:
+        now = time.monotonic()
+        return now - self._loaded_at > self.reload_interval or now - self._checked_at > self.ttl
+
+    def _ensure_loaded(self):
+        reload_if_due(self._lock, self._loaded, self._is_due, self._reload)
+
+    def _reload(self):
+        if time.monotonic() - self._loaded_at > self.reload_interval:
+            self.load()
+        else:
+            self.load_changes()
+
+
+def _contains(lists: Dict[Optional[str], Set[Key]], chain_id: str, key: Key) -> bool:
+    return key in lists.get(None, ()) or key in lists.get(chain_id, ())
+
+
+sender_lists = SenderLists(
+    ttl=env.float("senderListTTL", default=10),
+    reload_interval=env.float("senderListReloadInterval", default=600),
+    bloom_filter=env.bool("senderListBloomFilter", default=False),
+    bloom_error_rate=env.float("senderListBloomErrorRate", default=0.001),
+)
+
+
+@receiver(post_save, sender=SenderListEntry)
+def apply_saved_sender(sender, instance, **kwargs):
+    with sender_lists._lock:
+        sender_lists.apply(instance)
+
+
+@receiver(post_delete, sender=SenderListEntry)
+def apply_deleted_sender(sender, instance, **kwargs):
+    with sender_lists._lock:
+        sender_lists.apply(instance, deleted=True)
@@ -0,0 +1,112 @@
+"""
+Cache of signed `paymasterAndData` for retried sponsorship requests.
+
+Wallets and bundlers often send the same `pm_sponsorUserOperation` again within seconds (for
+example after estimating gas). The signed data is kept for `signatureCacheTTL` seconds, keyed
+by a digest of everything the paymaster hash covers, and never served once its `validUntil` is
+less than `signatureCacheMargin` seconds away. `validUntil` is relative to the block used when
+signing, so the margin also absorbs the age of that block. At most `signatureCacheSize` entries
+are kept, the least recently used ones are evicted first. Keys and entries have a fixed size,
+whatever the size of the operation.
+
+A retry is only answered from the cache once it passed every check of a new request, including
+the sender funds and the sponsorship budgets.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import environ
+
+from .decoder import UserOperation
+from .op_hash import pack_user_operation
+from .utils import fast_keccak
+
+env = environ.Env()
+
+
+def signature_key(chain_id: str, token, op: UserOperation, exchange_rate: int) -> Tuple:
+    """
+    :return: key of the fields hashed by `getHash`, except `validUntil`. The operation is
+        kept as the keccak of its packed form, which covers the length of `paymasterAndData`
+        through the signature offset
+    """
+    return (
+        chain_id,
+        token["address"].lower(),
+        exchange_rate,
+        fast_keccak(pack_user_operation(op)),
+    )
+
+
+class SignatureCache:
+    def __init__(self, ttl: float, margin: float, max_size: int):
+        self.ttl = ttl
+        self.margin = margin
+        self.max_size = max_size
+        # key -> (expires at, paymasterAndData, hash)
+        self._entries: "OrderedDict[Hashable, Tuple[float, str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, bytes]]:
+        """
+        :return: `paymasterAndData` hex string and signed hash, if `key` was signed recently
+            and its `validUntil` is still far enough
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, paymaster_and_data, hash = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return paymaster_and_data, hash
+
+    def put(self, key: Hashable, valid_for: float, paymaster_and_data: str, hash: bytes):
+        """
+        :param valid_for: seconds between the block used when signing and `validUntil`
+        """
+        lifetime = min(self.ttl, valid_for - self.margin)
+        if not self.enabled or lifetime <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + lifetime, paymaster_and_data, hash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_ratio": self.hits / lookups if lookups else 0,
+        }
+
+
+signature_cache = SignatureCache(
+    ttl=env.float("signatureCacheTTL", default=30),
+    margin=env.float("signatureCacheMargin", default=60),
+    max_size=env.int("signatureCacheSize", default=10000),
+)
@@ -0,0 +1,79 @@
+"""
+Per-process paymaster signer, one per chain.
+
+The signing key is derived once and the paymaster address and chainId are read from the
+environment once, instead of on every sponsored operation.
+"""
+import threading
+from typing import Dict, Union
+
+from eth_account import Account
+from eth_account.messages import defunct_hash_message
+from hexbytes import HexBytes
+
+from .chains import chain_env
+
+# token (20) | mode (1) | validUntil (6) | fee (32) | exchangeRate (32) | signature (65)
+TOKEN_OFFSET = 0
+MODE_OFFSET = 20
+VALID_UNTIL_OFFSET = 21
+FEE_OFFSET = 27
+EXCHANGE_RATE_OFFSET = 59
+SIGNATURE_OFFSET = 91
+SIGNATURE_SIZE = 65
+PAYMASTER_AND_DATA_SIZE = SIGNATURE_OFFSET + SIGNATURE_SIZE
+
+
+def build_paymaster_and_data(
+    token: Union[str, bytes],
+    mode: int,
+    valid_until: int,
+    fee: int,
+    exchange_rate: int,
+    signature: bytes,
+) -> bytes:
+    """
+    Packs the paymaster data the way `CandidePaymaster` decodes `paymasterAndData`
+    :return: `paymasterAndData` without the paymaster address
+    """
+    buffer = bytearray(PAYMASTER_AND_DATA_SIZE)
+    buffer[TOKEN_OFFSET:MODE_OFFSET] = HexBytes(token)
+    buffer[MODE_OFFSET] = mode
+    buffer[VALID_UNTIL_OFFSET:FEE_OFFSET] = valid_until.to_bytes(6, "big")
+    buffer[FEE_OFFSET:EXCHANGE_RATE_OFFSET] = fee.to_bytes(32, "big")
+    buffer[EXCHANGE_RATE_OFFSET:SIGNATURE_OFFSET] = exchange_rate.to_bytes(32, "big")
+    buffer[SIGNATURE_OFFSET:] = signature
+    return bytes(buffer)
+
+
+class SigningContext:
+    def __init__(self, chain_id: str, paymaster_address: str, private_key: str):
+        self.chain_id = int(chain_id)
+        self.paymaster_address = paymaster_address
+        self.account = Account.from_key(private_key)
+
+    def sign(self, hash: bytes) -> bytes:
+        """
+        :param hash: `CandidePaymaster.getHash` result
+        :return: 65 bytes signature of `hash` as an eth_sign message
+        """
+        return self.account.signHash(defunct_hash_message(hash)).signature
+
+
+_signers: Dict[str, SigningContext] = {}
+_signers_lock = threading.Lock()
+
+
+def get_signing_context(chain_id: str) -> SigningContext:
+    signer = _signers.get(chain_id)
+    if signer is None:
+        with _signers_lock:
+            signer = _signers.get(chain_id)
+            if signer is None:
+                signer = SigningContext(
+                    chain_id,
+                    chain_env("paymaster_add", chain_id),
+                    chain_env("paymaster_pk", chain_id),
+                )
+                _signers[chain_id] = signer
+    return signer
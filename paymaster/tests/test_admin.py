@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from paymaster.models import Operation
+
+SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+OTHER_SENDER = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+
+
+class OperationSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        for nonce in (7, 70, 255):
+            Operation.objects.create(
+                sender=SENDER, nonce=nonce, callData=b"\x01", hash=b"\x02" * 32
+            )
+        Operation.objects.create(sender=OTHER_SENDER, nonce=7, callData=b"\x01")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, term: str):
+        response = self.client.get("/admin/paymaster/operation/", {"q": term})
+        self.assertEqual(response.status_code, 200)
+        return sorted(
+            (operation.sender, operation.nonce) for operation in response.context["cl"].result_list
+        )
+
+    def test_decimal_nonce(self):
+        self.assertEqual(self.search("7"), [(OTHER_SENDER, 7), (SENDER, 7)])
+
+    def test_decimal_nonce_with_leading_zeros(self):
+        self.assertEqual(self.search("007"), [(OTHER_SENDER, 7), (SENDER, 7)])
+        self.assertEqual(self.search("00"), [])
+
+    def test_hex_nonce(self):
+        self.assertEqual(self.search("0xff"), [(SENDER, 255)])
+        self.assertEqual(self.search("0x0046"), [(SENDER, 70)])
+
+    def test_address(self):
+        self.assertEqual(self.search(OTHER_SENDER), [(OTHER_SENDER, 7)])
+
+    def test_hash(self):
+        self.assertEqual(len(self.search("0x" + "02" * 32)), 3)
+
+    def test_other_terms(self):
+        self.assertEqual(self.search("sponsored"), [])
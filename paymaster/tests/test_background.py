@@ -0,0 +1,59 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from paymaster.background import BackgroundThread, reload_if_due
+
+
+class BackgroundThreadTestCase(SimpleTestCase):
+    def test_started_once(self):
+        started = []
+        stop = threading.Event()
+        thread = BackgroundThread(lambda: started.append(1) or stop.wait(10), "test")
+        self.assertFalse(thread.is_alive())
+        for _ in range(3):
+            thread.ensure_started()
+        self.assertTrue(thread.is_alive())
+        stop.set()
+        thread.join(10)
+        self.assertEqual(started, [1])
+
+    def test_restarted_once_stopped(self):
+        runs = []
+        thread = BackgroundThread(lambda: runs.append(1), "test")
+        thread.ensure_started()
+        thread.join(10)
+        thread.ensure_started()
+        thread.join(10)
+        self.assertEqual(runs, [1, 1])
+
+
+class ReloadIfDueTestCase(SimpleTestCase):
+    def test_not_due(self):
+        reloads = []
+        reload_if_due(threading.Lock(), True, lambda: False, lambda: reloads.append(1))
+        self.assertEqual(reloads, [])
+
+    def test_first_load_is_waited_for(self):
+        lock = threading.Lock()
+        reloads = []
+        lock.acquire()
+        caller = threading.Thread(
+            target=reload_if_due, args=(lock, False, lambda: not reloads, lambda: reloads.append(1))
+        )
+        caller.start()
+        caller.join(0.1)
+        self.assertTrue(caller.is_alive())
+        lock.release()
+        caller.join(10)
+        self.assertEqual(reloads, [1])
+
+    def test_later_reloads_do_not_wait(self):
+        lock = threading.Lock()
+        reloads = []
+        with lock:
+            reload_if_due(lock, True, lambda: True, lambda: reloads.append(1))
+        self.assertEqual(reloads, [])
+        reload_if_due(lock, True, lambda: True, lambda: reloads.append(1))
+        self.assertEqual(reloads, [1])
+        self.assertFalse(lock.locked())
@@ -0,0 +1,128 @@
+"""
+JSON-RPC batches dispatched concurrently with shared lookups.
+"""
+import json
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from jsonrpcserver import Success
+from jsonrpcserver.methods import global_methods
+
+from paymaster import batch
+from paymaster.batch import batch_resolve, dispatch_batch
+
+INVALID_REQUEST = -32600
+
+
+def request(method: str, *params, id=1) -> dict:
+    element = {"jsonrpc": "2.0", "method": method, "params": list(params)}
+    if id is not None:
+        element["id"] = id
+    return element
+
+
+class DispatchBatchTestCase(SimpleTestCase):
+    def setUp(self):
+        self.lookups = 0
+        methods = mock.patch.dict(
+            global_methods,
+            {
+                "test_echo": self.echo,
+                "test_lookup": self.lookup,
+                "test_context": lambda context: Success(context),
+            },
+        )
+        methods.start()
+        self.addCleanup(methods.stop)
+
+    def echo(self, context, value, delay=0):
+        time.sleep(delay)
+        return Success(value)
+
+    def lookup(self, context):
+        def fetch():
+            self.lookups += 1
+            # Long enough for the other elements to wait for it
+            time.sleep(0.05)
+            return object()
+
+        return Success(id(batch_resolve(("test", context), fetch)))
+
+    def dispatch(self, body):
+        response = dispatch_batch(json.dumps(body), context="10")
+        return json.loads(response) if response else response
+
+    def test_responses_in_request_order(self):
+        responses = self.dispatch(
+            [request("test_echo", i, (5 - i) / 100, id=i) for i in range(5)]
+        )
+        self.assertEqual([r["id"] for r in responses], list(range(5)))
+        self.assertEqual([r["result"] for r in responses], list(range(5)))
+
+    def test_notifications_have_no_response(self):
+        responses = self.dispatch(
+            [request("test_echo", 1, id=None), request("test_echo", 2, id=2)]
+        )
+        self.assertEqual(responses, [{"jsonrpc": "2.0", "result": 2, "id": 2}])
+        self.assertEqual(
+            self.dispatch([request("test_echo", 1, id=None), request("test_echo", 2, id=None)]),
+            "",
+        )
+
+    def test_invalid_elements(self):
+        responses = self.dispatch(
+            [
+                request("test_echo", 1, id=1),
+                1,
+                {"foo": "bar"},
+                [request("test_echo", 2, id=2), request("test_echo", 3, id=3)],
+                request("test_echo", 4, id=4),
+            ]
+        )
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(responses[0]["result"], 1)
+        for response in responses[1:4]:
+            self.assertEqual(response["error"]["code"], INVALID_REQUEST)
+            self.assertIsNone(response["id"])
+        self.assertEqual(responses[4]["result"], 4)
+
+    def test_lookups_are_shared_by_the_batch(self):
+        responses = self.dispatch([request("test_lookup", id=i) for i in range(4)])
+        self.assertEqual(self.lookups, 1)
+        self.assertEqual(len({r["result"] for r in responses}), 1)
+        # Each batch and each single request resolves again
+        self.dispatch([request("test_lookup", id=i) for i in range(2)])
+        self.dispatch(request("test_lookup"))
+        self.assertEqual(self.lookups, 3)
+
+    def test_failed_lookup_is_shared(self):
+        calls = []
+
+        def fail():
+            calls.append(threading.get_ident())
+            time.sleep(0.05)
+            raise RuntimeError("node down")
+
+        global_methods["test_fail"] = lambda context: Success(batch_resolve("fail", fail))
+        with self.assertLogs("jsonrpcserver", "ERROR"):
+            responses = self.dispatch([request("test_fail", id=i) for i in range(3)])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all("error" in r for r in responses))
+
+    def test_single_request_is_parsed_once(self):
+        with mock.patch.object(batch, "dispatch", wraps=batch.dispatch) as dispatch:
+            response = self.dispatch(request("test_context"))
+            self.assertEqual(response, {"jsonrpc": "2.0", "result": "10", "id": 1})
+            self.assertEqual(dispatch.call_args.args[0], request("test_context"))
+            self.dispatch([request("test_context")])
+            self.assertEqual(dispatch.call_args.args[0], [request("test_context")])
+        # Malformed bodies still get the parse error
+        response = json.loads(dispatch_batch("[{", context="10"))
+        self.assertEqual(response["error"]["code"], -32700)
+
+    def test_elements_close_old_connections(self):
+        with mock.patch.object(batch, "close_old_connections") as close_old_connections:
+            self.dispatch([request("test_echo", i, id=i) for i in range(3)])
+        self.assertEqual(close_old_connections.call_count, 6)
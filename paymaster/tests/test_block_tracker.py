@@ -0,0 +1,99 @@
+"""
+Latest block timestamp tracked by polling the block number.
+"""
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from paymaster import block_tracker
+from paymaster.block_tracker import BlockTracker
+
+NOW = 1000.0
+CHAIN_ID = "10"
+
+
+def block(number: int) -> SimpleNamespace:
+    return SimpleNamespace(number=number, timestamp=0x64000000 + number * 2)
+
+
+class BlockTrackerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.w3 = mock.Mock()
+        self.w3.eth.block_number = 16
+        self.w3.eth.get_block.side_effect = lambda number: block(
+            self.w3.eth.block_number if number == "latest" else number
+        )
+        self.tracker = BlockTracker(CHAIN_ID, self.w3, interval=2, max_drift=12)
+        # Polls are driven by the tests
+        self.tracker._poller = mock.Mock()
+        monotonic = mock.patch("paymaster.block_tracker.time.monotonic", return_value=NOW)
+        self.monotonic = monotonic.start()
+        self.addCleanup(monotonic.stop)
+
+    def test_block_is_fetched_when_its_number_changes(self):
+        self.tracker._poll()
+        self.w3.eth.get_block.assert_called_once_with(16)
+
+        self.monotonic.return_value = NOW + 2
+        self.tracker._poll()
+        self.assertEqual(self.w3.eth.get_block.call_count, 1)
+        self.assertEqual(self.tracker.updated_at, NOW + 2)
+
+        self.w3.eth.block_number = 17
+        self.tracker._poll()
+        self.w3.eth.get_block.assert_called_with(17)
+        self.assertEqual(self.tracker.latest_timestamp(), block(17).timestamp)
+        self.assertEqual(self.tracker.fallback_fetches, 0)
+
+    def test_fallback_when_the_tracker_is_stale(self):
+        # Nothing tracked yet
+        self.assertEqual(self.tracker.latest_timestamp(), block(16).timestamp)
+        self.w3.eth.get_block.assert_called_once_with("latest")
+
+        self.monotonic.return_value = NOW + 12
+        self.assertEqual(self.tracker.latest_timestamp(), block(16).timestamp)
+        self.assertEqual(self.w3.eth.get_block.call_count, 1)
+
+        self.w3.eth.block_number = 20
+        self.monotonic.return_value = NOW + 12.1
+        self.assertEqual(self.tracker.latest_timestamp(), block(20).timestamp)
+        self.w3.eth.get_block.assert_called_with("latest")
+        self.assertEqual(self.tracker.fallback_fetches, 2)
+
+    def test_older_blocks_are_ignored(self):
+        self.w3.eth.block_number = 20
+        self.tracker._poll()
+        # A node behind the polled one
+        self.w3.eth.block_number = 19
+        self.monotonic.return_value = NOW + 13
+        self.assertEqual(self.tracker.latest_timestamp(), block(20).timestamp)
+        self.assertEqual(self.tracker.block_number, 20)
+
+    def test_async_fallback(self):
+        async_w3 = mock.Mock()
+        async_w3.eth.get_block = mock.AsyncMock(return_value=block(18))
+        with mock.patch.object(
+            block_tracker, "get_async_client", return_value=SimpleNamespace(w3=async_w3)
+        ) as get_async_client:
+            timestamp = asyncio.run(self.tracker.async_latest_timestamp())
+            self.assertEqual(timestamp, block(18).timestamp)
+            async_w3.eth.get_block.assert_awaited_once_with("latest")
+            get_async_client.assert_called_once_with(CHAIN_ID)
+
+            # Fresh
+            asyncio.run(self.tracker.async_latest_timestamp())
+            self.assertEqual(async_w3.eth.get_block.await_count, 1)
+        self.w3.eth.get_block.assert_not_called()
+
+    def test_failed_poll_is_retried(self):
+        self.w3.eth.get_block.side_effect = [ConnectionError("node down"), block(16)]
+        # The second sleep stops the poller
+        with mock.patch(
+            "paymaster.block_tracker.time.sleep", side_effect=[None, StopIteration]
+        ) as sleep, self.assertLogs("paymaster.block_tracker", "WARNING"):
+            with self.assertRaises(StopIteration):
+                self.tracker._run()
+        sleep.assert_called_with(2)
+        self.assertEqual(self.tracker.block_number, 16)
@@ -0,0 +1,109 @@
+"""
+Sponsorship budgets counted in memory and checkpointed to the database.
+"""
+import threading
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TransactionTestCase
+
+from paymaster.budget import BudgetLedger
+from paymaster.models import BudgetCheckpoint
+from paymaster.tests.test_db import run_threads
+
+CHAIN_ID = "10"
+TOKEN = {
+    "address": "0x7F5c764cBc14f9669B88837ca1490cCa17c31607",
+    "maxTokenSpend": 150,
+    "maxSenderSpend": "100",
+}
+SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+OTHER_SENDER = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+
+
+def create_ledger() -> BudgetLedger:
+    ledger = BudgetLedger(bucket_seconds=60, retention=3600, interval=60, shards=4)
+    # Checkpoints are driven by the tests
+    ledger._writer = mock.Mock()
+    return ledger
+
+
+class BudgetLedgerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.ledger = create_ledger()
+
+    def spent(self, ledger: BudgetLedger, sender: str = None) -> int:
+        key = (CHAIN_ID, TOKEN["address"].lower(), sender and sender.lower())
+        return ledger._spent(key, 0)
+
+    def test_budgets(self):
+        self.ledger.record(CHAIN_ID, TOKEN, SENDER, 90)
+        self.assertIsNone(self.ledger.exceeded(CHAIN_ID, TOKEN, SENDER, 10))
+        self.assertEqual(self.ledger.exceeded(CHAIN_ID, TOKEN, SENDER, 11), "sender")
+        self.assertIsNone(self.ledger.exceeded(CHAIN_ID, TOKEN, OTHER_SENDER, 60))
+        self.assertEqual(self.ledger.exceeded(CHAIN_ID, TOKEN, OTHER_SENDER, 61), "token")
+        unlimited = {"address": TOKEN["address"]}
+        self.assertIsNone(self.ledger.exceeded(CHAIN_ID, unlimited, SENDER, 10**30))
+
+    def test_checkpoints_are_seen_by_other_processes(self):
+        self.ledger.record(CHAIN_ID, TOKEN, SENDER, 40)
+        self.ledger.record(CHAIN_ID, TOKEN, OTHER_SENDER, 30)
+        self.ledger.checkpoint()
+        self.ledger.record(CHAIN_ID, TOKEN, SENDER, 5)
+
+        other = create_ledger()
+        other.load()
+        self.assertEqual(self.spent(other, SENDER), 40)
+        self.assertEqual(self.spent(other), 70)
+        # Pending spending of this process is kept by its reloads
+        self.ledger.load()
+        self.assertEqual(self.spent(self.ledger, SENDER), 45)
+        self.assertEqual(self.spent(self.ledger), 75)
+
+    def test_load_during_a_record(self):
+        # A load of another thread runs between the two counters of the record, then the
+        # record goes on. Either way both counters end up with the amount
+        add = self.ledger._add
+        loader = threading.Thread(target=run_threads, args=([self.ledger.load],))
+
+        def add_then_load(key, bucket, amount):
+            add(key, bucket, amount)
+            if loader.ident is None:
+                loader.start()
+                loader.join(0.5)
+
+        with mock.patch.object(self.ledger, "_add", add_then_load):
+            self.ledger.record(CHAIN_ID, TOKEN, SENDER, 7)
+        loader.join()
+
+        self.assertEqual(self.spent(self.ledger), 7)
+        self.assertEqual(self.spent(self.ledger, SENDER), 7)
+        self.ledger.checkpoint()
+        self.assertEqual(self.spent(self.ledger), 7)
+        self.assertEqual(self.spent(self.ledger, SENDER), 7)
+
+    def test_failed_reload_after_a_checkpoint(self):
+        self.ledger.record(CHAIN_ID, TOKEN, SENDER, 40)
+        with mock.patch.object(self.ledger, "load", side_effect=OperationalError("locked")):
+            self.ledger.checkpoint()
+        self.assertEqual(self.ledger.stats()["pending"], 0)
+        self.assertEqual(self.spent(self.ledger, SENDER), 40)
+
+        # The stored spending is not stored again by the next checkpoint
+        self.ledger.checkpoint()
+        amounts = BudgetCheckpoint.objects.values_list("amount", flat=True)
+        self.assertEqual(sum(amounts), 40)
+        self.assertEqual(self.spent(self.ledger, SENDER), 40)
+
+    def test_failed_checkpoint_is_retried(self):
+        self.ledger.record(CHAIN_ID, TOKEN, SENDER, 40)
+        with mock.patch.object(
+            BudgetCheckpoint.objects, "bulk_create", side_effect=OperationalError("locked")
+        ):
+            self.ledger.checkpoint()
+        self.assertEqual(BudgetCheckpoint.objects.count(), 0)
+
+        self.ledger.checkpoint()
+        amounts = BudgetCheckpoint.objects.values_list("amount", flat=True)
+        self.assertEqual(sum(amounts), 40)
+        self.assertEqual(self.spent(self.ledger, SENDER), 40)
@@ -0,0 +1,159 @@
+"""
+Concurrent writers and readers on the configured database: a SQLite file in WAL mode by
+default, PostgreSQL when `DATABASE_URL` points to one.
+"""
+import threading
+import time
+from typing import Callable, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import TransactionTestCase, skipUnlessDBFeature
+
+from paymaster.models import ERC20ApprovedToken, Operation
+from paymaster.token_registry import TokenRegistry
+
+SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+TOKEN = "0x7F5c764cBc14f9669B88837ca1490cCa17c31607"
+
+WRITERS = 4
+READERS = 4
+TRANSACTIONS = 25
+ROWS = 20
+
+
+def run_threads(targets: List[Callable[[], None]]) -> List[BaseException]:
+    """
+    Runs each target in its own thread, with its own connection
+    :return: exceptions raised by the targets
+    """
+    errors: List[BaseException] = []
+
+    def run(target):
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        ERC20ApprovedToken.objects.create(
+            name="T", chains={"10": {"address": TOKEN, "decimals": 6, "enabled": True}}
+        )
+
+    def test_sqlite_settings(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA busy_timeout")
+            timeout = settings.DATABASES["default"]["OPTIONS"]["timeout"]
+            self.assertEqual(cursor.fetchone()[0], int(timeout * 1000))
+
+    def test_concurrent_writers_and_readers(self):
+        writing = threading.Event()
+        loads = []
+
+        def write(writer: int):
+            writing.set()
+            for nonce in range(TRANSACTIONS):
+                with transaction.atomic():
+                    Operation.objects.bulk_create(
+                        Operation(sender=SENDER, nonce=writer * 1000 + nonce, callData=b"\x01")
+                        for _ in range(ROWS)
+                    )
+
+        def read():
+            registry = TokenRegistry(ttl=0)
+            writing.wait()
+            for _ in range(TRANSACTIONS):
+                registry.load()
+                loads.append(registry.get("10", TOKEN))
+                Operation.objects.filter(sender=SENDER).count()
+
+        errors = run_threads(
+            [lambda writer=writer: write(writer) for writer in range(WRITERS)]
+            + [read] * READERS
+        )
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Operation.objects.count(), WRITERS * TRANSACTIONS * ROWS)
+        self.assertEqual(len(loads), READERS * TRANSACTIONS)
+        self.assertTrue(all(token is not None for token in loads))
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_row_lock_is_waited_for(self):
+        # Locking behaviour of server databases, SQLite has no row locks
+        token = ERC20ApprovedToken.objects.get()
+        locked = threading.Event()
+        released = []
+
+        def hold():
+            with transaction.atomic():
+                ERC20ApprovedToken.objects.select_for_update().get(pk=token.pk)
+                locked.set()
+                time.sleep(0.5)
+                released.append(time.monotonic())
+
+        def update():
+            locked.wait()
+            with transaction.atomic():
+                ERC20ApprovedToken.objects.filter(pk=token.pk).update(name="U")
+            self.assertGreaterEqual(time.monotonic(), released[0])
+
+        self.assertEqual(run_threads([hold, update]), [])
+        self.assertEqual(ERC20ApprovedToken.objects.get().name, "U")
+
+    def test_reads_do_not_wait_for_writers(self):
+        locked = threading.Event()
+        done = threading.Event()
+        read_seconds = []
+
+        def hold_write_lock():
+            with transaction.atomic():
+                Operation.objects.create(sender=SENDER, nonce=1, callData=b"\x01")
+                locked.set()
+                done.wait(10)
+
+        def read():
+            locked.wait()
+            started = time.monotonic()
+            registry = TokenRegistry(ttl=0)
+            registry.load()
+            self.assertIsNotNone(registry.get("10", TOKEN))
+            self.assertEqual(Operation.objects.count(), 0)
+            read_seconds.append(time.monotonic() - started)
+            done.set()
+
+        self.assertEqual(run_threads([hold_write_lock, read]), [])
+        self.assertLess(read_seconds[0], 1)
+
+    def test_writer_waits_for_the_write_lock(self):
+        # The second writer waits within the busy timeout instead of failing with
+        # "database is locked"
+        locked = threading.Event()
+
+        def hold_write_lock():
+            with transaction.atomic():
+                Operation.objects.create(sender=SENDER, nonce=1, callData=b"\x01")
+                locked.set()
+                time.sleep(0.5)
+
+        def write():
+            locked.wait()
+            with transaction.atomic():
+                Operation.objects.create(sender=SENDER, nonce=2, callData=b"\x01")
+
+        self.assertEqual(run_threads([hold_write_lock, write]), [])
+        self.assertEqual(Operation.objects.count(), 2)
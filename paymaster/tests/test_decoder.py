@@ -0,0 +1,102 @@
+"""
+`decode_user_operation` against `OperationSerialzer` over the same valid and invalid inputs.
+"""
+from django.test import SimpleTestCase
+from rest_framework.exceptions import ValidationError
+
+from paymaster.decoder import decode_user_operation
+from paymaster.management.commands.bench import large_user_operation, user_operation
+from paymaster.serializers import OperationSerialzer
+
+UINT_FIELDS = (
+    "nonce",
+    "callGasLimit",
+    "verificationGasLimit",
+    "preVerificationGas",
+    "maxFeePerGas",
+    "maxPriorityFeePerGas",
+)
+
+VALID_CHANGES = [
+    {},
+    {"nonce": "0X1"},
+    {"nonce": "0x0x1f", "callGasLimit": "0x0X5208"},
+    {"nonce": "  0xabc  ", "maxFeePerGas": "3b9aca00"},
+    {"nonce": "0x0x", "callGasLimit": "0X"},
+    {"nonce": b"\x01\x02", "callData": memoryview(b"\xb6\x1d")},
+    {"initCode": "0x", "callData": "", "paymasterAndData": "0X"},
+    {"callData": "0XB61D27F6", "initCode": "0x0xabc", "paymasterAndData": "0xb61d27f"},
+    {"signature": "0x"},
+    {"signature": "0X" + "22" * 65},
+]
+
+INVALID_CHANGES = [
+    {"nonce": "0xzz"},
+    {"nonce": "0x"},
+    {"nonce": ""},
+    {"nonce": None},
+    {"nonce": 1},
+    {"nonce": "0x0x0x1"},
+    {"nonce": "0xé1"},
+    {"callData": "0x0xzz"},
+    {"callData": []},
+    {"signature": "0x" + "11" * 64},
+    {"signature": "0x" + "11" * 66},
+    {"signature": "0x0X" + "11" * 64},
+    {"sender": "0x9fe46736679d2d9a65f0992f2272de9f3c7fa6e0"},
+    {"sender": "0x0000000000000000000000000000000000000000"},
+    {"sender": "0x0000000000000000000000000000000000000001"},
+    {"sender": None},
+    {"nonce": "0xzz", "initCode": 5, "signature": "0x11"},
+]
+
+
+class DecoderParityTestCase(SimpleTestCase):
+    def assertSameValues(self, data: dict):
+        serializer = OperationSerialzer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        op = decode_user_operation(data)
+        for field, value in serializer.validated_data.items():
+            if field == "sender":
+                self.assertEqual(op.sender, value)
+            elif field in UINT_FIELDS:
+                self.assertEqual(getattr(op, field), int.from_bytes(value, "big"), field)
+            else:
+                self.assertEqual(getattr(op, field), bytes(value), field)
+
+    def assertSameErrors(self, data):
+        serializer = OperationSerialzer(data=data)
+        self.assertFalse(serializer.is_valid())
+        with self.assertRaises(ValidationError) as context:
+            decode_user_operation(data)
+        self.assertEqual(context.exception.detail, serializer.errors)
+        # Same codes as well as messages
+        for field, errors in serializer.errors.items():
+            self.assertEqual(
+                [error.code for error in context.exception.detail[field]],
+                [error.code for error in errors],
+            )
+
+    def test_valid(self):
+        for changes in VALID_CHANGES:
+            with self.subTest(changes=changes):
+                self.assertSameValues(dict(user_operation(1), **changes))
+
+    def test_large_payloads(self):
+        self.assertSameValues(large_user_operation(1, 48 * 1024))
+
+    def test_invalid(self):
+        for changes in INVALID_CHANGES:
+            with self.subTest(changes=changes):
+                self.assertSameErrors(dict(user_operation(1), **changes))
+
+    def test_missing_fields(self):
+        data = user_operation(1)
+        del data["nonce"], data["signature"]
+        self.assertSameErrors(data)
+        self.assertSameErrors({})
+
+    def test_not_a_dict(self):
+        for data in ([user_operation(1)], "0x", None, 1):
+            with self.subTest(data=data):
+                self.assertSameErrors(data)
@@ -0,0 +1,206 @@
+"""
+Sender balance and allowance checks of `pm_sponsorUserOperation`, against the stub node of
+`manage.py bench`.
+"""
+import json
+import os
+from itertools import count
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from eth_abi import encode
+
+from paymaster.audit import audit_writer
+from paymaster.funds import (
+    APPROVE_SELECTOR,
+    EXECUTE_BATCH_SELECTOR,
+    EXECUTE_SELECTOR,
+    FundsChecker,
+    approved_amount,
+    funds_checker,
+)
+from paymaster.management.commands._stubs import TOKEN_BALANCE, start_stub_node
+from paymaster.management.commands.bench import (
+    BENCH_TOKEN,
+    DEV_PAYMASTER,
+    DEV_PAYMASTER_PK,
+    user_operation,
+)
+from paymaster.models import ERC20ApprovedToken
+from paymaster.ratelimit import sender_rate_limit
+from paymaster.token_registry import token_registry
+
+CHAIN_ID = "31337"
+OTHER_TOKEN = "0x94b008aA00579c1307B0EF2c499aD98a8ce58e58"
+SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+
+
+def approve(spender: str, amount: int) -> bytes:
+    return APPROVE_SELECTOR + encode(["address", "uint256"], [spender, amount])
+
+
+def execute(target: str, data: bytes) -> bytes:
+    return EXECUTE_SELECTOR + encode(["address", "uint256", "bytes"], [target, 0, data])
+
+
+def execute_batch(*calls) -> bytes:
+    targets, data = zip(*calls)
+    return EXECUTE_BATCH_SELECTOR + encode(["address[]", "bytes[]"], [targets, data])
+
+
+class ApprovedAmountTestCase(SimpleTestCase):
+    def test_execute(self):
+        call_data = execute(BENCH_TOKEN, approve(DEV_PAYMASTER, 5))
+        self.assertEqual(approved_amount(call_data, BENCH_TOKEN, DEV_PAYMASTER), 5)
+        self.assertEqual(approved_amount(call_data, BENCH_TOKEN.lower(), DEV_PAYMASTER.lower()), 5)
+
+    def test_execute_batch(self):
+        call_data = execute_batch(
+            (OTHER_TOKEN, approve(DEV_PAYMASTER, 9)),
+            (BENCH_TOKEN, approve(DEV_PAYMASTER, 7)),
+            (BENCH_TOKEN, approve(SENDER, 8)),
+            (SENDER, b"\x01\x02"),
+        )
+        self.assertEqual(approved_amount(call_data, BENCH_TOKEN, DEV_PAYMASTER), 7)
+
+    def test_last_approve_counts(self):
+        call_data = execute_batch(
+            (BENCH_TOKEN, approve(DEV_PAYMASTER, 7)), (BENCH_TOKEN, approve(DEV_PAYMASTER, 0))
+        )
+        self.assertEqual(approved_amount(call_data, BENCH_TOKEN, DEV_PAYMASTER), 0)
+
+    def test_other_targets_do_not_count(self):
+        for call_data in (
+            execute(OTHER_TOKEN, approve(DEV_PAYMASTER, 5)),
+            execute(BENCH_TOKEN, approve(SENDER, 5)),
+            # An approve of the paymaster anywhere in the callData is not enough
+            execute(SENDER, approve(DEV_PAYMASTER, 5)),
+            approve(DEV_PAYMASTER, 5),
+            bytes.fromhex(user_operation(0)["callData"][2:]),
+            b"",
+        ):
+            with self.subTest(call_data=call_data.hex()):
+                self.assertIsNone(approved_amount(call_data, BENCH_TOKEN, DEV_PAYMASTER))
+
+
+class Multicall3UnavailableTestCase(SimpleTestCase):
+    def test_chain_is_not_asked_again(self):
+        checker = FundsChecker(enabled=True, max_size=10, retry_interval=60)
+        with mock.patch("paymaster.funds.get_client") as get_client:
+            get_client.return_value.w3.eth.call.return_value = b""
+            for block_number in range(3):
+                funds = checker.get("1", SENDER, BENCH_TOKEN, DEV_PAYMASTER, block_number)
+                self.assertIsNone(funds)
+            checker.get("2", SENDER, BENCH_TOKEN, DEV_PAYMASTER, 0)
+        self.assertEqual(get_client.return_value.w3.eth.call.call_count, 2)
+        self.assertEqual(checker.stats()["skipped"], 2)
+
+    def test_node_errors_are_retried(self):
+        checker = FundsChecker(enabled=True, max_size=10, retry_interval=60)
+        with mock.patch("paymaster.funds.get_client") as get_client:
+            get_client.return_value.w3.eth.call.side_effect = ValueError("node error")
+            for block_number in range(3):
+                checker.get("1", SENDER, BENCH_TOKEN, DEV_PAYMASTER, block_number)
+        self.assertEqual(get_client.return_value.w3.eth.call.call_count, 3)
+        self.assertEqual(checker.stats()["skipped"], 0)
+
+
+class StubNodeTestCase(TestCase):
+    """
+    Sponsors operations through the endpoint, on a chain served by the stub node
+    """
+
+    chain_id = CHAIN_ID
+    # Extra settings of the approved token
+    token_settings: dict = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.node = start_stub_node(int(cls.chain_id), DEV_PAYMASTER)
+        cls.node_url = "http://127.0.0.1:%d" % cls.node.server_address[1]
+        environment = mock.patch.dict(
+            os.environ,
+            {
+                "chainId": cls.chain_id,
+                "HTTPProvider_" + cls.chain_id: cls.node_url,
+                "paymaster_add_" + cls.chain_id: DEV_PAYMASTER,
+                "paymaster_pk_" + cls.chain_id: DEV_PAYMASTER_PK,
+            },
+        )
+        environment.start()
+        cls.addClassCleanup(environment.stop)
+        # The writer thread would wait for the test transaction
+        audit = mock.patch.object(audit_writer, "enabled", False)
+        audit.start()
+        cls.addClassCleanup(audit.stop)
+        # Every operation comes from the same sender
+        sender_limit = mock.patch.object(sender_rate_limit, "rate", 0)
+        sender_limit.start()
+        cls.addClassCleanup(sender_limit.stop)
+        cls.addClassCleanup(cls.node.shutdown)
+        cls.nonces = count()
+
+    def setUp(self):
+        ERC20ApprovedToken.objects.create(
+            name="T",
+            chains={
+                self.chain_id: {
+                    "address": BENCH_TOKEN,
+                    "decimals": 6,
+                    "exchangeRateSource": self.node_url + "/price",
+                    "enabled": True,
+                    **self.token_settings,
+                }
+            },
+        )
+        token_registry.invalidate()
+        self.node.token_balance = self.node.token_allowance = TOKEN_BALANCE
+        funds_checker._entries.clear()
+
+    def operation(self, call_data: bytes = None) -> dict:
+        op = user_operation(next(self.nonces))
+        if call_data is not None:
+            op["callData"] = "0x" + call_data.hex()
+        return op
+
+    def sponsor(self, op: dict) -> dict:
+        body = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "pm_sponsorUserOperation",
+            "params": [op, BENCH_TOKEN],
+        }
+        response = self.client.post(
+            "/paymaster/" + self.chain_id, json.dumps(body), content_type="application/json"
+        )
+        return response.json()
+
+
+class SponsorFundsTestCase(StubNodeTestCase):
+    def test_funded_sender_is_sponsored(self):
+        self.assertIn("result", self.sponsor(self.operation()))
+
+    def test_insufficient_balance(self):
+        self.node.token_balance = 1
+        response = self.sponsor(self.operation())
+        self.assertEqual(response["error"]["code"], 5)
+        self.assertEqual(response["error"]["message"], "Insufficient token balance")
+
+    def test_insufficient_allowance(self):
+        self.node.token_allowance = 1
+        response = self.sponsor(self.operation())
+        self.assertEqual(response["error"]["code"], 6)
+        self.assertEqual(response["error"]["message"], "Insufficient token allowance")
+
+    def test_approve_in_call_data(self):
+        self.node.token_allowance = 0
+        call_data = execute_batch(
+            (BENCH_TOKEN, approve(DEV_PAYMASTER, TOKEN_BALANCE)), (SENDER, b"\x01")
+        )
+        self.assertIn("result", self.sponsor(self.operation(call_data)))
+
+    def test_approve_of_another_token(self):
+        self.node.token_allowance = 0
+        call_data = execute(OTHER_TOKEN, approve(DEV_PAYMASTER, TOKEN_BALANCE))
+        self.assertEqual(self.sponsor(self.operation(call_data))["error"]["code"], 6)
@@ -0,0 +1,83 @@
+"""
+`pre_verification_gas` against a port of the bundler's `calcPreVerificationGas`.
+"""
+import random
+from math import floor
+
+from django.test import SimpleTestCase
+from eth_abi import encode
+from hexbytes import HexBytes
+
+from paymaster import gas
+from paymaster.decoder import UserOperation
+from paymaster.gas import pre_verification_gas, signed_paymaster_and_data
+from paymaster.signer import build_paymaster_and_data
+from paymaster.tests.test_op_hash import (
+    PAYMASTER_ADDRESS,
+    TOKEN,
+    random_operation,
+    vector_operation,
+)
+
+USER_OP_TYPE = "(address,uint256,bytes,bytes,uint256,uint256,uint256,uint256,uint256,bytes,bytes)"
+
+EXCHANGE_RATE = 1633079662
+
+# Zero bytes of the signed paymasterAndData that the placeholder counts as non-zero: the low
+# bytes of validUntil and the signature
+MAX_OVERCOUNT = (gas.NON_ZERO_BYTE_GAS - gas.ZERO_BYTE_GAS) * (4 + 65)
+
+
+def calc_pre_verification_gas(op: UserOperation) -> int:
+    """
+    eth-infinitism bundler `calcPreVerificationGas` with the default overheads: the ABI encoded
+    operation without its offset word and its last word
+    """
+    packed = encode([USER_OP_TYPE], [tuple(op.as_dict().values())])[32:-32]
+    call_data_cost = sum(4 if byte == 0 else 16 for byte in packed)
+    length_in_word = (len(packed) + 31) / 32
+    return floor(call_data_cost + 21000 / gas.BUNDLE_SIZE + 18300 + 4 * length_in_word + 0.5)
+
+
+def sponsored(op: UserOperation, paymaster_and_data: bytes) -> UserOperation:
+    """
+    :return: `op` as sent to the bundler, with a signature of its final size
+    """
+    signature = op.signature.ljust(65, b"\xff")
+    return UserOperation(
+        **dict(op.as_dict(), paymasterAndData=paymaster_and_data, signature=signature)
+    )
+
+
+class PreVerificationGasTestCase(SimpleTestCase):
+    def test_matches_bundler(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            op = random_operation(rng)
+            exchange_rate = rng.getrandbits(rng.choice((32, 64, 256)))
+            paymaster_and_data = signed_paymaster_and_data(PAYMASTER_ADDRESS, TOKEN, exchange_rate)
+            self.assertEqual(
+                pre_verification_gas(op, paymaster_and_data),
+                calc_pre_verification_gas(sponsored(op, paymaster_and_data)),
+            )
+
+    def test_covers_signed_operation(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            op = random_operation(rng)
+            exchange_rate = rng.getrandbits(rng.choice((32, 64)))
+            signed = bytes(HexBytes(PAYMASTER_ADDRESS)) + build_paymaster_and_data(
+                TOKEN, 1, 0x64000000 + 180, 0, exchange_rate, rng.randbytes(65)
+            )
+            required = pre_verification_gas(
+                op, signed_paymaster_and_data(PAYMASTER_ADDRESS, TOKEN, exchange_rate)
+            )
+            bundler = calc_pre_verification_gas(sponsored(op, signed))
+            self.assertGreaterEqual(required, bundler)
+            self.assertLessEqual(required - bundler, MAX_OVERCOUNT)
+
+    def test_vector(self):
+        paymaster_and_data = signed_paymaster_and_data(PAYMASTER_ADDRESS, TOKEN, EXCHANGE_RATE)
+        op = vector_operation(callData=bytes.fromhex("b61d27f6") + b"\xab" * 196)
+        self.assertEqual(calc_pre_verification_gas(sponsored(op, paymaster_and_data)), 48340)
+        self.assertEqual(pre_verification_gas(op, paymaster_and_data), 48340)
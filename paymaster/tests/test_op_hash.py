@@ -0,0 +1,184 @@
+"""
+Differential tests of the local `CandidePaymaster.getHash` against a reference built from the
+`getHash` calldata, the way the contract reads it.
+"""
+import random
+
+from django.test import SimpleTestCase
+from eth_abi import encode
+from eth_utils import to_checksum_address
+from web3 import Web3
+
+from paymaster.abi import PAYMASTER_ABI
+from paymaster.decoder import UserOperation
+from paymaster.op_hash import get_paymaster_hash, pack_user_operation
+from paymaster.utils import fast_keccak
+
+PAYMASTER_ADDRESS = "0x7DdEFA2f027691116D0a7aa6418246622d70B12A"
+
+paymaster_contract = Web3().eth.contract(abi=PAYMASTER_ABI)
+
+
+def reference_pack(op: UserOperation, paymaster_data) -> bytes:
+    """
+    `CandidePaymaster.pack`: copies the `userOp` calldata up to the `paymasterAndData` length word
+    """
+    calldata = bytes.fromhex(
+        paymaster_contract.encodeABI(fn_name="getHash", args=[op.as_dict(), paymaster_data])[10:]
+    )
+    user_op = int.from_bytes(calldata[:32], "big")
+    paymaster_and_data = int.from_bytes(calldata[user_op + 9 * 32 : user_op + 10 * 32], "big")
+    return calldata[user_op : user_op + paymaster_and_data]
+
+
+def reference_hash(op: UserOperation, paymaster_data, chain_id: int, paymaster: str) -> bytes:
+    token, mode, valid_until, fee, exchange_rate = paymaster_data[:5]
+    return fast_keccak(
+        encode(
+            ["bytes", "uint256", "address", "address", "uint8", "uint48", "uint256", "uint256"],
+            [
+                reference_pack(op, paymaster_data),
+                chain_id,
+                paymaster,
+                token,
+                mode,
+                valid_until,
+                fee,
+                exchange_rate,
+            ],
+        )
+    )
+
+
+def random_address(rng: random.Random) -> str:
+    return to_checksum_address(rng.randbytes(20))
+
+
+def random_operation(rng: random.Random) -> UserOperation:
+    return UserOperation(
+        sender=random_address(rng),
+        nonce=rng.getrandbits(rng.choice((8, 64, 256))),
+        initCode=rng.randbytes(rng.choice((0, 1, 31, 32, 33, rng.randrange(300)))),
+        callData=rng.randbytes(rng.choice((0, 4, 68, rng.randrange(2000)))),
+        callGasLimit=rng.getrandbits(rng.choice((24, 256))),
+        verificationGasLimit=rng.getrandbits(rng.choice((24, 256))),
+        preVerificationGas=rng.getrandbits(rng.choice((24, 256))),
+        maxFeePerGas=rng.getrandbits(rng.choice((40, 256))),
+        maxPriorityFeePerGas=rng.getrandbits(rng.choice((40, 256))),
+        paymasterAndData=rng.randbytes(rng.choice((0, 20, 176, rng.randrange(300)))),
+        signature=rng.randbytes(rng.choice((0, 65, rng.randrange(200)))),
+    )
+
+
+def random_paymaster_data(rng: random.Random) -> list:
+    return [
+        random_address(rng),
+        rng.randrange(2),
+        rng.getrandbits(48),
+        rng.getrandbits(rng.choice((0, 64, 256))),
+        rng.getrandbits(rng.choice((32, 128, 256))),
+        b"",
+    ]
+
+
+def vector_operation(**fields) -> UserOperation:
+    return UserOperation(
+        **dict(
+            {
+                "sender": "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0",
+                "nonce": 0,
+                "initCode": b"",
+                "callData": b"",
+                "callGasLimit": 100000,
+                "verificationGasLimit": 200000,
+                "preVerificationGas": 50000,
+                "maxFeePerGas": 2 * 10**9,
+                "maxPriorityFeePerGas": 10**9,
+                "paymasterAndData": b"",
+                "signature": b"\x01" * 65,
+            },
+            **fields,
+        )
+    )
+
+
+TOKEN = "0x7F5c764cBc14f9669B88837ca1490cCa17c31607"
+
+# (operation, paymaster data, chainId, expected getHash), pinned so that a change of the packing
+# or of the encoded fields is caught even if the reference above changes with it. Hashes
+# returned by a deployed paymaster's `getHash` can be added here as they are recorded
+VECTORS = [
+    (
+        vector_operation(),
+        [TOKEN, 1, 0x64000000 + 180, 0, 1633079662, b""],
+        10,
+        "554b056a75943a0b641fc1a00425fe086b70e79a086a0f9e34b65028ebb24e9e",
+    ),
+    (
+        vector_operation(
+            nonce=7,
+            initCode=bytes.fromhex("9406cc6185a346906296840746125a0e44976454") + b"\x5f" * 88,
+            callData=bytes.fromhex("b61d27f6") + b"\x00" * 12 + b"\x11" * 20 + b"\x00" * 64,
+            paymasterAndData=b"\xff" * 176,
+        ),
+        [TOKEN, 0, 2**48 - 1, 10**6, 10**18, b"\x02" * 65],
+        420,
+        "5f8e4fa5f19b9dff292b223019c9f0e4e34882bfd539b9a3b70bed31478ca61d",
+    ),
+    (
+        vector_operation(
+            nonce=2**256 - 1,
+            callData=b"\xab" * 1000,
+            callGasLimit=2**256 - 1,
+            maxFeePerGas=2**256 - 1,
+            signature=b"",
+        ),
+        [TOKEN, 1, 0, 2**256 - 1, 2**256 - 1, b""],
+        1,
+        "c8db7afbe1001713b5c7d660d31e49cc446c8da824f57332544bd50b0a5c5d51",
+    ),
+]
+
+
+class PackUserOperationTestCase(SimpleTestCase):
+    def test_pack_matches_calldata(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            op = random_operation(rng)
+            paymaster_data = random_paymaster_data(rng)
+            self.assertEqual(pack_user_operation(op), reference_pack(op, paymaster_data))
+
+
+class PaymasterHashTestCase(SimpleTestCase):
+    def test_random_operations(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            op = random_operation(rng)
+            paymaster_data = random_paymaster_data(rng)
+            chain_id = rng.choice((1, 5, 10, 137, 420, 2**64))
+            self.assertEqual(
+                get_paymaster_hash(op, paymaster_data, chain_id, PAYMASTER_ADDRESS),
+                reference_hash(op, paymaster_data, chain_id, PAYMASTER_ADDRESS),
+            )
+
+    def test_vectors(self):
+        for op, paymaster_data, chain_id, expected in VECTORS:
+            with self.subTest(chain_id=chain_id):
+                self.assertEqual(
+                    reference_hash(op, paymaster_data, chain_id, PAYMASTER_ADDRESS).hex(),
+                    expected,
+                )
+                self.assertEqual(
+                    get_paymaster_hash(op, paymaster_data, chain_id, PAYMASTER_ADDRESS).hex(),
+                    expected,
+                )
+
+    def test_ignores_signatures(self):
+        op, paymaster_data, chain_id, _ = VECTORS[0]
+        signed = vector_operation(signature=b"\x03" * 65)
+        self.assertEqual(
+            get_paymaster_hash(op, paymaster_data, chain_id, PAYMASTER_ADDRESS),
+            get_paymaster_hash(
+                signed, paymaster_data[:5] + [b"\x04" * 65], chain_id, PAYMASTER_ADDRESS
+            ),
+        )
@@ -0,0 +1,159 @@
+"""
+Prices read from `exchangeRateSource` responses by each adapter, with and without `ijson`.
+"""
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from paymaster import price_sources
+from paymaster.price_sources import (
+    ResponseTooLarge,
+    async_read_prices,
+    read_prices,
+    token_path,
+    token_rate,
+)
+
+ADDRESS = "0x7F5c764cBc14f9669B88837ca1490cCa17c31607"
+COINGECKO = {
+    "address": ADDRESS,
+    "decimals": 6,
+    "exchangeRateSource": "https://api.coingecko.com/api/v3/simple/token_price/"
+    "optimistic-ethereum?contract_addresses=%s&vs_currencies=eth" % ADDRESS,
+}
+TOKEN_PRICE = {
+    "address": ADDRESS,
+    "decimals": 6,
+    "exchangeRateSource": "https://prices.test/tokens",
+    "exchangeRateAdapter": "tokenPrice",
+    "exchangeRatePath": "data.item.eth",
+}
+ETHER_PRICE = {
+    "address": ADDRESS,
+    "decimals": 6,
+    "exchangeRateSource": "https://prices.test/ether",
+    "exchangeRateAdapter": "etherPrice",
+    "exchangeRatePath": "data.rates.USDC",
+}
+
+
+def chunked(body: bytes, size: int = 7) -> list:
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+async def async_chunks(chunks: list):
+    for chunk in chunks:
+        yield chunk
+
+
+class PriceSourcesTestCase(SimpleTestCase):
+    def rate(self, token: dict, body: bytes, max_size: int = 1024 * 1024) -> int:
+        """
+        :return: rate read from `body` by the sync and async readers, which must agree
+        """
+        path = token_path(token)
+        prices = read_prices(chunked(body), [path], max_size=max_size)
+        async_prices = asyncio.run(
+            async_read_prices(async_chunks(chunked(body)), [path], max_size=max_size)
+        )
+        self.assertEqual(prices, async_prices)
+        return token_rate(token, prices)
+
+    def coingecko(self, price: str) -> bytes:
+        return ('{"%s": {"eth": %s, "usd": 1.0}}' % (ADDRESS.lower(), price)).encode()
+
+    def test_coingecko(self):
+        # 10**6 / 0.00061234 rounded up
+        self.assertEqual(self.rate(COINGECKO, self.coingecko("0.00061234")), 1633079662)
+        self.assertEqual(self.rate(COINGECKO, self.coingecko("6.1234e-4")), 1633079662)
+        self.assertEqual(self.rate(COINGECKO, self.coingecko("6.1234E-4")), 1633079662)
+        self.assertEqual(self.rate(COINGECKO, self.coingecko('"0.00061234"')), 1633079662)
+        self.assertEqual(self.rate(COINGECKO, self.coingecko("2")), 500000)
+
+    def test_coingecko_token_of_another_chain(self):
+        token = dict(
+            COINGECKO,
+            exchangeRateSource="https://api.coingecko.com/api/v3/simple/token_price/ethereum"
+            "?contract_addresses=0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2&vs_currencies=eth",
+        )
+        body = b'{"0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2": {"eth": 1}}'
+        self.assertEqual(self.rate(token, body), 10**6)
+
+    def test_token_price(self):
+        body = json.dumps({"data": [{"eth": "ignored"}, {"eth": 0.0005}]}).encode()
+        self.assertEqual(self.rate(TOKEN_PRICE, body), 2 * 10**9)
+        self.assertEqual(self.rate(TOKEN_PRICE, b'{"data": [{"eth": 3}]}'), 333334)
+        self.assertEqual(self.rate(TOKEN_PRICE, b'{"data": [{"eth": 5e-4}]}'), 2 * 10**9)
+
+    def test_ether_price(self):
+        self.assertEqual(
+            self.rate(ETHER_PRICE, b'{"data": {"rates": {"USDC": "1633.0795"}}}'), 1633079500
+        )
+        self.assertEqual(
+            self.rate(ETHER_PRICE, b'{"data": {"rates": {"USDC": 1.6330795e3}}}'), 1633079500
+        )
+        self.assertEqual(
+            self.rate(ETHER_PRICE, b'{"data": {"rates": {"USDC": 1633}}}'), 1633 * 10**6
+        )
+        # Rounded up
+        self.assertEqual(
+            self.rate(ETHER_PRICE, b'{"data": {"rates": {"USDC": 1633.0000001}}}'), 1633000001
+        )
+
+    def test_invalid_prices(self):
+        for price in ("0", "-1", '"-1e-4"'):
+            with self.subTest(price=price), self.assertRaisesMessage(ValueError, "Invalid"):
+                self.rate(COINGECKO, self.coingecko(price))
+        # Not read as prices
+        for price in ('"NaN"', '"Infinity"', '"-inf"', "1e999999999", '"1e-999999999"', "true"):
+            with self.subTest(price=price), self.assertRaisesMessage(ValueError, "No price"):
+                self.rate(COINGECKO, self.coingecko(price))
+
+    def test_missing_path(self):
+        with self.assertRaisesMessage(ValueError, "No price at %s.eth" % ADDRESS.lower()):
+            self.rate(COINGECKO, b'{"0x0000000000000000000000000000000000000001": {"eth": 1}}')
+        with self.assertRaisesMessage(ValueError, "No price at data.rates.USDC"):
+            self.rate(ETHER_PRICE, b'{"data": {"rates": {"USDC": null}}}')
+        token = {key: value for key, value in ETHER_PRICE.items() if key != "exchangeRatePath"}
+        with self.assertRaisesMessage(ValueError, "exchangeRatePath is required"):
+            token_path(token)
+
+    def test_malformed_bodies(self):
+        for body in (
+            b"<html><body>502 Bad Gateway</body></html>",
+            b'{"error": "rate limited"',
+            b"",
+        ):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                self.rate(COINGECKO, body)
+
+    def test_oversized_response(self):
+        body = b'{"padding": "%s", %s' % (b"x" * 1000, self.coingecko("0.00061234")[1:])
+        with self.assertRaises(ResponseTooLarge):
+            self.rate(COINGECKO, body, max_size=1000)
+        self.assertEqual(self.rate(COINGECKO, body, max_size=len(body)), 1633079662)
+
+    def test_reading_stops_at_the_price(self):
+        body = b'{"%s": {"eth": 0.00061234}, "padding": "%s"}' % (
+            ADDRESS.lower().encode(),
+            b"x" * 1000,
+        )
+        self.assertEqual(self.rate(COINGECKO, body, max_size=100), 1633079662)
+
+
+class WithoutIjsonTestCase(PriceSourcesTestCase):
+    def setUp(self):
+        patch = mock.patch.object(price_sources, "ijson", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_reading_stops_at_the_price(self):
+        # The whole body is loaded
+        body = b'{"%s": {"eth": 0.00061234}, "padding": "%s"}' % (
+            ADDRESS.lower().encode(),
+            b"x" * 1000,
+        )
+        with self.assertRaises(ResponseTooLarge):
+            self.rate(COINGECKO, body, max_size=100)
@@ -0,0 +1,119 @@
+"""
+GCRA throttling of the memory and SQLite backends.
+"""
+import os
+import tempfile
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+
+from paymaster import ratelimit
+from paymaster.ratelimit import MemoryBackend, RateLimit, SQLiteBackend, client_ip
+
+NOW = 1700000000.0
+INTERVAL = 0.5
+BURST = 3
+TOLERANCE = INTERVAL * (BURST - 1)
+
+
+class BackendTestMixin:
+    def create_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.create_backend()
+
+    def update(self, key: str, now: float) -> bool:
+        return self.backend.update(key, now, INTERVAL, TOLERANCE)
+
+    def test_burst_then_rate(self):
+        allowed = [self.update("a", NOW) for _ in range(BURST + 1)]
+        self.assertEqual(allowed, [True] * BURST + [False])
+        self.assertFalse(self.update("a", NOW + INTERVAL / 2))
+        self.assertTrue(self.update("a", NOW + INTERVAL))
+        self.assertFalse(self.update("a", NOW + INTERVAL))
+
+    def test_keys_are_independent(self):
+        for _ in range(BURST):
+            self.update("a", NOW)
+        self.assertFalse(self.update("a", NOW))
+        self.assertTrue(self.update("b", NOW))
+
+    def test_idle_key_gets_its_burst_back(self):
+        for _ in range(BURST):
+            self.update("a", NOW)
+        later = NOW + INTERVAL * BURST
+        allowed = [self.update("a", later) for _ in range(BURST + 1)]
+        self.assertEqual(allowed, [True] * BURST + [False])
+
+
+class MemoryBackendTestCase(BackendTestMixin, SimpleTestCase):
+    def create_backend(self):
+        return MemoryBackend(max_keys=100)
+
+    def test_least_recently_used_keys_are_dropped(self):
+        self.backend.max_keys = 2
+        for key in ("a", "b", "c"):
+            self.update(key, NOW)
+        self.assertEqual(len(self.backend), 2)
+        self.assertNotIn("a", self.backend._tats)
+
+    def test_expired_keys_are_dropped(self):
+        self.update("a", NOW)
+        self.update("b", NOW + 10)
+        self.assertEqual(len(self.backend), 1)
+
+    def test_no_keys(self):
+        self.backend.max_keys = 0
+        allowed = [self.update("a", NOW) for _ in range(BURST + 1)]
+        self.assertEqual(allowed, [True] * (BURST + 1))
+        self.assertEqual(len(self.backend), 0)
+
+
+class SQLiteBackendTestCase(BackendTestMixin, SimpleTestCase):
+    def create_backend(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "ratelimit.sqlite3")
+        return SQLiteBackend(self.path, timeout=5)
+
+    def test_shared_by_processes(self):
+        other = SQLiteBackend(self.path, timeout=5)
+        for _ in range(BURST):
+            self.update("a", NOW)
+        self.assertFalse(other.update("a", NOW, INTERVAL, TOLERANCE))
+
+    def test_expired_keys_are_purged(self):
+        self.backend.PURGE_EVERY = 2
+        self.update("a", NOW)
+        self.update("b", NOW + 10)
+        rows = self.backend._connection().execute("SELECT key FROM rate_limit").fetchall()
+        self.assertEqual(rows, [("b",)])
+
+
+class RateLimitTestCase(SimpleTestCase):
+    def test_disabled(self):
+        limit = RateLimit("test", 0, 1)
+        with mock.patch.object(ratelimit, "get_backend") as get_backend:
+            self.assertTrue(all(limit.allow("a") for _ in range(10)))
+        get_backend.assert_not_called()
+
+    def test_ip_limit_is_off_by_default(self):
+        if "ipRateLimit" in os.environ:
+            self.skipTest("ipRateLimit is set")
+        self.assertFalse(ratelimit.ip_rate_limit.enabled)
+
+    def test_counts(self):
+        limit = RateLimit("test", 1, 2)
+        with mock.patch.object(ratelimit, "get_backend", return_value=MemoryBackend(10)):
+            self.assertEqual([limit.allow("a") for _ in range(3)], [True, True, False])
+        self.assertEqual((limit.allowed, limit.throttled), (2, 1))
+
+    def test_client_ip(self):
+        request = RequestFactory().get(
+            "/", HTTP_X_FORWARDED_FOR="203.0.113.7, 10.0.0.1", REMOTE_ADDR="10.0.0.1"
+        )
+        with mock.patch.object(ratelimit, "CLIENT_IP_HEADER", None):
+            self.assertEqual(client_ip(request), "10.0.0.1")
+        with mock.patch.object(ratelimit, "CLIENT_IP_HEADER", "X-Forwarded-For"):
+            self.assertEqual(client_ip(request), "203.0.113.7")
@@ -0,0 +1,221 @@
+"""
+Exchange rate cache of the sync and asyncio endpoints.
+"""
+import asyncio
+import threading
+import warnings
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from paymaster.price_sources import parse_path
+from paymaster.rates import ExchangeRateCache, RateUnavailable
+
+NOW = 1000.0
+CHAIN_ID = "10"
+SOURCE = "https://prices.test/tokens"
+OTHER_SOURCE = "https://other.test/tokens"
+
+
+def price_token(address: str, symbol: str, source: str = SOURCE) -> dict:
+    return {
+        "address": address,
+        "decimals": 6,
+        "exchangeRateSource": source,
+        "exchangeRateAdapter": "tokenPrice",
+        "exchangeRatePath": "prices.%s.eth" % symbol,
+    }
+
+
+USDC = price_token("0x7F5c764cBc14f9669B88837ca1490cCa17c31607", "USDC")
+DAI = price_token("0xDA10009cBd5D07dd0CeCc66161FC93D7c9000da1", "DAI")
+OP = price_token("0x4200000000000000000000000000000000000042", "OP", OTHER_SOURCE)
+
+
+def create_cache() -> ExchangeRateCache:
+    return ExchangeRateCache(ttl=60, max_staleness=600, timeout=1)
+
+
+class StubSource:
+    """
+    `fetch_prices` answering the prices set by the tests, sources without prices are down
+    """
+
+    def __init__(self):
+        self.prices = {}
+        self.calls = []
+        self.blocked = set()
+        self.release = threading.Event()
+
+    def set_price(self, token: dict, price: str):
+        path = parse_path(token["exchangeRatePath"])
+        self.prices.setdefault(token["exchangeRateSource"], {})[path] = Decimal(price)
+
+    def __call__(self, url, paths, timeout):
+        paths = sorted(paths)
+        self.calls.append((url, paths))
+        if url in self.blocked:
+            self.release.wait(5)
+        if url not in self.prices:
+            raise requests.ConnectionError("%s is down" % url)
+        return {path: price for path, price in self.prices[url].items() if path in paths}
+
+
+class ExchangeRateCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = ExchangeRateCache(ttl=60, max_staleness=600, timeout=0.2)
+        # Refreshes are driven by the tests
+        self.cache._refresher = mock.Mock()
+        self.source = StubSource()
+        self.source.set_price(USDC, "0.0005")
+        self.source.set_price(DAI, "0.00025")
+        self.source.set_price(OP, "0.001")
+        fetch_prices = mock.patch("paymaster.rates.fetch_prices", self.source)
+        fetch_prices.start()
+        self.addCleanup(fetch_prices.stop)
+        monotonic = mock.patch("paymaster.rates.time.monotonic", return_value=NOW)
+        self.monotonic = monotonic.start()
+        self.addCleanup(monotonic.stop)
+        self.addCleanup(self.shutdown_executor)
+
+    def shutdown_executor(self):
+        if self.cache._executor is not None:
+            self.cache._executor.shutdown(wait=True)
+
+    def refresh_once(self):
+        # One pass of the refresher, its next wait stops it
+        self.cache._wakeup = mock.Mock(wait=mock.Mock(side_effect=[True, StopIteration]))
+        with self.assertRaises(StopIteration):
+            self.cache._run()
+
+    def test_miss_then_hit(self):
+        self.assertEqual(self.cache.get(CHAIN_ID, USDC), 2 * 10**9)
+        self.assertEqual(self.cache.get(CHAIN_ID, USDC), 2 * 10**9)
+        self.assertEqual(len(self.source.calls), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_rate_is_served_while_refreshed(self):
+        self.cache.get(CHAIN_ID, USDC)
+        self.source.set_price(USDC, "0.001")
+        self.monotonic.return_value = NOW + 61
+        self.assertEqual(self.cache.get(CHAIN_ID, USDC), 2 * 10**9)
+        self.assertEqual(self.cache.stale_hits, 1)
+        self.assertEqual(len(self.source.calls), 1)
+        self.assertTrue(self.cache._wakeup.is_set())
+
+        self.refresh_once()
+        self.assertEqual(self.cache.get(CHAIN_ID, USDC), 10**9)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_refused_past_max_staleness(self):
+        self.cache.get(CHAIN_ID, USDC)
+        self.monotonic.return_value = NOW + 600
+        self.cache.get(CHAIN_ID, USDC)
+        self.monotonic.return_value = NOW + 601
+        with self.assertRaises(RateUnavailable):
+            self.cache.get(CHAIN_ID, USDC)
+        self.assertEqual(self.cache.refused, 1)
+        # Fetched again by `get_many`, left out while the source is down
+        del self.source.prices[SOURCE]
+        self.assertEqual(self.cache.get_many(CHAIN_ID, [USDC, DAI]), {})
+
+    def test_source_down(self):
+        del self.source.prices[SOURCE]
+        with self.assertRaises(RateUnavailable):
+            self.cache.get(CHAIN_ID, USDC)
+        self.assertEqual(self.cache.refresh_errors, 1)
+
+    def test_refreshes_are_grouped_by_source(self):
+        for token in (USDC, DAI, OP):
+            self.cache.get(CHAIN_ID, token)
+        self.source.calls.clear()
+        self.source.set_price(DAI, "0.0005")
+        del self.source.prices[OTHER_SOURCE]
+
+        # Refreshed once half the TTL is gone
+        self.monotonic.return_value = NOW + 31
+        self.refresh_once()
+        self.assertEqual(
+            self.source.calls,
+            [
+                (SOURCE, [("prices", "DAI", "eth"), ("prices", "USDC", "eth")]),
+                (OTHER_SOURCE, [("prices", "OP", "eth")]),
+            ],
+        )
+        self.assertEqual(self.cache.get(CHAIN_ID, DAI), 2 * 10**9)
+        self.assertEqual(self.cache.refresh_errors, 1)
+
+        # The failed source is retried once per timeout
+        self.source.calls.clear()
+        self.refresh_once()
+        self.assertEqual(self.source.calls, [])
+        self.monotonic.return_value = NOW + 31.2
+        self.refresh_once()
+        self.assertEqual(self.source.calls, [(OTHER_SOURCE, [("prices", "OP", "eth")])])
+
+    def test_get_many_fetches_each_source_once(self):
+        quotes = self.cache.get_many(CHAIN_ID, [USDC, DAI, OP])
+        self.assertEqual(
+            quotes,
+            {
+                USDC["address"].lower(): (2 * 10**9, False),
+                DAI["address"].lower(): (4 * 10**9, False),
+                OP["address"].lower(): (10**9, False),
+            },
+        )
+        self.assertEqual(sorted(url for url, _ in self.source.calls), [OTHER_SOURCE, SOURCE])
+
+        self.monotonic.return_value = NOW + 61
+        quotes = self.cache.get_many(CHAIN_ID, [USDC])
+        self.assertEqual(quotes, {USDC["address"].lower(): (2 * 10**9, True)})
+        self.assertEqual(len(self.source.calls), 2)
+
+    def test_get_many_leaves_out_slow_sources(self):
+        self.source.blocked.add(OTHER_SOURCE)
+        self.addCleanup(self.source.release.set)
+
+        quotes = self.cache.get_many(CHAIN_ID, [USDC, OP])
+        self.assertEqual(quotes, {USDC["address"].lower(): (2 * 10**9, False)})
+        # The slow source is still stored once it answers
+        self.source.release.set()
+        self.shutdown_executor()
+        self.assertEqual(self.cache.get(CHAIN_ID, OP), 10**9)
+
+
+class SessionTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = create_cache()
+        self.addCleanup(self.cache.close)
+
+    def test_one_session_per_loop(self):
+        async def sessions():
+            return await self.cache._get_session(), await self.cache._get_session()
+
+        first, again = asyncio.run(sessions())
+        self.assertIs(first, again)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", ResourceWarning)
+            second, _ = asyncio.run(sessions())
+        self.assertIsNot(second, first)
+        # The session of the closed loop is closed with the new one
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        self.assertEqual(list(self.cache._sessions.values()), [second])
+
+        self.cache.close()
+        self.assertTrue(second.closed)
+        self.assertEqual(self.cache._sessions, {})
+
+    def test_close_sessions_of_running_loops(self):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        self.addCleanup(loop.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+
+        session = asyncio.run_coroutine_threadsafe(self.cache._get_session(), loop).result(5)
+        self.cache.close()
+        self.assertTrue(session.closed)
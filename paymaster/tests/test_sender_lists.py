@@ -0,0 +1,103 @@
+"""
+Sender lists index kept in step with changed, duplicated and deleted entries.
+"""
+from django.test import TestCase
+
+from paymaster.models import SenderListEntry
+from paymaster.sender_lists import SenderLists, sender_lists
+
+SENDER = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+OTHER_SENDER = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+CHAIN_ID = "10"
+OTHER_CHAIN_ID = "420"
+
+
+class SenderListsTestCase(TestCase):
+    bloom_filter = False
+
+    def setUp(self):
+        self.lists = SenderLists(
+            ttl=60, reload_interval=600, bloom_filter=self.bloom_filter, bloom_error_rate=0.001
+        )
+        # Saved entries are also applied to the lists of the process
+        self.addCleanup(sender_lists.invalidate)
+
+    def assertAllowed(self, address: str, chain_id: str = CHAIN_ID):
+        self.assertTrue(self.lists.is_allowed(chain_id, address))
+
+    def assertNotAllowed(self, address: str, chain_id: str = CHAIN_ID):
+        self.assertFalse(self.lists.is_allowed(chain_id, address))
+
+    def test_entry_moved_to_the_allowlist(self):
+        entry = SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY)
+        self.lists.load()
+        self.assertNotAllowed(SENDER)
+        self.assertAllowed(OTHER_SENDER)
+
+        entry.list = SenderListEntry.ALLOW
+        entry.save()
+        self.lists.apply(entry)
+        self.assertAllowed(SENDER)
+        self.assertNotAllowed(OTHER_SENDER)
+
+    def test_entry_moved_to_another_address(self):
+        entry = SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY)
+        self.lists.load()
+
+        entry.address = OTHER_SENDER
+        entry.save()
+        self.lists.apply(entry)
+        self.assertAllowed(SENDER)
+        self.assertNotAllowed(OTHER_SENDER)
+
+    def test_entry_moved_to_another_chain(self):
+        entry = SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY)
+        self.lists.load()
+        self.assertNotAllowed(SENDER, OTHER_CHAIN_ID)
+
+        entry.chainId = CHAIN_ID
+        entry.save()
+        self.lists.apply(entry)
+        self.assertNotAllowed(SENDER, CHAIN_ID)
+        self.assertAllowed(SENDER, OTHER_CHAIN_ID)
+
+    def test_duplicate_entries(self):
+        first, second = [
+            SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY)
+            for _ in range(2)
+        ]
+        self.lists.load()
+
+        # `delete()` clears the pk of the instance after the post_delete signal
+        SenderListEntry.objects.filter(pk=first.pk).delete()
+        self.lists.apply(first, deleted=True)
+        self.assertNotAllowed(SENDER)
+
+        second.enabled = False
+        second.save()
+        self.lists.apply(second)
+        self.assertAllowed(SENDER)
+
+    def test_changes_of_another_process(self):
+        entry = SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY)
+        SenderListEntry.objects.create(address=SENDER, list=SenderListEntry.DENY, chainId=CHAIN_ID)
+        self.lists.load()
+
+        entry.list = SenderListEntry.ALLOW
+        entry.save()
+        self.lists.load_changes()
+        # Still denied on CHAIN_ID by the second entry
+        self.assertNotAllowed(SENDER, CHAIN_ID)
+        self.assertAllowed(SENDER, OTHER_CHAIN_ID)
+        self.assertNotAllowed(OTHER_SENDER, OTHER_CHAIN_ID)
+
+        # Entries applied again by the next check are not counted twice
+        self.lists.load_changes()
+        entry.enabled = False
+        entry.save()
+        self.lists.load_changes()
+        self.assertAllowed(OTHER_SENDER, OTHER_CHAIN_ID)
+
+
+class BloomFilterSenderListsTestCase(SenderListsTestCase):
+    bloom_filter = True
@@ -0,0 +1,138 @@
+"""
+Signed `paymasterAndData` reused for retried sponsorship requests.
+"""
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from paymaster.budget import budget_ledger
+from paymaster.decoder import UserOperation
+from paymaster.management.commands.bench import BENCH_TOKEN
+from paymaster.models import ERC20ApprovedToken
+from paymaster.signature_cache import SignatureCache, signature_key, signature_cache
+from paymaster.tests.test_funds import StubNodeTestCase
+from paymaster.tests.test_op_hash import vector_operation
+from paymaster.token_registry import token_registry
+
+TOKEN = {"address": BENCH_TOKEN}
+NOW = 1000.0
+
+
+class SignatureKeyTestCase(SimpleTestCase):
+    def key(self, op: UserOperation, exchange_rate: int = 1633079662) -> tuple:
+        return signature_key("10", TOKEN, op, exchange_rate)
+
+    def test_fields_of_the_hash(self):
+        op = vector_operation()
+        self.assertEqual(self.key(op), self.key(vector_operation()))
+        # The signatures are not hashed, only the size of paymasterAndData is
+        self.assertEqual(self.key(op), self.key(vector_operation(signature=b"\x02" * 65)))
+        self.assertEqual(
+            self.key(vector_operation(paymasterAndData=b"\x01" * 176)),
+            self.key(vector_operation(paymasterAndData=b"\x02" * 176)),
+        )
+        for changed in (
+            vector_operation(nonce=1),
+            vector_operation(callData=b"\x01"),
+            vector_operation(initCode=b"\x01"),
+            vector_operation(maxFeePerGas=1),
+            vector_operation(paymasterAndData=b"\x01" * 176),
+        ):
+            self.assertNotEqual(self.key(op), self.key(changed))
+        self.assertNotEqual(self.key(op), self.key(op, exchange_rate=1))
+        self.assertNotEqual(self.key(op), signature_key("420", TOKEN, op, 1633079662))
+
+    def test_size_does_not_depend_on_the_operation(self):
+        key = self.key(vector_operation(callData=b"\x01" * 100000, initCode=b"\x02" * 10000))
+        self.assertEqual(key[:3], ("10", BENCH_TOKEN.lower(), 1633079662))
+        self.assertEqual(len(key[3]), 32)
+        self.assertEqual(len(key), 4)
+
+
+class SignatureCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = SignatureCache(ttl=30, margin=60, max_size=2)
+        monotonic = mock.patch("paymaster.signature_cache.time.monotonic", return_value=NOW)
+        self.monotonic = monotonic.start()
+        self.addCleanup(monotonic.stop)
+
+    def test_hit(self):
+        self.cache.put("a", 180, "0xsigned", b"hash")
+        self.assertEqual(self.cache.get("a"), ("0xsigned", b"hash"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        self.cache.put("a", 180, "0xsigned", b"hash")
+        self.monotonic.return_value = NOW + 29
+        self.assertIsNotNone(self.cache.get("a"))
+        self.monotonic.return_value = NOW + 30
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.expired, 1)
+
+    def test_valid_until_margin(self):
+        # validUntil 70 seconds away is kept 10 seconds, less than the TTL
+        self.cache.put("a", 70, "0xsigned", b"hash")
+        self.monotonic.return_value = NOW + 10
+        self.assertIsNone(self.cache.get("a"))
+        # Already within the margin
+        self.cache.put("b", 60, "0xsigned", b"hash")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.put("a", 180, "0xa", b"a")
+        self.cache.put("b", 180, "0xb", b"b")
+        self.cache.get("a")
+        self.cache.put("c", 180, "0xc", b"c")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_disabled(self):
+        cache = SignatureCache(ttl=0, margin=60, max_size=2)
+        cache.put("a", 180, "0xsigned", b"hash")
+        self.assertIsNone(cache.get("a"))
+
+
+class SponsorRetryTestCase(StubNodeTestCase):
+    chain_id = "31338"
+    token_settings = {"maxSenderSpend": 10**30}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Checkpoints would wait for the test transaction
+        writer = mock.patch.object(budget_ledger, "_writer")
+        writer.start()
+        cls.addClassCleanup(writer.stop)
+
+    def sender_spent(self, sender: str) -> int:
+        return budget_ledger._spent((self.chain_id, BENCH_TOKEN.lower(), sender.lower()), 0)
+
+    def test_retry_is_answered_from_the_cache(self):
+        op = self.operation()
+        first = self.sponsor(op)
+        hits = signature_cache.hits
+        self.assertEqual(self.sponsor(op), first)
+        self.assertEqual(signature_cache.hits, hits + 1)
+        self.assertNotEqual(self.sponsor(dict(op, callGasLimit="0x5209")), first)
+
+    def test_retry_costs_no_budget(self):
+        op = self.operation()
+        first = self.sponsor(op)
+        self.assertIn("result", first)
+        spent = self.sender_spent(op["sender"])
+        self.assertGreater(spent, 0)
+
+        # The budget is used up by the first operation
+        token = ERC20ApprovedToken.objects.get(name="T")
+        token.chains[self.chain_id]["maxSenderSpend"] = spent
+        token.save()
+        token_registry.invalidate()
+
+        self.assertEqual(self.sponsor(op), first)
+        self.assertEqual(self.sender_spent(op["sender"]), spent)
+        response = self.sponsor(self.operation())
+        self.assertEqual(response["error"]["code"], 10)
+        self.assertEqual(response["error"]["data"], "sender")
@@ -0,0 +1,48 @@
+"""
+Memoized checksum addresses against web3.
+"""
+import importlib
+import os
+import random
+from unittest import mock
+
+from django.test import SimpleTestCase
+from web3 import Web3
+
+from paymaster import utils
+from paymaster.utils import fast_is_checksum_address, fast_to_checksum_address
+
+
+class ChecksumAddressTestCase(SimpleTestCase):
+    def test_matches_web3(self):
+        rng = random.Random(5)
+        for _ in range(500):
+            address = rng.randbytes(20)
+            expected = Web3.to_checksum_address(address)
+            for value in (address, "0x" + address.hex(), "0x" + address.hex().upper()):
+                self.assertEqual(fast_to_checksum_address(value), expected)
+            self.assertTrue(fast_is_checksum_address(expected))
+            lowercase = expected.lower()
+            self.assertEqual(
+                fast_is_checksum_address(lowercase), Web3.is_checksum_address(lowercase)
+            )
+
+    def test_invalid_addresses(self):
+        for value in ("0x1234", "0x" + "zz" * 20, "", 1):
+            with self.subTest(value=value):
+                self.assertFalse(fast_is_checksum_address(value))
+
+    def test_cache_size_setting(self):
+        # `fast_to_checksum_address` is memoized with the size read when the module is loaded
+        self.addCleanup(importlib.reload, utils)
+        with mock.patch.dict(os.environ, {"checksumCacheSize": "2"}):
+            importlib.reload(utils)
+
+        addresses = ["0x%040x" % i for i in range(2, 5)]
+        for address in addresses + addresses[-1:]:
+            utils.fast_to_checksum_address(address)
+        info = utils.checksum_cache_info()
+        self.assertEqual(info["max_size"], 2)
+        self.assertEqual(info["size"], 2)
+        self.assertEqual((info["hits"], info["misses"]), (1, 3))
+        self.assertEqual(info["hit_rate"], 0.25)
@@ -0,0 +1,82 @@
+"""
+In-memory index of `ERC20ApprovedToken.chains`, keyed by chainId and lowercase token address.
+
+The index is rebuilt after an `ERC20ApprovedToken` is saved or deleted in this process and
+every `tokenRegistryTTL` seconds, so changes made by other processes are picked up as well.
+Only the first load is waited for, later reloads are done by one request while the others keep
+reading the previous index.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+import environ
+from asgiref.sync import sync_to_async
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .background import reload_if_due
+from .models import ERC20ApprovedToken
+
+env = environ.Env()
+
+
+class TokenRegistry:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._tokens: Dict[str, Dict[str, dict]] = {}
+        self._loaded_at = float("-inf")
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        tokens: Dict[str, Dict[str, dict]] = {}
+        for name, chains in ERC20ApprovedToken.objects.order_by("pk").values_list(
+            "name", "chains"
+        ):
+            for chain_id, token in chains.items():
+                tokens.setdefault(chain_id, {})[token["address"].lower()] = dict(
+                    token, name=name
+                )
+        self._tokens = tokens
+        self._loaded_at = time.monotonic()
+        self._loaded = True
+
+    def invalidate(self):
+        self._loaded_at = float("-inf")
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def get(self, chain_id: str, address: str) -> Optional[dict]:
+        """
+        :return: token config of `address` on `chain_id`, `None` if it is not approved
+        """
+        self._ensure_loaded()
+        return self._tokens.get(chain_id, {}).get(address.lower())
+
+    def tokens(self, chain_id: str) -> List[dict]:
+        """
+        :return: configs of every approved token on `chain_id`
+        """
+        self._ensure_loaded()
+        return list(self._tokens.get(chain_id, {}).values())
+
+    async def async_refresh(self):
+        """
+        Reloads a stale registry from the event loop, so `get` and `tokens` do not query the db
+        """
+        if self.is_stale():
+            await sync_to_async(self._ensure_loaded)()
+
+    def _ensure_loaded(self):
+        reload_if_due(self._lock, self._loaded, self.is_stale, self.load)
+
+
+token_registry = TokenRegistry(ttl=env.float("tokenRegistryTTL", default=60))
+
+
+@receiver(post_save, sender=ERC20ApprovedToken)
+@receiver(post_delete, sender=ERC20ApprovedToken)
+def invalidate_token_registry(sender, **kwargs):
+    token_registry.invalidate()
@@ -17,10 +17,12 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from paymaster import paymaster
+from paymaster import paymaster, async_paymaster, metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
 
-    path("paymaster", paymaster.jsonrpc),
+    path("paymaster", async_paymaster.jsonrpc if settings.ASYNC_RPC else paymaster.jsonrpc),
+    path("paymaster/<int:chain_id>", async_paymaster.jsonrpc if settings.ASYNC_RPC else paymaster.jsonrpc),
+    path("metrics", metrics.metrics),
 ]+ static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
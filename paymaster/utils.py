@@ -1,9 +1,16 @@
-from typing import Union
+from functools import lru_cache
+from typing import Dict, Union
+import environ
 from eth_typing import AnyAddress, ChecksumAddress, HexStr
 from eth_utils import to_normalized_address
 from sha3 import keccak_256
 from django.core.exceptions import ValidationError
 
+env = environ.Env()
+
+# Keccak hex digits of the address hash that uppercase the matching address char (EIP-55)
+UPPERCASE_NIBBLES = frozenset("89abcdef")
+
 
 def validate_checksumed_address(address):
     if not fast_is_checksum_address(address):
@@ -13,6 +20,15 @@ def validate_checksumed_address(address):
         )
 
 
+def fast_keccak(value: bytes) -> bytes:
+    """
+    Calculates ethereum keccak256 using fast library `pysha3`
+    :param value:
+    :return: Keccak256 used by ethereum as `bytes`
+    """
+    return keccak_256(value).digest()
+
+
 def fast_keccak_hex(value: bytes) -> HexStr:
     """
     Same as `fast_keccak`, but it's a little more optimal calling `hexdigest()`
@@ -37,9 +53,11 @@ def fast_is_checksum_address(value: Union[AnyAddress, str, bytes]) -> bool:
         return False
 
 
+@lru_cache(maxsize=env.int("checksumCacheSize", default=65536))
 def fast_to_checksum_address(value: Union[AnyAddress, str, bytes]) -> ChecksumAddress:
     """
-    Converts to checksum_address. Uses more optimal `pysha3` instead of `eth_utils` for keccak256 calculation
+    Converts to checksum_address. Uses more optimal `pysha3` instead of `eth_utils` for keccak256 calculation.
+    Results are memoized, as the same senders and tokens are checked again and again
     :param value:
     :return:
     """
@@ -48,6 +66,21 @@ def fast_to_checksum_address(value: Union[AnyAddress, str, bytes]) -> ChecksumAd
     return _build_checksum_address(norm_address, address_hash)
 
 
+def checksum_cache_info() -> Dict[str, float]:
+    """
+    :return: hit and miss counters of the `fast_to_checksum_address` cache
+    """
+    info = fast_to_checksum_address.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": info.hits / lookups if lookups else 0,
+    }
+
+
 def _build_checksum_address(
     norm_address: HexStr, address_hash: HexStr
 ) -> ChecksumAddress:
@@ -59,14 +92,10 @@ def _build_checksum_address(
     """
     return ChecksumAddress(
         "0x"
-        + (
-            "".join(
-                (
-                    norm_address[i].upper()
-                    if int(address_hash[i], 16) > 7
-                    else norm_address[i]
-                )
-                for i in range(0, 40)
-            )
+        + "".join(
+            [
+                char.upper() if nibble in UPPERCASE_NIBBLES else char
+                for char, nibble in zip(norm_address, address_hash)
+            ]
         )
     )
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Process wide `Web3` clients, one per chain.
+
+Clients are created lazily on first use and shared by every thread of the worker, so the
+gunicorn WSGI workers and the ASGI thread pool reuse the same keep-alive connections.
+"""
+import os
+import threading
+from typing import Dict
+
+import aiohttp
+import environ
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
+from web3.middleware import async_geth_poa_middleware, geth_poa_middleware
+from web3.providers.rpc import HTTPProvider
+
+from .abi import PAYMASTER_ABI
+from .chains import chain_env
+
+env = environ.Env()
+
+# Chains that need the geth POA middleware
+POA_CHAIN_IDS = set(env.list("POAChainIds", default=["10"]))
+
+
+class PooledHTTPProvider(HTTPProvider):
+    """
+    `HTTPProvider` sending every request through one `requests.Session` with a bounded
+    keep-alive connection pool. `HTTPProvider` caches a session per thread, which opens a new
+    connection for every thread that talks to the node.
+    """
+
+    def __init__(self, endpoint_uri: str, pool_size: int, timeout: float, **kwargs):
+        super().__init__(endpoint_uri, **kwargs)
+        self.timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        request_kwargs = self.get_request_kwargs()
+        request_kwargs.setdefault("timeout", self.timeout)
+        response = self.session.post(
+            self.endpoint_uri, data=request_data, **request_kwargs
+        )
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: number of HTTP requests sent, connections opened and requests that reused an
+            already open connection
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = 0
+        requests_sent = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": requests_sent - connections,
+        }
+
+
+class Web3Client:
+    """
+    `Web3` instance of a chain with its prebuilt paymaster contract
+    """
+
+    def __init__(self, chain_id: str, endpoint_uri: str, paymaster_address: str):
+        self.chain_id = chain_id
+        self.provider = PooledHTTPProvider(
+            endpoint_uri,
+            pool_size=env.int("HTTPProviderPoolSize", default=10),
+            timeout=env.float("HTTPProviderTimeout", default=10),
+        )
+        self.w3 = Web3(self.provider)
+        if chain_id in POA_CHAIN_IDS:
+            self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        self.paymaster = self.w3.eth.contract(
+            address=paymaster_address, abi=PAYMASTER_ABI
+        )
+
+
+class AsyncWeb3Client:
+    """
+    `AsyncWeb3` instance of a chain, used by the ASGI JSON-RPC endpoint. web3 keeps one
+    keep-alive `aiohttp` session per endpoint for the event loop thread.
+    """
+
+    def __init__(self, chain_id: str, endpoint_uri: str):
+        self.chain_id = chain_id
+        self.provider = AsyncHTTPProvider(
+            endpoint_uri,
+            request_kwargs={
+                "timeout": aiohttp.ClientTimeout(
+                    total=env.float("HTTPProviderTimeout", default=10)
+                )
+            },
+        )
+        self.w3 = AsyncWeb3(self.provider)
+        if chain_id in POA_CHAIN_IDS:
+            self.w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+
+
+_clients: Dict[str, Web3Client] = {}
+_async_clients: Dict[str, AsyncWeb3Client] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(chain_id: str) -> Web3Client:
+    client = _clients.get(chain_id)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(chain_id)
+            if client is None:
+                client = Web3Client(
+                    chain_id,
+                    chain_env("HTTPProvider", chain_id),
+                    chain_env("paymaster_add", chain_id),
+                )
+                _clients[chain_id] = client
+    return client
+
+
+def get_async_client(chain_id: str) -> AsyncWeb3Client:
+    client = _async_clients.get(chain_id)
+    if client is None:
+        with _clients_lock:
+            client = _async_clients.get(chain_id)
+            if client is None:
+                client = AsyncWeb3Client(chain_id, chain_env("HTTPProvider", chain_id))
+                _async_clients[chain_id] = client
+    return client
+
+
+def get_pool_stats() -> Dict[str, Dict[str, int]]:
+    return {
+        chain_id: client.provider.get_stats() for chain_id, client in _clients.items()
+    }
+
+
+def _clear_clients():
+    _clients.clear()
+    _async_clients.clear()
+
+
+# Connections must not be shared with processes forked after the clients were created
+# (e.g. gunicorn `--preload`)
+os.register_at_fork(after_in_child=_clear_clients)
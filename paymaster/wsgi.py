@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "paymaster.settings")
 
 application = get_wsgi_application()
+
+# Load the approved tokens before serving the first request
+from paymaster.token_registry import token_registry  # noqa: E402
+
+token_registry.load()